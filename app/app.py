@@ -1,18 +1,21 @@
+import sys
+from pathlib import Path
+
 import streamlit as st
-from pages.home import home_page
-from pages.initiative import initiative_page
-from pages.beneficiaries import beneficiaries_page
-from pages.regression_analysis import regression_analysis_page
-from pages.etude_de_cas import etude_de_cas_page
-from pages.data_processing import data_processing_page
 
-# Définir les pages
-home = st.Page(home_page, title="Home", icon="🏠")
-initiative = st.Page(initiative_page, title="L'Initiative", icon="💡")
-beneficiaries = st.Page(beneficiaries_page, title="Bénéficiaires", icon="🗺️")
-etude_de_cas = st.Page(etude_de_cas_page, title="Étude de cas", icon="🔍")
-regression_analysis = st.Page(regression_analysis_page, title="Analyse de régression", icon="📊")
-data_processing = st.Page(data_processing_page, title="Traitement des données", icon="🛠️")
+# Rendre le dossier scripts/ importable depuis les pages
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from navigation import lazy_page, profiling_mode
+
+# Définir les pages : chaque module (et ses dépendances lourdes) n'est importé
+# qu'à la première ouverture de la page
+home = st.Page(lazy_page("pages.home", "home_page"), title="Home", icon="🏠")
+initiative = st.Page(lazy_page("pages.initiative", "initiative_page"), title="L'Initiative", icon="💡")
+beneficiaries = st.Page(lazy_page("pages.beneficiaries", "beneficiaries_page"), title="Bénéficiaires", icon="🗺️")
+etude_de_cas = st.Page(lazy_page("pages.etude_de_cas", "etude_de_cas_page"), title="Étude de cas", icon="🔍")
+regression_analysis = st.Page(lazy_page("pages.regression_analysis", "regression_analysis_page"), title="Analyse de régression", icon="📊")
+data_processing = st.Page(lazy_page("pages.data_processing", "data_processing_page"), title="Traitement des données", icon="🛠️")
 
 
 
@@ -22,5 +25,13 @@ pg = st.navigation([home, initiative, beneficiaries, etude_de_cas, regression_an
 # Configurer l'application
 st.set_page_config(page_title="Projet Data Science", page_icon="📈")
 
-# Exécuter la page sélectionnée
-pg.run()
+# Exécuter la page sélectionnée ; avec ?profile=1 dans l'URL, la barre latérale
+# détaille la durée de chaque étape de la relance (module de diagnostic importé
+# seulement dans ce cas)
+if profiling_mode() is None:
+    pg.run()
+else:
+    from components.debug import rerun_diagnostics
+
+    with rerun_diagnostics(pg.title):
+        pg.run()
@@ -0,0 +1,64 @@
+"""
+Résultats calculés en arrière-plan (scripts/jobs.py).
+
+background_result() renvoie le résultat d'un calcul s'il est prêt. Sinon, il
+lance le calcul (une seule fois pour toutes les sessions), affiche à sa place
+une barre de progression dans un fragment qui se rafraîchit seul, et renvoie
+None : le reste de la page, le texte notamment, s'affiche sans attendre. À la
+fin du calcul, le fragment relance la page, qui trouve alors le résultat.
+
+tables_ready() fait de même pour les tables de scripts/preprocess.py : une
+table absente ou périmée est reconstruite en arrière-plan plutôt que pendant
+l'exécution de la page.
+"""
+import streamlit as st
+
+from scripts.jobs import get, report_progress, submit
+from scripts.preprocess import TABLES, ensure_table, is_fresh
+from scripts.utils import file_version
+
+# Intervalle de rafraîchissement des barres de progression
+POLL_SECONDS = 0.5
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def job_progress(key):
+    """Barre de progression du calcul `key` ; relance la page quand il est terminé."""
+    job = get(key)
+    if job is None or job.done():
+        st.rerun()
+    text = f"{job.label} : {job.message}…" if job.message else f"{job.label}…"
+    st.progress(job.progress, text=text)
+
+
+def background_result(key, function, *args, label, **kwargs):
+    """Résultat de function(*args, **kwargs) calculé en arrière-plan sous `key`, ou None s'il n'est pas prêt."""
+    job = submit(key, function, *args, label=label, **kwargs)
+    if job.done():
+        # Lève l'exception d'un calcul échoué ; il sera relancé à la prochaine relance
+        return job.result()
+    job_progress(key)
+    return None
+
+
+def _build_tables(names):
+    for count, name in enumerate(names):
+        report_progress(count / len(names), name)
+        ensure_table(name)
+    return names
+
+
+def tables_ready(*names):
+    """Vrai si les tables `names` sont à jour ; sinon les reconstruit en arrière-plan et renvoie False."""
+    stale = tuple(name for name in names if not is_fresh(name))
+    if not stale:
+        return True
+    key = ("préparation des tables", tuple((name, file_version(TABLES[name][0])) for name in stale))
+    job = submit(key, _build_tables, stale, label="Préparation des données")
+    if job.done():
+        job.result()
+        return True
+    st.info("Les données préparées sont absentes ou périmées : elles sont reconstruites, une seule fois. "
+            "Lancez `python -m scripts.preprocess` avant de démarrer l'application pour éviter cette attente.")
+    job_progress(key)
+    return False
@@ -0,0 +1,97 @@
+"""
+Panneau de diagnostic des relances.
+
+Désactivé par défaut : il s'active pour une session en ajoutant ?profile=1 à
+l'URL, ou pour toutes avec PROJET_DATA_PROFILE=1. La barre latérale affiche
+alors la durée et la variation de mémoire de chaque étape de la relance
+(import, chargement, transformation, ajustement, rendu) marquée par
+scripts.instrumentation.stage(). Avec ?profile=cprofile ou
+?profile=pyinstrument, la relance est aussi profilée et la trace proposée au
+téléchargement. PROJET_DATA_METRICS exporte chaque relance dans un fichier.
+"""
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from navigation import profiling_mode
+from scripts.instrumentation import record_run
+from scripts.utils import cache_info
+
+KIND_LABELS = {
+    "import": "Import",
+    "load": "Chargement",
+    "transform": "Transformation",
+    "fit": "Ajustement",
+    "render": "Rendu",
+}
+
+
+def _mebibytes(value):
+    return None if value is None else round(value / 1024 ** 2, 1)
+
+
+def debug_panel(run, cache_before=None):
+    """Affiche dans la barre latérale les étapes de la relance `run` (un RunRecord)."""
+    with st.sidebar.expander("Diagnostic de la relance", expanded=True):
+        left, right = st.columns(2)
+        left.metric("Durée", f"{run.seconds:.3f} s")
+        if run.rss_delta is not None:
+            right.metric("Mémoire", f"{run.rss_delta / 1024 ** 2:+.1f} Mo")
+        if run.error:
+            st.caption(f"Relance interrompue par {run.error}.")
+
+        totals = run.totals()
+        if totals:
+            st.dataframe(
+                pd.DataFrame({
+                    "Type": [KIND_LABELS.get(kind, kind) for kind in totals],
+                    "Durée (s)": [round(seconds, 4) for seconds in totals.values()],
+                }).sort_values("Durée (s)", ascending=False),
+                hide_index=True,
+            )
+            # Étapes dans l'ordre d'exécution, indentées selon leur imbrication
+            st.dataframe(
+                pd.DataFrame({
+                    "Étape": ["· " * record.depth + record.name for record in run.stages],
+                    "Type": [KIND_LABELS.get(record.kind, record.kind) for record in run.stages],
+                    "Durée (s)": [round(record.seconds, 4) for record in run.stages],
+                    "Propre (s)": [round(seconds, 4) for seconds in run.self_seconds()],
+                    "Mémoire (Mo)": [_mebibytes(record.rss_delta) for record in run.stages],
+                }),
+                hide_index=True,
+            )
+        else:
+            st.caption("Aucune étape coûteuse : tout venait des caches.")
+
+        cache = cache_info()
+        if cache_before is not None:
+            st.caption(f"Cache des tables : {cache['hits'] - cache_before['hits']} lectures servies, "
+                       f"{cache['misses'] - cache_before['misses']} manquées ; "
+                       f"{cache['entries']} entrées, {_mebibytes(cache['bytes'])} Mo.")
+
+        if run.profile_path is not None:
+            st.download_button(
+                "Télécharger la trace du profileur",
+                data=run.profile_path.read_bytes(),
+                file_name=run.profile_path.name,
+            )
+            st.caption(f"Trace enregistrée dans {run.profile_path}")
+
+
+@contextmanager
+def rerun_diagnostics(label):
+    """Enregistre les étapes du bloc et affiche le panneau si le diagnostic est activé."""
+    mode = profiling_mode()
+    if mode is None:
+        yield None
+        return
+    cache_before = cache_info()
+    run = None
+    try:
+        with record_run(label, profiler=None if mode == "timings" else mode) as run:
+            yield run
+    finally:
+        # Aussi après st.stop() : le panneau explique où la relance s'est arrêtée
+        if run is not None:
+            debug_panel(run, cache_before)
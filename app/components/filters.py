@@ -0,0 +1,96 @@
+"""
+Filtres des communes par région, grille de densité, aire d'attraction et statut PVD.
+
+Chaque valeur de chaque dimension a son bitmap (un bit par ligne de la table,
+compacté avec np.packbits), calculé une fois par version des tables et partagé
+entre les sessions. Appliquer des filtres revient à un OU entre les valeurs
+choisies d'une dimension puis à un ET entre les dimensions, sur quelques
+kilo-octets par valeur, sans masque pandas.
+"""
+import numpy as np
+import streamlit as st
+
+from scripts.comparison import GROUPINGS, commune_groups
+from scripts.queries import CODE_COLUMNS, commune_attributes, pvd_table
+from scripts.utils import cached_derived, file_version, table_path
+
+# Dimensions proposées : clé -> libellé du filtre
+DIMENSIONS = {
+    "region": GROUPINGS["region"],
+    "gcd": GROUPINGS["gcd"],
+    "aav": GROUPINGS["aav"],
+    "pvd": "Petites Villes de Demain",
+}
+MISSING_LABEL = "Non renseigné"
+PVD_LABELS = {True: "Commune PVD", False: "Hors PVD"}
+
+
+def build_filter_index(frame, table):
+    """{"nrows", "dimensions": {dimension: {valeur: bitmap compacté}}} pour les lignes de `frame`."""
+    codes = frame[CODE_COLUMNS[table]].astype(str)
+    groups = commune_groups(codes)
+    columns = {name: groups[name].to_numpy() for name in ("region", "gcd", "aav")}
+    columns["pvd"] = commune_attributes(table)["pvd"].map(PVD_LABELS).to_numpy()
+
+    dimensions = {}
+    for dimension in DIMENSIONS:
+        values = np.where(columns[dimension] == "", MISSING_LABEL, columns[dimension]).astype(str)
+        names, codes_of_rows = np.unique(values, return_inverse=True)
+        # Une ligne de bits par valeur, construite en une seule comparaison
+        bits = codes_of_rows[None, :] == np.arange(len(names))[:, None]
+        packed = np.packbits(bits, axis=1)
+        dimensions[dimension] = {name: packed[i] for i, name in enumerate(names.tolist())}
+    return {"nrows": len(frame), "dimensions": dimensions}
+
+
+def filter_index(table="etude_2_cas"):
+    """Index bitmap de `table`, reconstruit quand une des tables sources change."""
+    versions = (
+        file_version(table_path("final_filtered_data_sample")),
+        pvd_table(),
+        file_version(table_path(pvd_table())),
+    )
+    return cached_derived(table, ("filter_index", versions), lambda frame: build_filter_index(frame, table))
+
+
+def combine(index, selections):
+    """
+    Bitmap compacté des lignes retenues par `selections` ({dimension: [valeurs]}) :
+    OU entre les valeurs d'une dimension, ET entre les dimensions. None si aucun filtre.
+    """
+    packed = None
+    for dimension, values in selections.items():
+        bitmaps = index["dimensions"][dimension]
+        values = [value for value in values if value in bitmaps]
+        if not values:
+            continue
+        chosen = np.bitwise_or.reduce([bitmaps[value] for value in values])
+        packed = chosen if packed is None else packed & chosen
+    return packed
+
+
+def filter_mask(index, selections):
+    """Masque booléen des lignes retenues (toutes si aucun filtre)."""
+    packed = combine(index, selections)
+    if packed is None:
+        return np.ones(index["nrows"], dtype=bool)
+    return np.unpackbits(packed, count=index["nrows"]).view(bool)
+
+
+def commune_filters(table="etude_2_cas", dimensions=tuple(DIMENSIONS), key="filtres", container=None):
+    """
+    Affiche un filtre par dimension de `dimensions` (dans la barre latérale par
+    défaut) et renvoie (sélections, masque booléen des lignes de `table` retenues).
+    """
+    container = container or st.sidebar
+    index = filter_index(table)
+    container.header("Filtres")
+    selections = {}
+    for dimension in dimensions:
+        options = list(index["dimensions"][dimension])
+        selections[dimension] = container.multiselect(DIMENSIONS[dimension], options=options, key=f"{key}_{dimension}")
+
+    mask = filter_mask(index, selections)
+    if any(selections.values()):
+        container.caption(f"{int(mask.sum())} communes retenues sur {index['nrows']}")
+    return selections, mask
@@ -0,0 +1,107 @@
+"""
+Graphiques Plotly partagés entre les pages.
+
+Les figures sont construites une fois pour des données et un titre donnés puis
+mises en cache (st.cache_data) : chaque appel en reçoit une copie, qu'il peut
+modifier sans toucher à celle des autres sessions. Les nuages de points
+choisissent leur rendu selon le nombre de points : SVG pour quelques milliers,
+WebGL (scattergl) au-delà, puis une carte de densité calculée côté serveur pour
+les dizaines de milliers de communes, afin de n'envoyer que les cases et non
+chaque point.
+"""
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+PALETTE = px.colors.qualitative.Set2
+
+# Seuils de rendu des nuages de points
+SVG_MAX_POINTS = 2000
+WEBGL_MAX_POINTS = 20000
+DENSITY_BINS = 80
+
+
+def configure_pie_chart(fig):
+    fig.update_traces(
+        textinfo="value",
+        textfont_size=16,
+        marker=dict(line=dict(color='#000000', width=1))
+    )
+    fig.update_layout(
+        legend_font_size=12,
+        height=500,
+        width=500,
+    )
+    return fig
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def pie_chart(names, values, title):
+    """Diagramme circulaire des parts `values` (tuples) nommées `names`."""
+    fig = px.pie(
+        names=list(names),
+        values=list(values),
+        title=title,
+        color_discrete_sequence=PALETTE
+    )
+    return configure_pie_chart(fig)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def bar_chart(categories, values, title, x_label, y_label):
+    """Diagramme en barres d'une valeur par catégorie (tuples)."""
+    fig = px.bar(
+        x=list(categories),
+        y=list(values),
+        labels={"x": x_label, "y": y_label},
+        title=title,
+        text_auto=True,
+        color_discrete_sequence=PALETTE
+    )
+    fig.update_traces(width=0.4)
+    return fig
+
+
+def _density_trace(x, y, bins):
+    # Comptage par case côté serveur : seules les cases non vides sont colorées
+    valid = np.isfinite(x) & np.isfinite(y)
+    counts, x_edges, y_edges = np.histogram2d(x[valid], y[valid], bins=bins)
+    counts = np.where(counts > 0, counts, np.nan)
+    return go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=counts.T,
+        colorscale="Blues",
+        colorbar=dict(title="Communes"),
+        hovertemplate="%{x:.3g}, %{y:.3g} : %{z} communes<extra></extra>",
+    )
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def scatter_chart(x, y, title, x_label, y_label, highlight=None, highlight_labels=None):
+    """
+    Nuage des points (x, y) (tableaux numpy), avec éventuellement des points mis
+    en avant (`highlight` : positions dans x et y, légendées par `highlight_labels`).
+    Le rendu dépend du nombre de points : SVG, WebGL ou densité par cases.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    fig = go.Figure()
+    if len(x) > WEBGL_MAX_POINTS:
+        fig.add_trace(_density_trace(x, y, DENSITY_BINS))
+    else:
+        trace = go.Scatter if len(x) <= SVG_MAX_POINTS else go.Scattergl
+        fig.add_trace(trace(x=x, y=y, mode="markers", marker=dict(color=PALETTE[0], opacity=0.6, size=5),
+                            name="Communes", hoverinfo="skip" if len(x) > SVG_MAX_POINTS else None))
+    if highlight is not None and len(highlight):
+        highlight = np.asarray(highlight)
+        fig.add_trace(go.Scatter(
+            x=x[highlight], y=y[highlight], mode="markers+text",
+            text=list(highlight_labels) if highlight_labels is not None else None,
+            textposition="top center",
+            marker=dict(color=PALETTE[1], size=12, line=dict(color="#000000", width=1)),
+            name="Communes sélectionnées",
+        ))
+    fig.update_layout(title=title, xaxis_title=x_label, yaxis_title=y_label, showlegend=False)
+    return fig
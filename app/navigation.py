@@ -0,0 +1,91 @@
+"""
+Lazy registration of the pages of the app.
+
+A page module, and the heavy libraries it imports (statsmodels, matplotlib,
+plotly, folium...), is only imported the first time the page is opened. Each
+first import is timed and logged; set PROJET_DATA_IMPORT_REPORT to a file path
+to also append the measurements there as JSON lines, e.g. to follow the cold
+start of autoscaled containers. `python -X importtime` gives the detail of a
+single import.
+
+profiling_mode() tells whether the rerun diagnostics of components/debug.py
+are on, so that app.py only imports that module (and pandas) when they are.
+"""
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import streamlit as st
+
+from scripts.instrumentation import PROFILERS, stage
+
+logger = logging.getLogger(__name__)
+
+# module name -> {"seconds": ..., "new_modules": ...}, filled on first import
+IMPORT_REPORT = {}
+_import_lock = threading.Lock()
+# Modules whose import has finished: sys.modules also holds the ones being imported
+_imported = set()
+
+# Values of ?profile= and PROJET_DATA_PROFILE that leave the diagnostics off
+DISABLED_VALUES = ("", "0", "false", "off", "non")
+
+
+def import_page(module_name):
+    """Import a page module, timing it the first time."""
+    if module_name in _imported:
+        return sys.modules[module_name]
+    with _import_lock:
+        if module_name in _imported:
+            return sys.modules[module_name]
+        if module_name in sys.modules:
+            # Imported elsewhere (possibly still running): import_module waits for it to finish
+            module = importlib.import_module(module_name)
+            _imported.add(module_name)
+            return module
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        with stage(f"import {module_name}", "import"):
+            module = importlib.import_module(module_name)
+        _imported.add(module_name)
+        record = {
+            "module": module_name,
+            "seconds": round(time.perf_counter() - start, 4),
+            "new_modules": len(sys.modules) - modules_before,
+            "timestamp": time.time(),
+            "pid": os.getpid(),
+        }
+    IMPORT_REPORT[module_name] = record
+    logger.info("Imported %s in %.3f s (%d new modules)", module_name, record["seconds"], record["new_modules"])
+    report_path = os.environ.get("PROJET_DATA_IMPORT_REPORT")
+    if report_path:
+        with open(report_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    return module
+
+
+def lazy_page(module_name, function_name):
+    """
+    Page callable for st.Page that imports `module_name` on first use. It keeps
+    the name of the page function, which Streamlit uses for the page URL.
+    """
+    def run():
+        page = getattr(import_page(module_name), function_name)
+        with stage(function_name, "render"):
+            page()
+
+    run.__name__ = function_name
+    run.__qualname__ = function_name
+    return run
+
+
+def profiling_mode():
+    """None when the diagnostics are off, else "timings" or the name of a profiler of PROFILERS."""
+    value = str(st.query_params.get("profile") or os.environ.get("PROJET_DATA_PROFILE", "")).strip().lower()
+    if value in DISABLED_VALUES:
+        return None
+    return value if value in PROFILERS else "timings"
@@ -1,66 +1,237 @@
+import numpy as np
 import streamlit as st
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
-import json
+from components.background import background_result, tables_ready
+from components.filters import commune_filters
+from scripts.classifier import classifier_fingerprint, pvd_classifier
+from scripts.geo import features_in_tiles, level_for_zoom, tiles_in_view
+from scripts.instrumentation import stage
+from scripts.jobs import report_progress
+from scripts.preprocess import layer_path
+from scripts.queries import select
+from scripts.similarity import FEATURES, POPULATION
+from scripts.utils import PVD_GEOJSON_PATH, file_version, load_pvd_layer, pvd_polygon_index, table_path
+
+MAP_CENTER = [46.603354, 1.888334]
+MAP_ZOOM = 6
+
+# Modes d'affichage : en automatique, les contours ne sont dessinés qu'à partir de ce zoom
+DISPLAY_MODES = ["Automatique", "Contours des communes", "Points regroupés"]
+POLYGON_MIN_ZOOM = 9
+
+# Marqueur créé côté navigateur pour chaque ligne [lat, lon, commune, couleur, région, score PVD]
+CENTROID_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 6, color: "black", weight: 1, fillColor: row[3], fillOpacity: 0.8
+    });
+    marker.bindTooltip(row[2] + " (" + row[4] + ")<br>Profil PVD : " + row[5], {sticky: true});
+    return marker;
+};
+"""
+
+# Couleurs du score PVD, du plus faible au plus élevé, par tranche de 20 %
+SCORE_COLORS = ["#fee5d9", "#fcae91", "#fb6a4a", "#de2d26", "#a50f15"]
+MISSING_SCORE_COLOR = "#bdbdbd"
+
+
+def score_labels(scores):
+    """Scores PVD affichés dans les infobulles, « non disponible » hors de etude_2_cas."""
+    return ["non disponible" if np.isnan(score) else f"{score:.0%}" for score in scores]
 
-def beneficiaries_page():
-    st.title("Communes Bénéficiaires")
-    st.write("Passez votre souris sur une commune pour afficher son nom et sa région.")
-
-    # Charger le fichier GeoJSON
-    geojson_file = "./data/PVD.geojson"
-    try:
-        with open(geojson_file, "r", encoding="utf-8") as f:
-            geojson_data = json.load(f)
-    except FileNotFoundError:
-        st.error(f"Le fichier {geojson_file} est introuvable. Vérifiez son emplacement.")
-        return
 
-    # Définir une palette de couleurs pour les régions
-    region_colors = {
-        "Auvergne-Rhône-Alpes": "blue",
-        "Bourgogne-Franche-Comté": "green",
-        "Bretagne": "purple",
-        "Centre-Val de Loire": "orange",
-        "Corse": "red",
-        "Grand Est": "cyan",
-        "Hauts-de-France": "pink",
-        "Île-de-France": "yellow",
-        "Normandie": "brown",
-        "Nouvelle-Aquitaine": "darkgreen",
-        "Occitanie": "darkblue",
-        "Pays de la Loire": "gold",
-        "Provence-Alpes-Côte d'Azur": "darkred",
+def score_colors(scores):
+    bins = np.clip((np.nan_to_num(scores) * len(SCORE_COLORS)).astype(int), 0, len(SCORE_COLORS) - 1)
+    return [MISSING_SCORE_COLOR if np.isnan(score) else SCORE_COLORS[b] for score, b in zip(scores, bins)]
+
+
+def style_function(feature):
+    # La couleur de la région est déjà calculée par scripts/preprocess.py
+    return {
+        "fillColor": feature["properties"]["fill"],  # Couleur par région
+        "color": "black",  # Bordure noire
+        "weight": 1,  # Épaisseur des bordures
+        "fillOpacity": 0.6,  # Opacité des couleurs
     }
 
-    # Créer une fonction de style pour attribuer des couleurs par région
-    def style_function(feature):
-        region_name = feature["properties"]["reg_name"]  # Nom de la région
-        return {
-            "fillColor": region_colors.get(region_name, "gray"),  # Couleur par région
-            "color": "black",  # Bordure noire
-            "weight": 1,  # Épaisseur des bordures
-            "fillOpacity": 0.6,  # Opacité des couleurs
-        }
 
-    # Créer une carte Folium
-    m = folium.Map(location=[46.603354, 1.888334], zoom_start=6, tiles="cartodbpositron")
+@st.cache_data(max_entries=64, show_spinner=False)
+def commune_features(level, tiles, layer_version, rows=None, classifier_key=None, color_by_score=False):
+    """
+    GeoJSON des communes visibles (limitées aux lignes `rows` de la table des
+    communes si elle est filtrée), calculé une fois par vue ; chaque appel en reçoit une copie.
+    """
+    layer = load_pvd_layer(level)
+    visible = features_in_tiles(layer, tiles)
+    if rows is not None:
+        visible = sorted(set(visible).intersection(rows))
+    # Score PVD lu dans les scores précalculés ; les entités de la couche partagée ne sont pas modifiées
+    scores = pvd_classifier().score([layer["features"][i]["properties"]["code"] for i in visible])
+    colors = score_colors(scores) if color_by_score else [layer["features"][i]["properties"]["fill"] for i in visible]
+    features = [
+        dict(layer["features"][i], properties=dict(layer["features"][i]["properties"], score=label, fill=color))
+        for i, label, color in zip(visible, score_labels(scores), colors)
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
 
-    # Ajouter les données GeoJSON avec le style par région
+def commune_layer(level, tiles, layer_version, rows=None, classifier_key=None, color_by_score=False):
+    """Couche Folium des communes visibles, construite à chaque exécution à partir du GeoJSON en cache."""
+    feature_group = folium.FeatureGroup(name="Communes")
     folium.GeoJson(
-        geojson_data,
+        commune_features(level, tiles, layer_version, rows, classifier_key, color_by_score),
         name="Communes",
         style_function=style_function,
         tooltip=folium.GeoJsonTooltip(
-            fields=["lib_com", "reg_name"],  # Nom de la commune et région
-            aliases=["Nom de la commune :", "Région :"],  # Alias pour le tooltip
+            fields=["lib_com", "reg_name", "score"],  # Nom de la commune, région et score PVD
+            aliases=["Nom de la commune :", "Région :", "Profil PVD :"],  # Alias pour le tooltip
             localize=True,
             sticky=True,
         ),
-    ).add_to(m)
+    ).add_to(feature_group)
+    return feature_group
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def centroid_rows(table_version, rows=None, classifier_key=None, color_by_score=False):
+    """Lignes [lat, lon, commune, couleur, région, score PVD] des centroïdes (lignes `rows` si filtrées)."""
+    communes = select(["code", "lat", "lon", "lib_com", "fill", "reg_name"], table="pvd_communes")
+    if rows is not None:
+        communes = communes.take(list(rows))
+    # Coordonnées arrondies à 1 m environ pour alléger la page envoyée au navigateur
+    communes[["lat", "lon"]] = communes[["lat", "lon"]].astype("float64").round(5)
+    scores = pvd_classifier().score(communes["code"])
+    communes["score"] = score_labels(scores)
+    if color_by_score:
+        communes["fill"] = score_colors(scores)
+    return communes[["lat", "lon", "lib_com", "fill", "reg_name", "score"]].astype(object).values.tolist()
+
+
+def centroid_layer(table_version, rows=None, classifier_key=None, color_by_score=False):
+    """Centroïdes des communes regroupés en clusters, construits à chaque exécution à partir des lignes en cache."""
+    feature_group = folium.FeatureGroup(name="Communes")
+    FastMarkerCluster(centroid_rows(table_version, rows, classifier_key, color_by_score),
+                      callback=CENTROID_CALLBACK, name="Communes").add_to(feature_group)
+    return feature_group
+
+
+def map_data(level):
+    """Couche simplifiée du niveau `level`, centroïdes et scores PVD, chargés en arrière-plan avant la carte."""
+    load_pvd_layer(level)
+    report_progress(0.4, "centroïdes des communes")
+    select(["code", "lat", "lon", "lib_com", "fill", "reg_name"], table="pvd_communes")
+    report_progress(0.6, "scores PVD")
+    pvd_classifier()
+    report_progress(0.8, "index spatial")
+    pvd_polygon_index()
+    return level
+
+
+def map_view():
+    """Zoom et emprise de la carte lors de la dernière interaction."""
+    state = st.session_state.get("pvd_map") or {}
+    zoom = state.get("zoom") or MAP_ZOOM
+    bounds = state.get("bounds") or {}
+    south_west, north_east = bounds.get("_southWest") or {}, bounds.get("_northEast") or {}
+    if None in (south_west.get("lat"), south_west.get("lng"), north_east.get("lat"), north_east.get("lng")):
+        return zoom, None
+    return zoom, ((south_west["lat"], south_west["lng"]), (north_east["lat"], north_east["lng"]))
+
+
+def commune_panel(click, mask):
+    """Panneau latéral : la commune PVD affichée sous le dernier clic et ses indicateurs de etude_2_cas."""
+    st.subheader("Commune sélectionnée")
+    if not click or click.get("lat") is None or click.get("lng") is None:
+        st.caption("Cliquez sur une commune de la carte pour afficher ses indicateurs.")
+        return
+    # Quelques dizaines de microsecondes : la grille ne teste que les communes de la case cliquée
+    with stage("commune cliquée", "transform"):
+        position = pvd_polygon_index().locate(click["lat"], click["lng"])
+    if position < 0 or not mask[position]:
+        st.caption("Aucune commune PVD affichée à cet endroit.")
+        return
+
+    commune = select(["code", "lib_com", "reg_name"], table="pvd_communes").iloc[position]
+    st.markdown(f"**{commune['lib_com']}** ({commune['code']})  \n{commune['reg_name']}")
+    score = pvd_classifier().score([commune["code"]])[0]
+    if not np.isnan(score):
+        st.metric("Profil PVD", f"{score:.0%}")
+
+    indicators = select([POPULATION, *FEATURES], codes=[commune["code"]])
+    if indicators.empty:
+        st.caption("Indicateurs non disponibles dans etude_2_cas pour cette commune.")
+        return
+    values = indicators[[POPULATION, *FEATURES]].iloc[0]
+    st.dataframe(
+        values.rename("Valeur").rename_axis("Indicateur").reset_index(),
+        hide_index=True,
+        column_config={"Valeur": st.column_config.NumberColumn(format="%.4g")},
+    )
+
+
+def beneficiaries_page():
+    st.title("Communes Bénéficiaires")
+    st.write("Passez votre souris sur une commune pour afficher son nom, sa région et son profil PVD ; "
+             "cliquez dessus pour afficher ses indicateurs.")
+
+    geojson_file = PVD_GEOJSON_PATH
+    if not geojson_file.exists():
+        st.error(f"Le fichier {geojson_file} est introuvable. Vérifiez son emplacement.")
+        return
+    # Contours simplifiés et table des communes : compilés par scripts/preprocess.py
+    if not tables_ready("pvd_communes"):
+        return
+    zoom, bounds = map_view()
+    level = level_for_zoom(zoom)
+
+    # Filtres de la barre latérale : les lignes retenues de la table des communes,
+    # dans l'ordre des entités des couches
+    selections, mask = commune_filters(table="pvd_communes", dimensions=("region", "gcd", "aav"))
+    rows = tuple(np.flatnonzero(mask).tolist()) if any(selections.values()) else None
+
+    # Les contours de 1 627 communes sont lourds à afficher sur une machine modeste :
+    # le mode par points ne transmet qu'un centroïde par commune
+    display_mode = st.radio("Mode d'affichage", DISPLAY_MODES, horizontal=True)
+    if display_mode == "Automatique":
+        show_polygons = zoom >= POLYGON_MIN_ZOOM
+        st.caption(f"Les contours des communes s'affichent à partir du niveau de zoom {POLYGON_MIN_ZOOM}.")
+    else:
+        show_polygons = display_mode == "Contours des communes"
+    color_by_score = st.toggle("Colorer selon le profil PVD")
+    if color_by_score:
+        st.caption("Profil PVD : probabilité d'appartenir au programme estimée à partir des indicateurs de la "
+                   "commune, du plus clair (0 à 20 %) au plus foncé (80 à 100 %). Gris : indicateurs indisponibles.")
+
+    # La couche simplifiée du zoom courant et les scores sont chargés en arrière-plan :
+    # le texte et les filtres s'affichent sans attendre, la carte vient ensuite
+    classifier_key = classifier_fingerprint()
+    if background_result(("carte des communes", level, file_version(geojson_file), classifier_key), map_data,
+                         level, label="Chargement de la carte") is None:
+        return
 
-    # Ajouter un contrôle pour les couches
-    folium.LayerControl().add_to(m)
+    # Créer une carte Folium (rendu canvas) ; seules les communes des tuiles visibles lui sont envoyées
+    m = folium.Map(location=MAP_CENTER, zoom_start=MAP_ZOOM, tiles="cartodbpositron", prefer_canvas=True)
+    # Les scores sont calculés une fois pour toutes les communes (scripts/classifier.py) : ici, simple lecture
+    with stage("couche des communes", "transform"):
+        if show_polygons:
+            layer = commune_layer(level, tiles_in_view(level, bounds), file_version(layer_path(level)), rows,
+                                  classifier_key, color_by_score)
+        else:
+            layer = centroid_layer(file_version(table_path("pvd_communes")), rows, classifier_key, color_by_score)
 
-    # Afficher la carte dans Streamlit
-    st_folium(m, width=1000, height=600)
+    # Afficher la carte dans Streamlit, le panneau de la commune cliquée à côté
+    map_column, panel_column = st.columns([3, 1])
+    with map_column, stage("st_folium", "render"):
+        state = st_folium(
+            m,
+            key="pvd_map",
+            height=600,
+            use_container_width=True,
+            feature_group_to_add=layer,
+            layer_control=folium.LayerControl(),
+            returned_objects=["zoom", "bounds", "last_clicked"],
+        )
+    with panel_column:
+        commune_panel((state or {}).get("last_clicked"), mask)
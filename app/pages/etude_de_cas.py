@@ -1,35 +1,177 @@
-import pandas as pd
+import numpy as np
 import streamlit as st
-import plotly.express as px
+from components.background import background_result
+from components.filters import commune_filters, filter_index
+from components.graphs import bar_chart, pie_chart, scatter_chart
+from scripts.artifacts import fingerprint
+from scripts.classifier import classifier_fingerprint, pvd_classifier
+from scripts.comparison import GROUPINGS, comparison_engine
+from scripts.instrumentation import stage
+from scripts.jobs import report_progress
+from scripts.preprocess import PIPELINE_VERSION, TABLES
+from scripts.queries import select
+from scripts.similarity import POPULATION, similarity_index
+from scripts.utils import cached_derived, commune_index, commune_labels
+
+# Communes du cas d'étude initial, proposées par défaut
+DEFAULT_COMMUNES = ["34247", "30132"]  # Saint-Clément-de-Rivière, La Grand-Combe
+
+PVD_FILTERS = {"Toutes": None, "Communes PVD": True, "Hors PVD": False}
+
+# Résumés rédigés du cas d'étude initial, affichés aussi pendant la préparation des données
+AGE_SUMMARY = """
+    Les tranches d'âge des deux communes révèlent des différences significatives. 
+    À **Saint-Clément-de-Rivière**, on observe une proportion importante de personnes âgées entre 60 et 74 ans (26,8 %), indiquant une population vieillissante, typique des communes résidentielles attractives pour les retraités. 
+    En revanche, **La Grand-Combe** présente une répartition plus équilibrée avec une part légèrement plus importante des moins de 15 ans et des jeunes adultes (15-29 ans), témoignant d'une population plus jeune et active.
+    """
+SERVICES_SUMMARY = """
+    Les services disponibles diffèrent fortement entre les deux communes. 
+    **Saint-Clément-de-Rivière** bénéficie d’un accès plus large aux services, avec un nombre supérieur de dentistes (8 contre 2) et de médecins généralistes (7 contre 3), reflétant une infrastructure médicale bien développée. De plus, cette commune dispose de 4 boulangeries et pâtisseries contre 3 à La Grand-Combe, renforçant son caractère attractif pour les familles. Cependant, **La Grand-Combe** se distingue par un plus grand nombre d’écoles primaires (5 contre 3), un facteur essentiel pour les familles avec enfants. Ces différences mettent en évidence une disparité dans la qualité et l’étendue des services offerts dans ces deux communes.
+    """
+METRICS_SUMMARY = """
+    Les métriques clés mettent en évidence des écarts notables. La **médiane du revenu disponible** est nettement plus élevée à **Saint-Clément-de-Rivière** (34,31k€ contre 15,18k€ à La Grand-Combe), reflétant un écart socio-économique significatif entre les deux communes. En termes d'équipements sportifs, bien que Saint-Clément-de-Rivière ait un nombre légèrement plus élevé (19 contre 16), le **taux d'équipements sportifs pour 1 000 habitants** reste relativement proche (3,8 pour Saint-Clément-de-Rivière et 3,2 pour La Grand-Combe). Cela souligne que, malgré un nombre total moindre, La Grand-Combe maintient une densité d’équipements suffisante pour sa population.
+    """
+FINAL_OBSERVATIONS = """
+    Il est intéressant de noter que **La Grand-Combe** fait partie du programme PVD (Petites Villes de Demain), contrairement à **Saint-Clément-de-Rivière**. 
+    Cela peut s'expliquer par les critères de sélection du programme, qui priorisent les communes présentant des besoins socio-économiques importants et un potentiel de revitalisation. 
+    Bien que Saint-Clément-de-Rivière dispose d'infrastructures de qualité et d'une population aisée, les défis de La Grand-Combe, notamment liés à son passé industriel et à son niveau de revenu médian plus faible, justifient son inclusion dans le programme. 
+    Cette analyse met en évidence la nécessité d'adapter les politiques publiques aux spécificités locales pour répondre efficacement aux besoins des différentes communes.
+    """
+
+
+def labels_by_code():
+    """Libellé « Commune (Code) » de chaque code INSEE, pour l'affichage des listes de communes."""
+    return cached_derived("etude_2_cas", ("labels_by_code",),
+                          lambda frame: dict(zip(commune_index(), commune_labels())))
+
+
+def page_data():
+    """Filtres, libellés, index de similarité, moteur de comparaison et scores PVD, préparés en arrière-plan."""
+    report_progress(0.0, "filtres des communes")
+    filter_index()
+    labels_by_code()
+    report_progress(0.3, "index de similarité")
+    similarity_index()
+    report_progress(0.5, "moteur de comparaison")
+    comparison_engine()
+    report_progress(0.7, "scores PVD")
+    pvd_classifier()
+    return True
+
+
+def page_data_key():
+    # Le classifieur couvre etude_2_cas et la table des communes PVD ; reste l'échantillon de régression
+    return ("étude de cas", classifier_fingerprint(),
+            fingerprint(TABLES["final_filtered_data_sample"][0], PIPELINE_VERSION))
+
+
+def case_study_summaries():
+    """Résumés rédigés du cas d'étude, affichés pendant la préparation des données."""
+    st.header("Résumé des tranches d'âge")
+    st.write(AGE_SUMMARY)
+    st.header("Résumé des services")
+    st.write(SERVICES_SUMMARY)
+    st.header("Résumé des métriques clés")
+    st.write(METRICS_SUMMARY)
+    st.header("Observations finales")
+    st.write(FINAL_OBSERVATIONS)
+
+
+def known_positions(codes):
+    """Lignes de etude_2_cas des codes `codes`, les codes inconnus écartés."""
+    positions = commune_index().get_indexer(codes)
+    return positions[positions >= 0]
+
+
+def _add_communes(codes):
+    # Rappel des boutons : s'exécute avant la relance, le multiselect n'est pas encore dessiné
+    chosen = list(st.session_state.get("communes_comparees", []))
+    for code in commune_index()[known_positions(codes)]:
+        if code not in chosen:
+            chosen.append(code)
+    st.session_state["communes_comparees"] = chosen
+
+
+def similar_communes(selected_codes):
+    """Communes les plus proches d'une commune choisie, et paire PVD / hors PVD suggérée."""
+    with st.expander("Trouver des communes similaires"):
+        st.caption("Proximité sur le revenu, les tranches d'âge, les services et les équipements sportifs, "
+                   "chaque indicateur ramené à son écart type.")
+        code = st.selectbox("Commune de référence", selected_codes, format_func=labels_by_code().get)
+        left, right = st.columns(2)
+        pvd = left.radio("Programme PVD", list(PVD_FILTERS), horizontal=True)
+        comparable = right.checkbox("Population comparable (de moitié au double)")
+
+        index = similarity_index()
+        band = None
+        if comparable:
+            population = index.population[index.rows([code])[0]]
+            if np.isfinite(population) and population > 0:
+                band = (population / 2, population * 2)
+        with stage("communes similaires", "transform"):
+            neighbours = index.similar(code, k=10, pvd=PVD_FILTERS[pvd], population=band)
+        if neighbours.empty:
+            st.info("Aucune commune ne correspond à ces filtres.")
+        else:
+            st.dataframe(
+                neighbours,
+                hide_index=True,
+                column_config={
+                    "Distance": st.column_config.NumberColumn(format="%.2f"),
+                    POPULATION: st.column_config.NumberColumn("Population 2021", format="%d"),
+                    "PVD": st.column_config.CheckboxColumn("PVD"),
+                },
+            )
+            added = st.selectbox("Commune à ajouter", neighbours["Code"],
+                                 format_func=dict(zip(neighbours["Code"], neighbours["Libellé"])).get)
+            st.button("Ajouter à la comparaison", on_click=_add_communes, args=([added],))
+
+        # Paire suggérée : la commune la plus proche de l'autre côté du programme PVD
+        pair = index.matched_pair(code)
+        if pair is None:
+            st.caption("Pas de commune comparable de l'autre côté du programme PVD.")
+        else:
+            side = "PVD" if pair["PVD"] else "hors PVD"
+            st.write(f"Paire suggérée : **{pair['Libellé']}** ({side}, distance {pair['Distance']:.2f}).")
+            st.button("Comparer la paire suggérée", on_click=_add_communes, args=([pair["Code"]],))
+
 
 def etude_de_cas_page():
-    # Charger les fichiers
-    data_file = "data/etude_2_cas.csv"  # Fichier contenant toutes les communes
-
-    # Lire les données avec un encodage adapté
-    data = pd.read_csv(data_file, delimiter=";", encoding="latin1", low_memory=False)
-
-    # Renommer les colonnes pour corriger les caractères mal encodés
-    data.rename(columns={
-        "Libell�": "Libellé",
-        "Médiane du revenu disponible par UC 2020": "Médiane du revenu disponible par UC 2020",
-        "Nombre d'équipements sportifs 2023": "Nombre d'équipements sportifs 2023",
-        "Taux d'équipements sportifs pour 1 000 habitants 2023": "Taux d'équipements sportifs pour 1 000 habitants 2023",
-        "Nombre de supérettes et épieries": "Nombre de supérettes et épiceries",
-        "Nombre boulangeries et patisseries": "Nombre boulangeries et pâtisseries",
-        "Nombre écoles primaires maternelles élémentaires": "Nombre écoles primaires maternelles élémentaires",
-        "Nombre grandes surfaces 2023": "Nombre grandes surfaces 2023"
-    }, inplace=True)
-
-    # Sélectionner les deux communes
-    saint_clement = data[data["Code"] == "34247"]
-    la_grand_combe = data[data["Code"] == "30132"]
-
-    # Combiner les deux communes pour comparaison
-    comparison_data = pd.concat([saint_clement, la_grand_combe])
-    comparison_data["Commune"] = comparison_data["Libellé"]
+    # Configurer l'interface Streamlit
+    st.title("Comparaison de communes")
+
+    # Index des filtres, de similarité et de comparaison et scores PVD : préparés
+    # en arrière-plan à froid, les résumés rédigés s'affichent en attendant
+    if background_result(page_data_key(), page_data, label="Préparation des communes") is None:
+        case_study_summaries()
+        return
+
+    # Choix des communes : la liste contient les codes INSEE, affichés sous la
+    # forme « Commune (Code) » ; l'index des codes et les libellés sont
+    # construits une seule fois et partagés entre les sessions
+    codes = commune_index()
+
+    # Les filtres de la barre latérale restreignent la liste des communes
+    # proposées ; les communes déjà choisies y restent
+    _, mask = commune_filters()
+    # Valeur initiale posée dans l'état de session : les boutons « communes
+    # similaires » y ajoutent des communes
+    chosen = st.session_state.setdefault("communes_comparees", list(codes[known_positions(DEFAULT_COMMUNES)]))
+    mask = mask.copy()
+    mask[known_positions(chosen)] = True
+    selected_codes = st.multiselect(
+        "Communes à comparer",
+        options=codes[mask].tolist(),
+        format_func=labels_by_code().get,
+        key="communes_comparees",
+        help="Le cas d'étude initial compare Saint-Clément-de-Rivière et La Grand-Combe.",
+    )
+    st.caption("Les résumés rédigés portent sur le cas d'étude initial : Saint-Clément-de-Rivière et La Grand-Combe.")
+    if not selected_codes:
+        st.info("Sélectionnez au moins une commune pour afficher la comparaison.")
+        return
+    similar_communes(selected_codes)
 
-    # Assurer que les colonnes numériques sont bien au format float
     age_columns = [
         "Part des 60-74 ans 2021", 
         "Part des moins de 15 ans 2021", 
@@ -54,122 +196,151 @@ def etude_de_cas_page():
         "Taux d'équipements sportifs pour 1 000 habitants 2023"
     ]
 
+    # Seules les colonnes affichées sont lues, pour les seules communes choisies
+    comparison_data = select(
+        ["Code", "Libellé", *age_columns, *service_columns, *numeric_columns],
+        codes=selected_codes,
+    )
+    comparison_data["Commune"] = comparison_data["Libellé"]
+
     existing_age_columns = [col for col in age_columns if col in comparison_data.columns]
     existing_service_columns = [col for col in service_columns if col in comparison_data.columns]
     existing_numeric_columns = [col for col in numeric_columns if col in comparison_data.columns]
 
-    for col in existing_numeric_columns + existing_age_columns + existing_service_columns:
-        comparison_data[col] = pd.to_numeric(comparison_data[col], errors='coerce')
-
-    # Configurer l'interface Streamlit
-    st.title("Comparaison entre Saint-Clément-de-Rivière et La Grand-Combe")
-
-    def configure_pie_chart(fig):
-        fig.update_traces(
-            textinfo="value",
-            textfont_size=16,
-            marker=dict(line=dict(color='#000000', width=1))
-        )
-        fig.update_layout(
-            legend_font_size=12,
-            height=500,
-            width=500,
-        )
-        return fig
-
     # Diagrammes circulaires pour les tranches d'âge
     st.header("Comparaison des tranches d'âge")
-    st.write("Diagrammes circulaires représentant les tranches d'âge des deux communes.")
-
-    col1, col2 = st.columns(2)
-    with col1:
-        age_data_clement = saint_clement[existing_age_columns].iloc[0]
-        age_pie_clement = px.pie(
-            names=existing_age_columns, 
-            values=age_data_clement,
-            title="Saint-Clément-de-Rivière : Tranches d'âge",
-            color_discrete_sequence=px.colors.qualitative.Set2
-        )
-        age_pie_clement = configure_pie_chart(age_pie_clement)
-        st.plotly_chart(age_pie_clement)
-
-    with col2:
-        age_data_grand_combe = la_grand_combe[existing_age_columns].iloc[0]
-        age_pie_grand_combe = px.pie(
-            names=existing_age_columns, 
-            values=age_data_grand_combe,
-            title="La Grand-Combe : Tranches d'âge",
-            color_discrete_sequence=px.colors.qualitative.Set2
-        )
-        age_pie_grand_combe = configure_pie_chart(age_pie_grand_combe)
-        st.plotly_chart(age_pie_grand_combe)
+    st.write("Diagrammes circulaires représentant les tranches d'âge des communes sélectionnées.")
+
+    # Deux communes par ligne
+    for start in range(0, len(comparison_data), 2):
+        for column, (_, commune) in zip(st.columns(2), comparison_data.iloc[start:start + 2].iterrows()):
+            with column:
+                age_pie = pie_chart(
+                    tuple(existing_age_columns),
+                    tuple(commune[existing_age_columns].tolist()),
+                    f"{commune['Commune']} : Tranches d'âge",
+                )
+                st.plotly_chart(age_pie)
 
     st.header("Résumé des tranches d'âge")
-    st.write("""
-    Les tranches d'âge des deux communes révèlent des différences significatives. 
-    À **Saint-Clément-de-Rivière**, on observe une proportion importante de personnes âgées entre 60 et 74 ans (26,8 %), indiquant une population vieillissante, typique des communes résidentielles attractives pour les retraités. 
-    En revanche, **La Grand-Combe** présente une répartition plus équilibrée avec une part légèrement plus importante des moins de 15 ans et des jeunes adultes (15-29 ans), témoignant d'une population plus jeune et active.
-    """)
+    st.write(AGE_SUMMARY)
 
     # Diagrammes circulaires pour les services
     st.header("Comparaison des services")
-    st.write("Diagrammes circulaires représentant les services des deux communes.")
-
-    # Saint-Clément-de-Rivière : Services
-    service_data_clement = saint_clement[existing_service_columns].iloc[0]
-    service_pie_clement = px.pie(
-        names=existing_service_columns, 
-        values=service_data_clement,
-        title="Saint-Clément-de-Rivière : Services",
-        color_discrete_sequence=px.colors.qualitative.Set2
-    )
-    service_pie_clement = configure_pie_chart(service_pie_clement)
-    st.plotly_chart(service_pie_clement)
-
-    # La Grand-Combe : Services
-    service_data_grand_combe = la_grand_combe[existing_service_columns].iloc[0]
-    service_pie_grand_combe = px.pie(
-        names=existing_service_columns, 
-        values=service_data_grand_combe,
-        title="La Grand-Combe : Services",
-        color_discrete_sequence=px.colors.qualitative.Set2
-    )
-    service_pie_grand_combe = configure_pie_chart(service_pie_grand_combe)
-    st.plotly_chart(service_pie_grand_combe)
+    st.write("Diagrammes circulaires représentant les services des communes sélectionnées.")
+
+    for _, commune in comparison_data.iterrows():
+        service_pie = pie_chart(
+            tuple(existing_service_columns),
+            tuple(commune[existing_service_columns].tolist()),
+            f"{commune['Commune']} : Services",
+        )
+        st.plotly_chart(service_pie)
 
     st.header("Résumé des services")
-    st.write("""
-    Les services disponibles diffèrent fortement entre les deux communes. 
-    **Saint-Clément-de-Rivière** bénéficie d’un accès plus large aux services, avec un nombre supérieur de dentistes (8 contre 2) et de médecins généralistes (7 contre 3), reflétant une infrastructure médicale bien développée. De plus, cette commune dispose de 4 boulangeries et pâtisseries contre 3 à La Grand-Combe, renforçant son caractère attractif pour les familles. Cependant, **La Grand-Combe** se distingue par un plus grand nombre d’écoles primaires (5 contre 3), un facteur essentiel pour les familles avec enfants. Ces différences mettent en évidence une disparité dans la qualité et l’étendue des services offerts dans ces deux communes.
-    """)
+    st.write(SERVICES_SUMMARY)
 
     # Comparaison des métriques clés
     st.header("Comparaison des métriques clés")
-    st.write("Diagrammes comparant les métriques clés des deux communes.")
+    st.write("Diagrammes comparant les métriques clés des communes sélectionnées.")
 
     for column in existing_numeric_columns:
-        bar_chart = px.bar(
-            comparison_data,
-            x="Commune",
-            y=column,
-            labels={"Commune": "Commune", column: column},
-            title=f"Comparaison des communes pour {column}",
-            text_auto=True,
-            color_discrete_sequence=px.colors.qualitative.Set2
+        metric_bar = bar_chart(
+            tuple(comparison_data["Commune"]),
+            tuple(comparison_data[column].tolist()),
+            f"Comparaison des communes pour {column}",
+            "Commune",
+            column,
         )
-        bar_chart.update_traces(width=0.4)
-        st.plotly_chart(bar_chart)
+        st.plotly_chart(metric_bar)
 
     st.header("Résumé des métriques clés")
-    st.write("""
-    Les métriques clés mettent en évidence des écarts notables. La **médiane du revenu disponible** est nettement plus élevée à **Saint-Clément-de-Rivière** (34,31k€ contre 15,18k€ à La Grand-Combe), reflétant un écart socio-économique significatif entre les deux communes. En termes d'équipements sportifs, bien que Saint-Clément-de-Rivière ait un nombre légèrement plus élevé (19 contre 16), le **taux d'équipements sportifs pour 1 000 habitants** reste relativement proche (3,8 pour Saint-Clément-de-Rivière et 3,2 pour La Grand-Combe). Cela souligne que, malgré un nombre total moindre, La Grand-Combe maintient une densité d’équipements suffisante pour sa population.
-    """)
+    st.write(METRICS_SUMMARY)
+
+    # Position de chaque commune dans la distribution de ses communes comparables
+    st.header("Position par rapport aux communes comparables")
+    grouping = st.selectbox(
+        "Communes comparables",
+        options=list(GROUPINGS),
+        index=list(GROUPINGS).index("region"),
+        format_func=GROUPINGS.get,
+    )
+    if grouping in ("gcd", "aav"):
+        st.caption("Les classes GCD et AAV ne sont connues que pour les communes PVD de l'échantillon de régression.")
+    with stage("position dans les groupes", "transform"):
+        positions = comparison_engine().compare(comparison_data["Code"].astype(str), grouping)
+    groups = positions.drop_duplicates("Code")
+    for _, commune in groups.iterrows():
+        if commune["Groupe"]:
+            st.write(f"**{commune['Libellé']}** : {commune['Groupe']} ({commune['Communes du groupe']} communes)")
+        else:
+            st.write(f"**{commune['Libellé']}** : pas de groupe de comparaison")
+    # Colonnes « Libellé (Code) » : deux communes peuvent porter le même nom
+    percentiles = positions.pivot(index="Indicateur", columns="Code", values="Percentile")
+    percentiles = percentiles.reindex(index=positions["Indicateur"].unique(), columns=groups["Code"])
+    percentiles.columns = groups["Libellé"] + " (" + groups["Code"] + ")"
+    st.dataframe(
+        percentiles,
+        column_config={
+            label: st.column_config.ProgressColumn(label, min_value=0, max_value=100, format="%.0f")
+            for label in percentiles.columns
+        },
+    )
+    st.caption("Percentile de chaque commune dans son groupe : 50 correspond à la médiane des communes comparables.")
+    with st.expander("Détail des valeurs et des quartiles du groupe"):
+        st.dataframe(positions.drop(columns=["Code"]), hide_index=True)
+
+    # Nuage national : toutes les communes retenues par les filtres, les
+    # communes choisies mises en avant
+    st.header("Positionnement parmi les communes")
+    engine = comparison_engine()
+    x_column, y_column = st.columns(2)
+    x_indicator = x_column.selectbox("Axe horizontal", engine.indicators,
+                                     index=engine.indicators.index("Médiane du revenu disponible par UC 2020"))
+    y_indicator = y_column.selectbox("Axe vertical", engine.indicators,
+                                     index=engine.indicators.index("Part des 60-74 ans 2021"))
+    selected_rows = engine.index.get_indexer(comparison_data["Code"].astype(str))
+    known = selected_rows >= 0
+    selected_rows = selected_rows[known]
+    mask[selected_rows] = True
+    rows = np.flatnonzero(mask)
+    with stage("nuage national", "render"):
+        national_scatter = scatter_chart(
+            engine.values[rows, engine.indicators.index(x_indicator)],
+            engine.values[rows, engine.indicators.index(y_indicator)],
+            f"{y_indicator} selon {x_indicator}",
+            x_indicator,
+            y_indicator,
+            highlight=np.searchsorted(rows, selected_rows),
+            highlight_labels=tuple(comparison_data["Commune"][known]),
+        )
+        st.plotly_chart(national_scatter)
+    st.caption(f"{len(rows)} communes ; au-delà de quelques dizaines de milliers de points, "
+               "le nuage est résumé en densité par cases.")
 
     # Observations finales sur le programme PVD
     st.header("Observations finales")
-    st.write("""
-    Il est intéressant de noter que **La Grand-Combe** fait partie du programme PVD (Petites Villes de Demain), contrairement à **Saint-Clément-de-Rivière**. 
-    Cela peut s'expliquer par les critères de sélection du programme, qui priorisent les communes présentant des besoins socio-économiques importants et un potentiel de revitalisation. 
-    Bien que Saint-Clément-de-Rivière dispose d'infrastructures de qualité et d'une population aisée, les défis de La Grand-Combe, notamment liés à son passé industriel et à son niveau de revenu médian plus faible, justifient son inclusion dans le programme. 
-    Cette analyse met en évidence la nécessité d'adapter les politiques publiques aux spécificités locales pour répondre efficacement aux besoins des différentes communes.
-    """)
+    st.write(FINAL_OBSERVATIONS)
+
+    # Profil PVD : scores précalculés pour toutes les communes, seulement lus ici
+    st.subheader("Profil PVD des communes choisies")
+    classifier = pvd_classifier()
+    profiles = classifier.table(comparison_data["Code"].astype(str))
+    st.dataframe(
+        profiles,
+        hide_index=True,
+        column_config={
+            "PVD": st.column_config.CheckboxColumn("Commune PVD"),
+            "Score PVD": st.column_config.ProgressColumn("Profil PVD", min_value=0, max_value=1, format="percent"),
+            "Percentile PVD": st.column_config.NumberColumn("Percentile national", format="%.0f"),
+        },
+    )
+    st.caption(f"Probabilité d'appartenir au programme estimée par une régression logistique sur les indicateurs "
+               f"ci-dessus, la population et les équipements ; chaque commune est notée par un modèle qui ne l'a "
+               f"pas vue (validation croisée, AUC {classifier.auc:.2f}).")
+    with st.expander("Indicateurs qui rapprochent ou éloignent du profil PVD"):
+        contributions = classifier.contributions(profiles["Code"])
+        contributions.columns = profiles["Libellé"] + " (" + profiles["Code"] + ")"
+        st.dataframe(contributions.round(2))
+        st.caption("Contribution de chaque indicateur au score, en log-cote, par rapport à une commune moyenne : "
+                   "positive, elle rapproche la commune du profil des communes PVD.")
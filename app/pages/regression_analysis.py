@@ -1,9 +1,87 @@
-import streamlit as st
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import statsmodels.api as sm
-from scipy.stats import shapiro
+import pandas as pd
+import streamlit as st
+from components.background import background_result
+from components.filters import commune_filters
+from scripts.instrumentation import stage
+from scripts.jobs import get, report_progress
+from scripts.prediction import regression_predictor
+from scripts.regression import model_fingerprint, regression_model
+from scripts.resampling import model_stability, stability_fingerprint
+from scripts.utils import REGRESSION_SAMPLE_PATH, commune_index, commune_labels, load_regression_sample
+from scripts.visualizations import FIGURES, model_figure
+
+
+def fitted_model():
+    """Modèle final, ses figures et son prédicteur, préparés ensemble en arrière-plan."""
+    model = regression_model()
+    report_progress(0.8, "figures")
+    for name in FIGURES:
+        model_figure(model, name)
+    regression_predictor()
+    return model
+
+
+def slider_bounds(values):
+    """(borne, pas, entier) d'un curseur de variation symétrique pour une colonne du modèle."""
+    spread = 2 * float(values.std()) or 1.0
+    integer = bool(np.all(values == np.round(values)))
+    step = 10 ** np.floor(np.log10(spread / 20))
+    if integer:
+        step = max(1, int(step))
+        return max(5, int(np.ceil(spread / step)) * step), step, True
+    return round(float(np.ceil(spread / step) * step), 10), float(step), False
+
+
+def scenario_section():
+    """Curseurs « et si » : variation des variables du modèle final sur un ensemble de communes."""
+    st.header("Scénarios")
+    st.markdown(
+        """
+        Les curseurs ajoutent une variation aux variables du modèle final (par exemple un cinéma ou deux médecins
+        généralistes de plus) pour les communes retenues par les filtres, et le taux d'évolution prévu est
+        recalculé pour les 1397 communes de l'échantillon. Une variation négative ne descend pas sous zéro.
+        """
+    )
+    predictor = regression_predictor()
+    _, mask = commune_filters(table="final_filtered_data_sample", dimensions=("region", "gcd", "aav"),
+                              key="scenario", container=st.expander("Communes concernées (toutes par défaut)"))
+
+    deltas = {}
+    columns = st.columns(2)
+    for j, variable in enumerate(predictor.variables):
+        bound, step, integer = slider_bounds(predictor.matrix[:, predictor.names.index(variable)])
+        deltas[variable] = columns[j % 2].slider(
+            variable, min_value=-bound, max_value=bound, value=0 if integer else 0.0, step=step,
+            key=f"scenario_{variable}",
+        )
+
+    # Un produit matrice-vecteur restreint aux colonnes modifiées : une fraction de milliseconde
+    with stage("scénario", "transform"):
+        baseline = predictor.predict()
+        predictions = predictor.scenario(deltas, rows=mask)
+
+    selected = int(mask.sum())
+    left, middle, right = st.columns(3)
+    left.metric("Communes concernées", selected)
+    if selected:
+        middle.metric("Taux prévu, communes concernées", f"{predictions[mask].mean():.3f} %",
+                      f"{predictions[mask].mean() - baseline[mask].mean():+.3f}")
+    right.metric("Taux prévu, échantillon", f"{predictions.mean():.3f} %",
+                 f"{predictions.mean() - baseline.mean():+.3f}")
+
+    if selected and any(deltas.values()):
+        labels = commune_labels()
+        positions = commune_index().get_indexer(predictor.codes[mask])
+        changes = pd.DataFrame({
+            "Commune": [labels[position] if position >= 0 else code
+                        for position, code in zip(positions, predictor.codes[mask])],
+            "Taux prévu": baseline[mask],
+            "Taux du scénario": predictions[mask],
+            "Variation": predictions[mask] - baseline[mask],
+        }).sort_values("Variation", ascending=False)
+        st.dataframe(changes.round(4), hide_index=True)
+
 
 def regression_analysis_page():
     st.title("📊 Analyse de régression")
@@ -15,9 +93,9 @@ def regression_analysis_page():
         """
     )
     
-    file_path = "data/final_filtered_data_sample.csv"
+    file_path = REGRESSION_SAMPLE_PATH
     try:
-        filtered_data = pd.read_csv(file_path)
+        filtered_data = load_regression_sample()
 
         # Étapes préliminaires
         st.header("Étapes préliminaires")
@@ -37,34 +115,21 @@ def regression_analysis_page():
         st.header("Aperçu des données")
         st.write(filtered_data.head())
 
-        # Suppression des colonnes inutiles
-        data_for_regression = filtered_data.drop(columns=[
-            'taux_evolution_due_solde_naturel', 'taux_evolution_due_solde_migratoire', 'code_insee'
-        ])
-
-        # Calcul de la matrice de corrélation
-        correlation_matrix = data_for_regression.corr()
-
-        # Identification des variables fortement corrélées
-        highly_correlated = np.where((correlation_matrix > 0.85) & (correlation_matrix != 1))
-        correlated_pairs = [
-            (correlation_matrix.index[x], correlation_matrix.columns[y])
-            for x, y in zip(*highly_correlated) if x < y
-        ]
-
-        # Affichage de la matrice de corrélation
+        # Matrice de corrélation, sélection backward, modèle final et figures :
+        # calculés en arrière-plan la première fois, puis relus depuis le cache
+        # disque tant que les données ne changent pas. En attendant, le texte
+        # de la page s'affiche et une barre de progression tient la place des résultats.
         st.header("Matrice de corrélation")
-        fig, ax = plt.subplots(figsize=(12, 10))
-        cax = ax.imshow(correlation_matrix, cmap='coolwarm', interpolation='nearest')
-        fig.colorbar(cax)
-        ax.set_title("Matrice de corrélation des variables")
-        st.pyplot(fig)
-
-        # Affichage des paires fortement corrélées
-        if correlated_pairs:
-            st.subheader("Paires de variables fortement corrélées")
-            for pair in correlated_pairs:
-                st.write(f"{pair[0]} et {pair[1]}")
+        model = background_result(("regression_model", model_fingerprint()), fitted_model,
+                                  label="Ajustement du modèle")
+        if model is not None:
+            st.image(model_figure(model, "correlation_heatmap"), width="stretch")
+
+            # Affichage des paires fortement corrélées
+            if model["correlated_pairs"]:
+                st.subheader("Paires de variables fortement corrélées")
+                for pair in model["correlated_pairs"]:
+                    st.write(f"{pair[0]} et {pair[1]}")
 
         # Construction du modèle
         st.header("Construction du modèle")
@@ -76,47 +141,31 @@ def regression_analysis_page():
 
             Cette sélection a permis de retirer 28 des 41 variables que nous avions choisies, faisant passer l’Akaike Information Criterion (AIC) 
             du modèle de **3067 à 3035**.
+
+            Une de ces variables est nulle ou colinéaire aux autres : sa p-value n’a pas de sens, elle est donc écartée
+            avant la sélection plutôt qu’à l’étape où sa p-value l’aurait fait retirer. Les étapes de suppression
+            sont numérotées sans elle ; le modèle final et son AIC sont inchangés.
             """
         )
 
-        # Séparation des variables prédicteurs et réponse
-        X = data_for_regression.drop(columns=['taux_evolution'])
-        y = data_for_regression['taux_evolution']
-
-        # Ajout d'une constante aux prédicteurs
-        X = sm.add_constant(X)
-
-        # Fonction pour régression par élimination arrière avec logs
-        def backward_regression_with_logging(X, y, significance_level=0.05):
-            steps = []
-            step_count = 1
-            while True:
-                model = sm.OLS(y, X).fit()
-                aic = model.aic
-                p_values = model.pvalues
-                max_p_value = p_values.max()
-                if max_p_value > significance_level:
-                    excluded_feature = p_values.idxmax()
-                    steps.append(f"Step {step_count}: Suppression de {excluded_feature}, AIC: {aic:.2f}")
-                    X = X.drop(columns=[excluded_feature])
-                    step_count += 1
-                else:
-                    break
-            return model, steps
-
-        # Lancer la régression par élimination arrière
-        final_model, regression_steps = backward_regression_with_logging(X, y)
-
-        # Affichage des étapes dans un menu déroulant
-        st.subheader("Étapes de la régression")
-        with st.expander("Voir les étapes de sélection backward"):
-            for step in regression_steps:
-                st.write(step)
-
-        # Résumé du modèle final
-        st.subheader("Résumé du modèle final")
-        with st.expander("Voir les résultats complets de la régression"):
-            st.text(final_model.summary())
+        if model is not None:
+            aliased = [step.variable for step in model["steps"] if step.action == "aliased"]
+            removed = [step for step in model["steps"] if step.action != "aliased"]
+            regression_steps = [f"Step {step_count}: Suppression de {step.variable}, AIC: {step.aic:.2f}"
+                                for step_count, step in enumerate(removed, start=1)]
+
+            # Affichage des étapes dans un menu déroulant
+            st.subheader("Étapes de la régression")
+            with st.expander("Voir les étapes de sélection backward"):
+                if aliased:
+                    st.write(f"Écartées avant la sélection (colonne nulle ou colinéaire) : {', '.join(aliased)}")
+                for step in regression_steps:
+                    st.write(step)
+
+            # Résumé du modèle final
+            st.subheader("Résumé du modèle final")
+            with st.expander("Voir les résultats complets de la régression"):
+                st.text(model["summary"])
 
         # Interprétation des résultats
         st.header("Interprétation des résultats")
@@ -160,22 +209,13 @@ def regression_analysis_page():
             """
         )
 
-        residuals = final_model.resid
-        fitted = final_model.fittedvalues
+        if model is not None:
+            # Résidus vs valeurs ajustées
+            st.image(model_figure(model, "residuals_vs_fitted"), width="stretch")
 
-        # Résidus vs valeurs ajustées
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.scatter(fitted, residuals, alpha=0.6)
-        ax.axhline(0, color='red', linestyle='--')
-        ax.set_title("Résidus vs Valeurs ajustées")
-        ax.set_xlabel("Valeurs ajustées")
-        ax.set_ylabel("Résidus")
-        st.pyplot(fig)
-
-        # QQ Plot
-        st.subheader("QQ Plot (Normalité des résidus)")
-        qq_fig = sm.qqplot(residuals, line='45', fit=True)
-        st.pyplot(qq_fig)
+            # QQ Plot
+            st.subheader("QQ Plot (Normalité des résidus)")
+            st.image(model_figure(model, "residuals_qqplot"), width="stretch")
 
         # Explication sur la faible valeur de R²
         st.header("Discussion sur le R²")
@@ -189,6 +229,45 @@ def regression_analysis_page():
             """
         )
 
+        # Prévisions « et si » du modèle final
+        if model is not None:
+            scenario_section()
+
+        # Stabilité de la sélection : rééchantillonnage bootstrap et validation croisée
+        st.header("Stabilité de la sélection")
+        st.markdown(
+            """
+            La sélection backward est relancée sur 1 000 échantillons bootstrap des communes, et le modèle
+            est évalué hors échantillon par validation croisée (5 répétitions de 10 blocs).
+            """
+        )
+        # Lancé en arrière-plan sur demande ; une session qui arrive pendant le
+        # calcul voit sa progression au lieu du bouton
+        stability = model_stability(compute=False)
+        stability_key = ("model_stability", stability_fingerprint())
+        if stability is None and (get(stability_key) is not None
+                                  or st.button("Lancer le rééchantillonnage (quelques secondes)")):
+            stability = background_result(stability_key, model_stability, label="Rééchantillonnage")
+        if stability is not None and model is not None:
+            st.write(
+                f"R² en validation croisée : **{stability.cv_r2:.2f}** "
+                f"(par bloc : {stability.fold_r2.mean():.2f} ± {stability.fold_r2.std():.2f}), "
+                f"contre {model['rsquared']:.2f} sur l'échantillon d'estimation."
+            )
+            bands = stability.coefficient_bands().rename(columns={
+                "variable": "Variable", "frequency": "Fréquence de sélection", "mean": "Coefficient moyen",
+                "std": "Écart-type", "lower": "Borne 2,5 %", "upper": "Borne 97,5 %",
+            })
+            bands["Dans le modèle final"] = bands["Variable"].isin(model["selected"])
+            st.dataframe(
+                bands,
+                hide_index=True,
+                column_config={
+                    "Fréquence de sélection": st.column_config.ProgressColumn(min_value=0, max_value=1, format="percent"),
+                },
+            )
+            st.caption("Coefficients et bornes calculés sur les échantillons où la variable est retenue.")
+
         # Dictionnaire de données
         st.header("📘 Dictionnaire des données", anchor="data_dictionary")
         with st.expander("Voir le dictionnaire des données"):
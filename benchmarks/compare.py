@@ -0,0 +1,70 @@
+"""
+Compare two result files of benchmarks/run.py.
+
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+    python -m benchmarks.compare old.json new.json --threshold 1.2
+
+Prints the ratio new / old of the median time and of the peak memory of every
+case present in both files, and exits with status 1 when a median time grew by
+more than `threshold` (and by more than `min_seconds`: sub-millisecond cases
+are mostly noise), so the comparison can gate a CI job. Timings are only
+comparable between runs on the same machine (see the "environment" block).
+"""
+import argparse
+import json
+import sys
+
+
+def _cases(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    cases = {(result["benchmark"], result["case"]): result for result in report["results"] if "skipped" not in result}
+    return report["environment"], cases
+
+
+def compare(old_path, new_path, threshold=1.10, min_seconds=0.005):
+    """Rows (benchmark, case, old median, new median, time ratio, memory ratio) and the regressed cases."""
+    _, old = _cases(old_path)
+    _, new = _cases(new_path)
+    rows, regressions = [], []
+    for key in new:
+        if key not in old:
+            continue
+        time_ratio = new[key]["median"] / old[key]["median"] if old[key]["median"] else float("inf")
+        memory_ratio = new[key]["peak_bytes"] / old[key]["peak_bytes"] if old[key]["peak_bytes"] else float("inf")
+        rows.append((*key, old[key]["median"], new[key]["median"], time_ratio, memory_ratio))
+        if time_ratio > threshold and new[key]["median"] - old[key]["median"] > min_seconds:
+            regressions.append(key)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("old", help="baseline result file")
+    parser.add_argument("new", help="result file to check")
+    parser.add_argument("--threshold", type=float, default=1.10,
+                        help="largest accepted ratio of the median times (default: 1.10)")
+    parser.add_argument("--min-seconds", type=float, default=0.005,
+                        help="smallest slowdown reported, in seconds (default: 0.005)")
+    args = parser.parse_args(argv)
+
+    old_env, _ = _cases(args.old)
+    new_env, _ = _cases(args.new)
+    for field in ("machine", "cpus", "python", "numpy", "pandas"):
+        if old_env.get(field) != new_env.get(field):
+            print(f"warning: {field} differs ({old_env.get(field)} -> {new_env.get(field)})")
+
+    rows, regressions = compare(args.old, args.new, args.threshold, args.min_seconds)
+    width = max((len(f"{benchmark} {case}") for benchmark, case, *_ in rows), default=10)
+    print(f"{'case':<{width}}  {'old s':>9}  {'new s':>9}  {'time':>6}  {'memory':>6}")
+    for benchmark, case, old_median, new_median, time_ratio, memory_ratio in rows:
+        flag = "  <- slower" if (benchmark, case) in regressions else ""
+        print(f"{f'{benchmark} {case}':<{width}}  {old_median:>9.4f}  {new_median:>9.4f}  "
+              f"{time_ratio:>5.2f}x  {memory_ratio:>5.2f}x{flag}")
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than {args.threshold:.2f}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
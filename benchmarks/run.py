@@ -0,0 +1,300 @@
+"""
+Benchmarks of the hot paths: data loading, correlation screening, backward
+selection and page renders.
+
+    python -m benchmarks.run                          # every benchmark at 1x, 10x and 100x
+    python -m benchmarks.run --scales 1 10 --repeat 5
+    python -m benchmarks.run --only selection corr:screening --output /tmp/before.json
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+The data benchmarks run on synthetic scale-ups of the real tables (see
+benchmarks/synthetic.py), along the rows and along the columns. Each case is
+run `repeat` times for its wall time, then once more under tracemalloc for its
+peak of Python and NumPy allocations, so that tracing does not skew the
+timings. The pages are rendered headless with the Streamlit stub of
+benchmarks/streamlit_stub.py, cold (in-process caches emptied, artifacts on
+disk kept) and warm (a rerun), on the real tables.
+
+Results are written as JSON to benchmarks/results/<commit>.json, with the
+commit, library versions and machine, so that two commits can be compared.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import streamlit_stub
+from benchmarks.synthetic import scale_frame
+from scripts.utils import ROOT_DIR
+
+RESULTS_DIR = ROOT_DIR / "benchmarks" / "results"
+DEFAULT_SCALES = (1, 10, 100)
+
+# Page module -> page function, as registered in app/app.py
+PAGES = {
+    "home": "home_page",
+    "initiative": "initiative_page",
+    "beneficiaries": "beneficiaries_page",
+    "data_processing": "data_processing_page",
+    "regression_analysis": "regression_analysis_page",
+    "etude_de_cas": "etude_de_cas_page",
+}
+
+
+class Skip(Exception):
+    """A case that does not make sense at this scale."""
+
+
+def measure(run, repeat, setup=None):
+    """
+    Wall times of `repeat` calls of run() (setup() before each, untimed) and
+    peak traced memory of one more. An untimed first call pays the imports.
+    """
+    if setup:
+        setup()
+    run()
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds": [round(t, 6) for t in times],
+        "min": round(min(times), 6),
+        "median": round(statistics.median(times), 6),
+        "peak_bytes": peak,
+    }
+
+
+# Data benchmarks: each is called with (rows, columns, workdir) and returns
+# (shape, run) after preparing its input, or raises Skip.
+
+def bench_read_csv(rows, columns, workdir):
+    from scripts.preprocess import read_etude_2_cas
+
+    if columns != 1:
+        raise Skip("the raw table is only scaled along the rows")
+    raw = scale_frame(read_etude_2_cas(), rows=rows)
+    path = Path(workdir) / f"etude_2_cas_x{rows}.csv"
+    raw.to_csv(path, sep=";", encoding="latin1", index=False)
+    return raw.shape, lambda: read_etude_2_cas(path)
+
+
+def bench_clean(rows, columns, workdir):
+    from scripts.preprocess import clean_etude_2_cas, read_etude_2_cas
+
+    if columns != 1:
+        raise Skip("the raw table is only scaled along the rows")
+    raw = scale_frame(read_etude_2_cas(), rows=rows)
+    return raw.shape, lambda: clean_etude_2_cas(raw)
+
+
+def bench_read_parquet(rows, columns, workdir):
+    from scripts.preprocess import ROW_GROUP_SIZE
+    from scripts.utils import load_table
+
+    frame = scale_frame(load_table("etude_2_cas"), rows=rows, columns=columns, exclude=("Code",))
+    path = Path(workdir) / f"etude_2_cas_x{rows}_x{columns}.parquet"
+    frame.to_parquet(path, index=False, row_group_size=ROW_GROUP_SIZE)
+    return frame.shape, lambda: pd.read_parquet(path)
+
+
+def _regression_sample(rows, columns):
+    from scripts.regression import RESPONSES
+    from scripts.utils import load_table
+
+    return scale_frame(load_table("final_filtered_data_sample"), rows=rows, columns=columns,
+                       exclude=("code_insee", *RESPONSES))
+
+
+def _correlation_data(rows, columns):
+    from scripts.design import expand_categoricals
+    from scripts.regression import DROPPED_COLUMNS
+
+    return expand_categoricals(_regression_sample(rows, columns).drop(columns=list(DROPPED_COLUMNS)))
+
+
+def bench_corr_pandas(rows, columns, workdir):
+    data = _correlation_data(rows, columns)
+    return data.shape, data.corr
+
+
+def bench_corr_screening(rows, columns, workdir):
+    from scripts.regression import CORRELATION_THRESHOLD, correlated_pairs
+
+    data = _correlation_data(rows, columns)
+    n = data.shape[1]
+
+    # As in fit_regression: blocked screening filling the float32 matrix of the heatmap.
+    def run():
+        correlated_pairs(data, CORRELATION_THRESHOLD, out=np.empty((n, n), np.float32))
+
+    return data.shape, run
+
+
+def bench_selection(rows, columns, workdir):
+    from scripts.regression import design_matrix
+    from scripts.selection import backward_regression_with_logging
+
+    X, y = design_matrix(_regression_sample(rows, columns))
+    if X.shape[1] >= X.shape[0]:
+        raise Skip(f"{X.shape[1]} variables for {X.shape[0]} observations")
+    return X.shape, lambda: backward_regression_with_logging(X, y)
+
+
+DATA_BENCHMARKS = {
+    "read_csv": bench_read_csv,
+    "clean": bench_clean,
+    "read_parquet": bench_read_parquet,
+    "corr:pandas": bench_corr_pandas,
+    "corr:screening": bench_corr_screening,
+    "selection": bench_selection,
+}
+
+
+def run_data_benchmarks(names, scales, repeat):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names:
+            for axis in ("rows", "columns"):
+                for scale in scales:
+                    if axis == "columns" and scale == 1:
+                        continue  # same case as rows x1
+                    rows, columns = (scale, 1) if axis == "rows" else (1, scale)
+                    case = {"benchmark": name, "case": f"{axis} x{scale}", "rows": rows, "columns": columns}
+                    try:
+                        shape, run = DATA_BENCHMARKS[name](rows, columns, workdir)
+                    except Skip as reason:
+                        print(f"{name} {case['case']}: skipped ({reason})")
+                        results.append(dict(case, skipped=str(reason)))
+                        continue
+                    result = dict(case, shape=list(shape), **measure(run, repeat))
+                    del run
+                    print(f"{name} {case['case']} {shape}: {result['median']:.4f} s, "
+                          f"peak {result['peak_bytes'] / 1024 ** 2:.1f} MiB")
+                    results.append(result)
+    return results
+
+
+def render_page(module_name, function_name):
+    from navigation import import_page
+
+    return getattr(import_page(f"pages.{module_name}"), function_name)()
+
+
+def run_page_benchmarks(names, repeat):
+    from scripts import jobs
+    from scripts.utils import clear_cache
+
+    st = streamlit_stub.install()
+    # Basemap notices of folium, irrelevant without a browser
+    warnings.filterwarnings("ignore", category=UserWarning, module="folium")
+    if str(ROOT_DIR / "app") not in sys.path:
+        sys.path.insert(0, str(ROOT_DIR / "app"))
+
+    def cold():
+        streamlit_stub.clear_caches()
+        clear_cache()
+        jobs.clear()
+        st.session_state.clear()
+
+    results = []
+    for name in names:
+        function_name = PAGES[name]
+        for case, setup in (("cold", cold), ("warm", None)):
+            result = dict({"benchmark": f"page:{name}", "case": case},
+                          **measure(lambda: render_page(name, function_name), repeat, setup))
+            print(f"page:{name} {case}: {result['median']:.4f} s, peak {result['peak_bytes'] / 1024 ** 2:.1f} MiB")
+            results.append(result)
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import scipy
+    import statsmodels
+
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "statsmodels": statsmodels.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def default_output(env):
+    name = (env["commit"] or "unknown")[:12] + ("-dirty" if env["dirty"] else "")
+    return RESULTS_DIR / f"{name}.json"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the data loading, selection and page render paths.")
+    parser.add_argument("--scales", nargs="+", type=int, default=list(DEFAULT_SCALES),
+                        help="scale-up factors of the synthetic tables (default: 1 10 100)")
+    parser.add_argument("--only", nargs="+", default=None,
+                        help=f"benchmarks to run among {', '.join(DATA_BENCHMARKS)}, pages "
+                             f"or page:<name> (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (default: 3)")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="result file (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args(argv)
+
+    only = set(args.only or [*DATA_BENCHMARKS, "pages"])
+    pages = list(PAGES) if "pages" in only else [name[5:] for name in only if name.startswith("page:")]
+    unknown = only - set(DATA_BENCHMARKS) - {"pages"} - {f"page:{name}" for name in PAGES}
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    # The pages import streamlit: the stub must come first.
+    streamlit_stub.install()
+    env = environment()
+    results = run_data_benchmarks([name for name in DATA_BENCHMARKS if name in only], sorted(set(args.scales)),
+                                  args.repeat)
+    results += run_page_benchmarks(pages, args.repeat)
+
+    output = args.output or default_output(env)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {"environment": env, "scales": sorted(set(args.scales)), "repeat": args.repeat, "results": results}
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
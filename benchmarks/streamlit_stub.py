@@ -0,0 +1,210 @@
+"""
+Headless stand-in for streamlit and streamlit_folium.
+
+install() registers the stub modules in sys.modules before the pages are
+imported, so that a page function can be called like any other function. The
+stub keeps what costs time in a real rerun and drops the rest:
+
+- st.cache_resource / st.cache_data memoize on the arguments, like Streamlit,
+  and clear_caches() empties them to measure a cold render;
+- widgets return their default value (or the value stored under their key in
+  st.session_state);
+- the payloads sent to the browser are still built: Plotly figures are
+  serialized to JSON, DataFrames converted to Arrow and Folium maps rendered
+  to HTML, as Streamlit does before sending them;
+- background jobs (scripts/jobs.py) run inline: a headless render has no
+  later rerun to pick their results up, and the work is what is measured.
+
+Everything else (layout, text) is accepted and ignored.
+"""
+import functools
+import hashlib
+import os
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+
+_caches = []
+
+
+def clear_caches():
+    for cache in _caches:
+        cache.clear()
+
+
+def _freeze(value):
+    # Hashable stand-in for the arguments of a cached function
+    if isinstance(value, np.ndarray):
+        return ("ndarray", value.shape, value.dtype.str, hashlib.blake2b(np.ascontiguousarray(value)).hexdigest())
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return (type(value).__name__, hashlib.blake2b(pd.util.hash_pandas_object(value).to_numpy()).hexdigest())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _cache(function=None, **options):
+    def decorate(function):
+        cache = {}
+        _caches.append(cache)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (_freeze(args), _freeze(kwargs))
+            if key not in cache:
+                cache[key] = function(*args, **kwargs)
+            return cache[key]
+
+        wrapper.clear = cache.clear
+        return wrapper
+
+    return decorate(function) if callable(function) else decorate
+
+
+class SessionState(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class Element:
+    """Any container or widget: calls are accepted, widgets return their default."""
+
+    def __init__(self, module):
+        self._module = module
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, name):
+        method = getattr(self._module, name, None)
+        if callable(method):
+            return method
+        return lambda *args, **kwargs: Element(self._module)
+
+    def __call__(self, *args, **kwargs):
+        return Element(self._module)
+
+
+def _state_value(key, default):
+    state = sys.modules["streamlit"].session_state
+    if key is not None:
+        return state.setdefault(key, default)
+    return default
+
+
+def _install_streamlit():
+    st = types.ModuleType("streamlit")
+    st.session_state = SessionState()
+    st.query_params = {}
+    st.cache_resource = _cache
+    st.cache_data = _cache
+
+    def multiselect(label, options=(), default=None, key=None, **kwargs):
+        return _state_value(key, list(default or []))
+
+    def selectbox(label, options=(), index=0, key=None, **kwargs):
+        options = list(options)
+        return _state_value(key, options[index] if options and index is not None else None)
+
+    def radio(label, options=(), index=0, key=None, **kwargs):
+        return selectbox(label, options, index, key)
+
+    def slider(label, min_value=None, max_value=None, value=None, key=None, **kwargs):
+        return _state_value(key, value if value is not None else min_value)
+
+    def number_input(label, min_value=None, max_value=None, value=None, key=None, **kwargs):
+        return _state_value(key, value if value is not None else (min_value or 0))
+
+    def text_input(label, value="", key=None, **kwargs):
+        return _state_value(key, value)
+
+    def checkbox(label, value=False, key=None, **kwargs):
+        return _state_value(key, value)
+
+    def button(label, key=None, **kwargs):
+        return False
+
+    def columns(spec, **kwargs):
+        count = spec if isinstance(spec, int) else len(spec)
+        return [Element(st) for _ in range(count)]
+
+    def tabs(labels, **kwargs):
+        return [Element(st) for _ in labels]
+
+    def plotly_chart(figure, **kwargs):
+        figure.to_json()
+
+    def dataframe(data, **kwargs):
+        import pyarrow as pa
+
+        if isinstance(data, pd.DataFrame):
+            pa.Table.from_pandas(data)
+
+    def fragment(function=None, **kwargs):
+        return function if callable(function) else (lambda function: function)
+
+    for function in (multiselect, selectbox, radio, slider, number_input, text_input, checkbox, button,
+                     columns, tabs, plotly_chart, dataframe, fragment):
+        setattr(st, function.__name__, function)
+    st.select_slider = slider
+    st.toggle = checkbox
+    st.data_editor = dataframe
+    st.table = dataframe
+    st.column_config = Element(st)
+    st.sidebar = Element(st)
+
+    def __getattr__(name):
+        # Text, layout and status elements
+        return Element(st)
+
+    st.__getattr__ = __getattr__
+    sys.modules["streamlit"] = st
+    return st
+
+
+def _install_streamlit_folium():
+    module = types.ModuleType("streamlit_folium")
+
+    def st_folium(fig, key=None, feature_group_to_add=None, returned_objects=None, **kwargs):
+        import folium
+
+        fig.get_root().render()
+        if feature_group_to_add is not None:
+            # Rendered on its own map, like streamlit_folium sends the dynamic layer apart from the base map
+            layer_map = folium.Map()
+            feature_group_to_add.add_to(layer_map)
+            layer_map.get_root().render()
+        return {}
+
+    module.st_folium = st_folium
+    sys.modules["streamlit_folium"] = module
+    return module
+
+
+def install():
+    """Register the stub modules; must run before the pages are imported."""
+    if "streamlit" in sys.modules and not isinstance(sys.modules["streamlit"].__dict__.get("session_state"),
+                                                      SessionState):
+        raise RuntimeError("streamlit is already imported: install the stub first")
+    if "streamlit" not in sys.modules:
+        _install_streamlit()
+        _install_streamlit_folium()
+    os.environ["PROJET_DATA_JOBS"] = "0"
+    return sys.modules["streamlit"]
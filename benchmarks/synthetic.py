@@ -0,0 +1,50 @@
+"""
+Repeatable synthetic scale-ups of the commune tables.
+
+A scale-up keeps the shape of the real data so that the benchmarks exercise
+the same code paths with more work:
+
+- rows x k: the rows are drawn with replacement (a bootstrap of the communes)
+  and their float columns jittered by 1 %, so that no two copies are equal;
+- columns x k: every numeric column gets k - 1 copies whose values are
+  shuffled across the rows. A copy has the distribution of its column but no
+  relation to the response, like the many noise variables of a wide
+  extraction, and it is not correlated enough to be screened out.
+
+Everything is drawn from a fixed seed: the same scale gives the same frame.
+"""
+import numpy as np
+import pandas as pd
+
+JITTER = 0.01
+
+
+def scale_rows(frame, factor, rng):
+    if factor == 1:
+        return frame
+    rows = rng.integers(0, len(frame), len(frame) * factor)
+    scaled = frame.take(rows).reset_index(drop=True)
+    for column in scaled.columns:
+        if pd.api.types.is_float_dtype(scaled[column]):
+            values = scaled[column].to_numpy()
+            noise = 1 + JITTER * rng.standard_normal(len(values))
+            scaled[column] = (values * noise).astype(values.dtype)
+    return scaled
+
+
+def scale_columns(frame, factor, rng, exclude=()):
+    if factor == 1:
+        return frame
+    columns = {column: frame[column] for column in frame.columns}
+    numeric = [column for column in frame.columns
+               if column not in exclude and pd.api.types.is_numeric_dtype(frame[column])]
+    for copy in range(1, factor):
+        for column in numeric:
+            columns[f"{column}__{copy}"] = frame[column].to_numpy()[rng.permutation(len(frame))]
+    return pd.DataFrame(columns)
+
+
+def scale_frame(frame, rows=1, columns=1, seed=0, exclude=()):
+    """`frame` with `rows` times its rows and `columns` times its numeric columns (except `exclude`)."""
+    rng = np.random.default_rng(seed)
+    return scale_columns(scale_rows(frame, rows, rng), columns, rng, exclude)
@@ -0,0 +1,125 @@
+"""
+Persistent cache for computed artifacts (fitted models, rendered figures, ...).
+
+An artifact is identified by a kind and a fingerprint of everything it depends
+on: input files are hashed by content, other parameters by their repr. It is
+pickled under data/cache/<kind>/<fingerprint>.pkl (or PROJET_DATA_CACHE_DIR)
+and also kept in memory, so a page gets it back in milliseconds and only
+recomputes it when one of its inputs changes.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+from scripts.instrumentation import stage
+from scripts.utils import DATA_DIR, SizedLRUCache, file_version, key_lock, object_nbytes
+
+CACHE_DIR = Path(os.environ.get("PROJET_DATA_CACHE_DIR", DATA_DIR / "cache"))
+
+_memory = SizedLRUCache(
+    max_bytes=int(float(os.environ.get("PROJET_DATA_ARTIFACT_MB", "128")) * 1024 ** 2),
+    max_entries=256,
+)
+_file_hashes = {}
+
+
+def file_digest(path):
+    """sha256 of a file's content, memoized on its mtime and size."""
+    path = Path(path).resolve()
+    version = file_version(path)
+    cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    _file_hashes[path] = (version, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def fingerprint(*parts):
+    """
+    Stable hash of the inputs of a computation. Path objects stand for the
+    content of the file they point to; anything else is hashed through repr().
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, Path):
+            digest.update(b"file:" + file_digest(part).encode())
+        else:
+            digest.update(b"value:" + repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def artifact_path(kind, key):
+    return CACHE_DIR / kind / f"{key}.pkl"
+
+
+def load_artifact(kind, key):
+    """Return the cached artifact, or None if it was never computed or is unreadable."""
+    value = _memory.get((kind, key))
+    if value is not None:
+        return value
+    try:
+        with stage(f"read {kind} artifact", "load"), open(artifact_path(kind, key), "rb") as f:
+            value = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    # Mark the file as recently used for prune_artifacts()
+    try:
+        os.utime(artifact_path(kind, key))
+    except OSError:
+        pass
+    _memory.put((kind, key), value, object_nbytes(value))
+    return value
+
+
+def save_artifact(kind, key, value):
+    path = artifact_path(kind, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so that a concurrent reader never sees a partial file.
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+    _memory.put((kind, key), value, object_nbytes(value))
+
+
+def prune_artifacts(kind, max_bytes):
+    """
+    Delete the least recently used artifacts of `kind` on disk (by the time
+    they were last written or read from disk) until they fit in `max_bytes`.
+    """
+    files = []
+    for path in (CACHE_DIR / kind).glob("*.pkl"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cached_artifact(kind, key, builder):
+    """Return the artifact (kind, key), calling builder() and saving its result on a miss."""
+    value = load_artifact(kind, key)
+    if value is None:
+        with key_lock(("artifact", kind, key)):
+            value = load_artifact(kind, key)
+            if value is None:
+                value = builder()
+                save_artifact(kind, key, value)
+    return value
@@ -0,0 +1,130 @@
+"""
+PVD-likeness: how much a commune resembles the communes of Petites Villes de Demain.
+
+A logistic regression predicts the membership of the programme (the codes of
+PVD.geojson, see queries.pvd_codes) from the indicators of etude_2_cas:
+population, income, age shares, services and sports equipment, counts taken
+as log(1 + n), missing values replaced by the median and every feature
+standardized. The score of a commune is its out-of-fold probability (5-fold
+cross-validation), so that a PVD commune is not scored by a model that has
+seen it; its percentile ranks it among all the communes.
+
+The model is fitted and the ~35 000 communes scored in one vectorized pass
+when the inputs change, and the result is kept on disk as the "classifier"
+artifact: pages only look the scores up, as columns of PvdClassifier.table().
+
+The scores are not written as a column of etude_2_cas by scripts/preprocess.py:
+a preprocessed table is compiled from a single raw source, without
+scikit-learn, while the scores depend on two sources (etude_2_cas.csv and the
+PVD list) and on the model. The artifact is keyed on both sources, the
+pipeline version and CLASSIFIER_VERSION, so it is recomputed whenever any of
+them changes, and a column of the table would go stale silently.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from scripts.artifacts import cached_artifact, fingerprint
+from scripts.instrumentation import stage
+from scripts.preprocess import PIPELINE_VERSION, TABLES
+from scripts.queries import pvd_codes, pvd_table
+from scripts.similarity import COUNT_FEATURES, POPULATION, standardized_features
+from scripts.similarity import FEATURES as INDICATORS
+from scripts.utils import load_table
+
+# Bump when the features, the model or the content of the artifact change.
+CLASSIFIER_VERSION = 1
+
+FEATURES = [POPULATION, *INDICATORS]
+LOG_FEATURES = [POPULATION, *COUNT_FEATURES]
+FOLDS = 5
+SEED = 0
+
+
+@dataclass
+class PvdClassifier:
+    key: str
+    features: list
+    codes: pd.Index
+    labels: np.ndarray
+    pvd: np.ndarray  # membership used as target, in table order
+    scores: np.ndarray  # out-of-fold probability of membership
+    percentiles: np.ndarray  # share of the communes with a lower score, in %
+    coefficients: pd.Series  # log-odds per standard deviation of each feature
+    intercept: float
+    matrix: np.ndarray  # standardized features, float32
+    auc: float  # out-of-fold area under the ROC curve
+
+    def rows(self, codes):
+        """Positions of the INSEE codes `codes`, -1 when unknown."""
+        return self.codes.get_indexer([str(code).strip().zfill(5) for code in codes])
+
+    def score(self, codes):
+        """Scores of `codes`, NaN for the communes absent from etude_2_cas."""
+        rows = self.rows(codes)
+        return np.where(rows >= 0, self.scores[rows], np.nan)
+
+    def table(self, codes=None):
+        """Code, label, membership, score and percentile of `codes` (all communes by default)."""
+        rows = np.arange(len(self.codes)) if codes is None else self.rows(codes)
+        rows = rows[rows >= 0]
+        return pd.DataFrame({
+            "Code": self.codes[rows],
+            "Libellé": self.labels[rows],
+            "PVD": self.pvd[rows],
+            "Score PVD": self.scores[rows],
+            "Percentile PVD": self.percentiles[rows],
+        })
+
+    def contributions(self, codes):
+        """Contribution of each feature to the log-odds of `codes` (features x communes), relative to the average commune."""
+        rows = self.rows(codes)
+        rows = rows[rows >= 0]
+        return pd.DataFrame(self.matrix[rows].T * self.coefficients.to_numpy()[:, None],
+                            index=self.features, columns=self.codes[rows])
+
+
+def fit_classifier(frame, members, key=None, features=FEATURES, folds=FOLDS, seed=SEED):
+    """Fit the model on `frame` (etude_2_cas) with the INSEE codes `members` as positives, and score every row."""
+    # Only needed on a cache miss
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import roc_auc_score
+    from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+    codes = pd.Index(frame["Code"].astype(str).str.zfill(5))
+    target = codes.isin(list(members))
+    with stage("PVD features", "transform"):
+        matrix, _, _ = standardized_features(frame, features, LOG_FEATURES)
+
+    model = LogisticRegression(max_iter=1000)
+    with stage("PVD classifier", "fit"):
+        splits = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+        scores = cross_val_predict(model, matrix, target, cv=splits, method="predict_proba")[:, 1]
+        model.fit(matrix, target)
+
+    ranks = pd.Series(scores).rank(method="min").to_numpy()
+    return PvdClassifier(
+        key=key,
+        features=list(features),
+        codes=codes,
+        labels=frame["Libellé"].to_numpy(dtype=object),
+        pvd=target,
+        scores=scores,
+        percentiles=100 * (ranks - 1) / len(scores),
+        coefficients=pd.Series(model.coef_[0], index=list(features)),
+        intercept=float(model.intercept_[0]),
+        matrix=matrix.astype(np.float32),
+        auc=float(roc_auc_score(target, scores)),
+    )
+
+
+def classifier_fingerprint(table="etude_2_cas"):
+    return fingerprint(TABLES[table][0], TABLES[pvd_table()][0], PIPELINE_VERSION, CLASSIFIER_VERSION,
+                       FEATURES, FOLDS, SEED)
+
+
+def pvd_classifier(table="etude_2_cas"):
+    """The PvdClassifier of `table` and its scores, loaded from disk when available."""
+    key = classifier_fingerprint(table)
+    return cached_artifact("classifier", key, lambda: fit_classifier(load_table(table), pvd_codes(), key))
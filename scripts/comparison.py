@@ -0,0 +1,179 @@
+"""
+Place communes against the distribution of their peers.
+
+The indicators of etude_2_cas are ranked once over the whole country. For each
+way of grouping the communes (whole country, region, GCD density class, AAV
+class) every indicator is then sorted within each group, under an int64 key
+(indicator, group, national rank). The position of any set of communes within
+their own group is one np.searchsorted over these keys, and the group
+quantiles are read off the sorted arrays, so a comparison never rescans the
+table.
+
+The GCD and AAV classes are only known for the communes of the regression
+sample (the PVD communes); the other communes have no peer group for them.
+"""
+import numpy as np
+import pandas as pd
+
+from scripts.geo import region_of
+from scripts.utils import cached_derived, file_version, load_table, table_path
+
+# Peer groups: key -> label shown in the app
+GROUPINGS = {
+    "france": "France entière",
+    "region": "Région",
+    "gcd": "Grille communale de densité",
+    "aav": "Aire d'attraction des villes",
+}
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+
+def commune_groups(codes, sample="final_filtered_data_sample"):
+    """Peer group of each commune for every grouping of GROUPINGS ("" when unknown)."""
+    codes = pd.Index(pd.Series(codes, dtype="str").str.zfill(5))
+    frame = load_table(sample)
+    sample_codes = pd.Index(frame["code_insee"].astype(str))
+    groups = pd.DataFrame(index=codes)
+    groups["france"] = "France"
+    groups["region"] = region_of(codes).to_numpy()
+    for name, column in (("gcd", "GCD"), ("aav", "AAV")):
+        classes = pd.Series(frame[column].astype(object).fillna("").to_numpy(), index=sample_codes)
+        groups[name] = classes[~classes.index.duplicated()].reindex(codes).fillna("").to_numpy()
+    return groups
+
+
+class PeerGroups:
+    """Indicators sorted within each group of one grouping of the communes."""
+
+    def __init__(self, labels, ranks, values):
+        nrows, ncols = values.shape
+        names, ids = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        # "" sorts first: communes without a group get -1 and are left out
+        if len(names) and names[0] == "":
+            names, ids = names[1:], ids - 1
+        self.names = names.tolist()
+        self.ids = ids.astype(np.int32)
+        self.width = nrows + 1
+        ngroups = len(self.names)
+
+        member = self.ids >= 0
+        indicator = np.broadcast_to(np.arange(ncols), (nrows, ncols))[member]
+        keys = (indicator * ngroups + self.ids[member, None]) * self.width + ranks[member]
+        order = np.argsort(keys, axis=None, kind="stable")
+        self.keys = keys.ravel()[order]
+        self.sorted_values = values[member].ravel()[order]
+
+        # Block of (indicator, group) in the sorted arrays; missing values
+        # (rank nrows) sit at the end of their block and are not counted.
+        base = (np.arange(ncols)[:, None] * ngroups + np.arange(ngroups)) * self.width
+        self.starts = np.searchsorted(self.keys, base)
+        self.counts = np.searchsorted(self.keys, base + nrows) - self.starts
+
+        filled = np.nan_to_num(self.sorted_values.astype(np.float64))
+        cumulative = np.concatenate([[0.0], np.cumsum(filled)])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.means = (cumulative[self.starts + self.counts] - cumulative[self.starts]) / self.counts
+        self.quantiles = np.stack([self._quantile(q) for q in QUANTILES], axis=-1)
+
+    def _quantile(self, q):
+        # Linear interpolation between the closest ranks, as np.quantile
+        position = q * np.maximum(self.counts - 1, 0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, np.maximum(self.counts - 1, 0))
+        last = len(self.sorted_values) - 1
+        lower = self.sorted_values[np.minimum(self.starts + low, last)]
+        upper = self.sorted_values[np.minimum(self.starts + high, last)]
+        value = lower + (position - low) * (upper - lower)
+        return np.where(self.counts > 0, value, np.nan)
+
+    def percentiles(self, rows, ranks):
+        """
+        Mid-rank percentile (0-100) of communes `rows` within their group, for
+        every indicator, given their national ranks (len(rows), ncols).
+        """
+        ncols = ranks.shape[1]
+        groups = self.ids[rows][:, None]
+        block = np.arange(ncols) * len(self.names) + np.maximum(groups, 0)
+        keys = block * self.width + ranks
+        below = np.searchsorted(self.keys, keys, side="left")
+        through = np.searchsorted(self.keys, keys, side="right")
+        starts = self.starts[np.arange(ncols), np.maximum(groups, 0)]
+        counts = self.counts[np.arange(ncols), np.maximum(groups, 0)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            percentile = 100 * ((below - starts) + (through - starts)) / 2 / counts
+        missing = (groups < 0) | (ranks >= self.width - 1) | (counts == 0)
+        return np.where(missing, np.nan, percentile)
+
+
+class ComparisonEngine:
+    """Peer distributions of the indicators of etude_2_cas for every grouping of GROUPINGS."""
+
+    def __init__(self, frame, groups, code_column="Code", label_column="Libellé"):
+        self.indicators = [column for column in frame.columns
+                           if column not in (code_column, label_column) and pd.api.types.is_numeric_dtype(frame[column])]
+        self.index = pd.Index(frame[code_column].astype(str))
+        self.labels = frame[label_column].astype(str).to_numpy()
+        self.values = frame[self.indicators].to_numpy(dtype=np.float32, na_value=np.nan)
+
+        # National rank of each value (ties share the lowest rank, missing ones get nrows)
+        nrows = len(frame)
+        self.ranks = np.full(self.values.shape, nrows, dtype=np.int64)
+        for j in range(len(self.indicators)):
+            column = self.values[:, j]
+            valid = ~np.isnan(column)
+            self.ranks[valid, j] = np.searchsorted(np.sort(column[valid]), column[valid], side="left")
+
+        self.group_labels = groups
+        self.groupings = {name: PeerGroups(groups[name].to_numpy(), self.ranks, self.values) for name in GROUPINGS}
+
+    @classmethod
+    def from_frame(cls, frame, code_column="Code"):
+        return cls(frame, commune_groups(frame[code_column].astype(str)), code_column)
+
+    def compare(self, codes, grouping="region"):
+        """
+        Position of the communes `codes` within their peer group: one row per
+        commune and indicator, with the value, the group, its size, the
+        percentile of the commune and the group quantiles. Unknown codes are skipped.
+        """
+        rows = self.index.get_indexer(pd.Index([str(code).strip().zfill(5) for code in codes]))
+        rows = rows[rows >= 0]
+        peers = self.groupings[grouping]
+        ncols = len(self.indicators)
+        percentiles = peers.percentiles(rows, self.ranks[rows])
+
+        groups = np.maximum(peers.ids[rows], 0)[:, None]
+        counts = np.where(peers.ids[rows, None] >= 0, peers.counts[np.arange(ncols), groups], 0)
+        quantiles = peers.quantiles[np.arange(ncols), groups]
+        result = pd.DataFrame({
+            "Code": np.repeat(self.index[rows].to_numpy(), ncols),
+            "Libellé": np.repeat(self.labels[rows], ncols),
+            "Indicateur": np.tile(self.indicators, len(rows)),
+            "Valeur": self.values[rows].ravel(),
+            "Groupe": np.repeat(self.group_labels[grouping].to_numpy()[rows], ncols),
+            "Communes du groupe": counts.ravel(),
+            "Percentile": percentiles.ravel(),
+        })
+        for k, q in enumerate(QUANTILES):
+            result[f"Q{round(q * 100)}"] = np.where(counts > 0, quantiles[..., k], np.nan).ravel()
+        return result
+
+    def statistics(self, grouping="region"):
+        """Size, mean and quantiles of every indicator in each group of `grouping`."""
+        peers = self.groupings[grouping]
+        ngroups = len(peers.names)
+        result = pd.DataFrame({
+            "Groupe": np.tile(peers.names, len(self.indicators)),
+            "Indicateur": np.repeat(self.indicators, ngroups),
+            "Communes": peers.counts.ravel(),
+            "Moyenne": peers.means.ravel(),
+        })
+        for k, q in enumerate(QUANTILES):
+            result[f"Q{round(q * 100)}"] = peers.quantiles[..., k].ravel()
+        return result
+
+
+def comparison_engine():
+    """The ComparisonEngine of etude_2_cas, built once per version of its tables."""
+    sample_version = file_version(table_path("final_filtered_data_sample"))
+    return cached_derived("etude_2_cas", ("comparison", sample_version), ComparisonEngine.from_frame)
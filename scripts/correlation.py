@@ -0,0 +1,123 @@
+"""
+Correlation screening for wide commune tables.
+
+The columns are standardized in float32 so that the correlation of two columns
+is the dot product of their standardized vectors. The correlation matrix is
+then computed block by block and only the upper-triangle pairs above the
+threshold are kept, so the full p x p matrix is never materialized unless the
+caller asks for it (out=, e.g. for a heatmap), in which case it is filled from
+the same block products rather than computed a second time. When the
+standardized table itself would not fit in the memory budget, the column
+blocks are standardized on the fly from the source.
+
+Missing values are replaced by the column mean (0 once standardized), which
+matches pandas' pairwise-complete correlation when the data has no gaps.
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def _column_block(X, start, stop):
+    if isinstance(X, pd.DataFrame):
+        return X.iloc[:, start:stop].to_numpy(dtype=np.float32, na_value=np.nan)
+    return np.asarray(X[:, start:stop], dtype=np.float32)
+
+
+def _standardize(block):
+    # Centered, unit-norm columns: Z_i . Z_j is the Pearson correlation.
+    mean = np.nanmean(block, axis=0)
+    block = block - mean
+    block[np.isnan(block)] = 0
+    norm = np.sqrt(np.einsum("ij,ij->j", block, block))
+    # Constant columns stay at zero and are never reported as correlated.
+    norm[norm == 0] = np.inf
+    return block / norm
+
+
+def _block_size(nrows, ncols, max_bytes):
+    # Two standardized column blocks (n x b) and their product (b x b) in float32.
+    budget = max_bytes // 4
+    block = ncols
+    while block > 1 and 2 * nrows * block + block * block > budget:
+        block //= 2
+    return max(block, 1)
+
+
+def correlated_pairs(X, threshold=0.85, absolute=False, max_bytes=DEFAULT_MAX_BYTES, block_size=None, out=None):
+    """
+    Pairs of columns of X (DataFrame or 2-D array) whose correlation exceeds
+    `threshold` (in absolute value if `absolute`), as a DataFrame with the
+    columns variable_1, variable_2 and correlation, strongest first. If `out`
+    (a p x p float32 array) is given, the full correlation matrix is written to it.
+    """
+    names = list(X.columns) if isinstance(X, pd.DataFrame) else list(range(X.shape[1]))
+    nrows, ncols = X.shape
+    block = block_size or _block_size(nrows, ncols, max_bytes)
+
+    # Standardize everything once if it fits in half the budget.
+    standardized = None
+    if nrows * ncols * 4 <= max_bytes // 2:
+        standardized = _standardize(_column_block(X, 0, ncols))
+
+    def column_block(start, stop):
+        if standardized is not None:
+            return standardized[:, start:stop]
+        return _standardize(_column_block(X, start, stop))
+
+    rows, cols, values = [], [], []
+    for i0 in range(0, ncols, block):
+        i1 = min(i0 + block, ncols)
+        left = column_block(i0, i1)
+        for j0 in range(i0, ncols, block):
+            j1 = min(j0 + block, ncols)
+            product = left.T @ (left if j0 == i0 else column_block(j0, j1))
+            if out is not None:
+                out[i0:i1, j0:j1] = product
+                out[j0:j1, i0:i1] = product.T
+            hits = np.abs(product) > threshold if absolute else product > threshold
+            if j0 == i0:
+                hits &= np.triu(np.ones(hits.shape, dtype=bool), k=1)
+            ii, jj = np.nonzero(hits)
+            rows.append(ii + i0)
+            cols.append(jj + j0)
+            values.append(product[ii, jj])
+
+    rows, cols, values = (np.concatenate(a) if a else np.empty(0) for a in (rows, cols, values))
+    order = np.argsort(-np.abs(values), kind="stable")
+    return pd.DataFrame({
+        "variable_1": [names[i] for i in rows[order]],
+        "variable_2": [names[j] for j in cols[order]],
+        "correlation": values[order].astype(np.float32),
+    })
+
+
+def prune_correlated(X, threshold=0.85, absolute=True, keep=(), max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Greedily drop columns until no pair exceeds `threshold`: the column
+    involved in the most remaining pairs goes first (ties: the later column).
+    Columns in `keep` are never dropped. Returns (kept columns, dropped columns, pairs).
+    """
+    pairs = correlated_pairs(X, threshold, absolute=absolute, max_bytes=max_bytes)
+    names = list(X.columns) if isinstance(X, pd.DataFrame) else list(range(X.shape[1]))
+    position = {name: i for i, name in enumerate(names)}
+    first = np.array([position[name] for name in pairs["variable_1"]], dtype=np.int64)
+    second = np.array([position[name] for name in pairs["variable_2"]], dtype=np.int64)
+    protected = np.zeros(len(names), dtype=bool)
+    protected[[position[name] for name in keep if name in position]] = True
+
+    alive = np.ones(len(first), dtype=bool)
+    dropped = []
+    while alive.any():
+        degree = np.bincount(first[alive], minlength=len(names)) + np.bincount(second[alive], minlength=len(names))
+        degree[protected] = 0
+        if degree.max() == 0:
+            break
+        # Last index among the columns with the highest degree
+        victim = len(names) - 1 - int(np.argmax(degree[::-1]))
+        dropped.append(names[victim])
+        alive &= (first != victim) & (second != victim)
+
+    kept = [name for name in names if name not in set(dropped)]
+    return kept, dropped, pairs
@@ -0,0 +1,123 @@
+"""
+Indicator (one-hot) columns built on demand from categorical columns.
+
+The regression sample stores each class dimension (GCD density grid, AAV
+urban area class) as a single pandas categorical with int8 codes instead of
+one float column per class. expand_categoricals() rebuilds the dummy columns
+at fit time, in place of the categorical column and in category order, named
+`<prefix><level>` with the spaces of the level replaced by underscores, so
+that the drop-first encoding of the original export (and the published
+model) is reproduced column for column. one_hot() gives the bare matrix,
+dense uint8 or scipy.sparse, for callers that do not need a DataFrame.
+
+A new dimension only needs a text column in the raw file: the preprocessing
+stores it as a categorical, and it is expanded with its first level as the
+reference unless CATEGORICAL_DIMENSIONS says otherwise. Which columns are
+expanded depends only on the dtypes, never on the values, so a filtered
+subset gives a design matrix of the same shape; commune keys and labels
+(KEY_COLUMNS) are never expanded.
+"""
+import numpy as np
+import pandas as pd
+
+# Column -> (dummy prefix, reference level dropped by the drop-first encoding)
+CATEGORICAL_DIMENSIONS = {
+    "GCD": ("GCD_", "1 - Grands centres urbains"),
+    "AAV": ("AAV_", "11 - Poles de moins de 50 000 hab."),
+}
+
+# Categorical identifiers of the preprocessed tables, never expanded into dummies
+KEY_COLUMNS = ("code_insee", "Code", "code", "Libellé", "lib_com")
+
+
+def dummy_name(prefix, level):
+    return prefix + str(level).replace(" ", "_")
+
+
+def dummy_level(prefix, name):
+    return name[len(prefix):].replace("_", " ")
+
+
+def collapse_dummies(frame, column, prefix, reference):
+    """
+    `frame` with its drop-first dummy columns `prefix`<level> replaced by one
+    categorical `column`, at the place of the first of them. Rows without any
+    dummy set are the `reference` level, which comes first in the categories.
+    """
+    dummies = [name for name in frame.columns if name.startswith(prefix)]
+    if not dummies:
+        return frame
+    values = frame[dummies].to_numpy()
+    if ((values != 0) & (values != 1)).any() or (values.sum(axis=1) > 1).any():
+        raise ValueError(f"the {prefix}* columns are not a one-hot encoding")
+    codes = np.where(values.any(axis=1), values.argmax(axis=1) + 1, 0)
+    levels = [reference] + [dummy_level(prefix, name) for name in dummies]
+    categorical = pd.Categorical.from_codes(codes, categories=levels)
+
+    columns = {}
+    for name in frame.columns:
+        if name == dummies[0]:
+            columns[column] = categorical
+        elif name not in dummies:
+            columns[name] = frame[name]
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def one_hot(values, prefix="", drop_first=True, reference=None, sparse=False, dtype=np.uint8):
+    """
+    Indicator matrix of the categorical `values` and the names of its columns,
+    one per level in category order. With drop_first, the `reference` level
+    (the first by default) gets no column. Missing values give a row of zeros.
+    The matrix is a dense array of `dtype`, or a scipy.sparse CSR matrix.
+    """
+    values = values if isinstance(values, pd.Categorical) else pd.Categorical(values)
+    levels = list(values.categories)
+    kept = list(range(len(levels)))
+    if drop_first and levels:
+        kept.remove(levels.index(reference) if reference is not None else 0)
+
+    # Matrix column of each category code; code -1 (missing) reads the last entry
+    column_of = np.full(len(levels) + 1, -1, dtype=np.int64)
+    column_of[kept] = np.arange(len(kept))
+    columns = column_of[values.codes]
+    rows = np.flatnonzero(columns >= 0)
+    shape = (len(values), len(kept))
+    if sparse:
+        from scipy import sparse as sp
+
+        matrix = sp.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, columns[rows])), shape=shape)
+    else:
+        matrix = np.zeros(shape, dtype=dtype)
+        matrix[rows, columns[rows]] = 1
+    return matrix, [dummy_name(prefix, levels[i]) for i in kept]
+
+
+def expand_categoricals(frame, columns=None, drop_first=True, references=None, sparse=False, dtype=np.uint8):
+    """
+    `frame` with each categorical column of `columns` replaced, at its place,
+    by its indicator columns. By default every categorical column is expanded
+    except the keys of KEY_COLUMNS.
+    `references` maps a column to its reference level (default:
+    CATEGORICAL_DIMENSIONS, else the first level); sparse=True gives pandas
+    sparse columns.
+    """
+    if columns is None:
+        columns = [name for name in frame.columns
+                   if isinstance(frame[name].dtype, pd.CategoricalDtype) and name not in KEY_COLUMNS]
+    if not columns:
+        return frame
+    references = references or {}
+
+    expanded = {}
+    for name in frame.columns:
+        if name not in columns:
+            expanded[name] = frame[name]
+            continue
+        prefix, reference = CATEGORICAL_DIMENSIONS.get(name, (f"{name}_", None))
+        matrix, names = one_hot(frame[name].array, prefix, drop_first, references.get(name, reference), sparse, dtype)
+        if sparse:
+            block = pd.DataFrame.sparse.from_spmatrix(matrix, index=frame.index, columns=names)
+            expanded.update({dummy: block[dummy] for dummy in names})
+        else:
+            expanded.update({dummy: matrix[:, j] for j, dummy in enumerate(names)})
+    return pd.DataFrame(expanded, index=frame.index)
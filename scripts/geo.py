@@ -0,0 +1,369 @@
+"""
+Map layers of the PVD communes, compiled offline from data/PVD.geojson.
+
+build_pvd_layers() simplifies each commune outline once per zoom level
+(Douglas-Peucker with a tolerance of half a screen pixel at that zoom),
+rounds the coordinates to the matching precision, bakes the region fill colour
+into the feature properties and indexes the features by web-mercator tile.
+At display time the map only sends the features of the tiles in view, at the
+level of detail of the current zoom.
+
+PolygonIndex finds the commune under a clicked point from the full-resolution
+outlines: a grid lists the features whose bounding box overlaps each cell, so
+a lookup only runs the point-in-polygon test on the one to three candidates
+of its cell, vectorized over their edges.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+# Fill colour of each region on the beneficiaries map
+REGION_COLORS = {
+    "Auvergne-Rhône-Alpes": "blue",
+    "Bourgogne-Franche-Comté": "green",
+    "Bretagne": "purple",
+    "Centre-Val de Loire": "orange",
+    "Corse": "red",
+    "Grand Est": "cyan",
+    "Hauts-de-France": "pink",
+    "Île-de-France": "yellow",
+    "Normandie": "brown",
+    "Nouvelle-Aquitaine": "darkgreen",
+    "Occitanie": "darkblue",
+    "Pays de la Loire": "gold",
+    "Provence-Alpes-Côte d'Azur": "darkred",
+}
+DEFAULT_COLOR = "gray"
+
+# Departments of each region (2023 map), to place a commune from its INSEE code
+REGION_DEPARTMENTS = {
+    "Auvergne-Rhône-Alpes": ("01", "03", "07", "15", "26", "38", "42", "43", "63", "69", "73", "74"),
+    "Bourgogne-Franche-Comté": ("21", "25", "39", "58", "70", "71", "89", "90"),
+    "Bretagne": ("22", "29", "35", "56"),
+    "Centre-Val de Loire": ("18", "28", "36", "37", "41", "45"),
+    "Corse": ("2A", "2B"),
+    "Grand Est": ("08", "10", "51", "52", "54", "55", "57", "67", "68", "88"),
+    "Hauts-de-France": ("02", "59", "60", "62", "80"),
+    "Île-de-France": ("75", "77", "78", "91", "92", "93", "94", "95"),
+    "Normandie": ("14", "27", "50", "61", "76"),
+    "Nouvelle-Aquitaine": ("16", "17", "19", "23", "24", "33", "40", "47", "64", "79", "86", "87"),
+    "Occitanie": ("09", "11", "12", "30", "31", "32", "34", "46", "48", "65", "66", "81", "82"),
+    "Pays de la Loire": ("44", "49", "53", "72", "85"),
+    "Provence-Alpes-Côte d'Azur": ("04", "05", "06", "13", "83", "84"),
+    "Guadeloupe": ("971",),
+    "Martinique": ("972",),
+    "Guyane": ("973",),
+    "La Réunion": ("974",),
+    "Mayotte": ("976",),
+}
+DEPARTMENT_REGIONS = {department: region for region, departments in REGION_DEPARTMENTS.items()
+                      for department in departments}
+
+# Zoom levels for which a simplified layer is built; a map at zoom z uses the
+# deepest level <= z.
+LEVEL_ZOOMS = (5, 7, 9, 11, 13)
+
+# Property holding the INSEE code, depending on the export of the GeoJSON.
+CODE_PROPERTIES = ("insee_com", "code_insee", "com_insee", "insee", "code")
+
+# Cell size of the PolygonIndex grid, in degrees (about 10 km, the size of a commune)
+GRID_DEGREES = 0.1
+
+
+def department_of(codes):
+    """Department code of each INSEE commune code (three characters overseas)."""
+    codes = pd.Series(codes, dtype="str").str.zfill(5)
+    return codes.str[:2].where(codes.str[:2] != "97", codes.str[:3])
+
+
+def region_of(codes):
+    """Region name of each INSEE commune code, "" when unknown."""
+    return department_of(codes).map(DEPARTMENT_REGIONS).fillna("")
+
+
+def level_for_zoom(zoom):
+    return max([z for z in LEVEL_ZOOMS if z <= zoom], default=LEVEL_ZOOMS[0])
+
+
+def pixel_size(zoom):
+    """Width in degrees of longitude of one 256 px tile pixel at `zoom`."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def coordinate_precision(zoom):
+    """Decimals needed to keep the rounding error below a tenth of a pixel."""
+    return max(0, math.ceil(-math.log10(pixel_size(zoom) / 10)))
+
+
+def tile_range(bbox, zoom):
+    """Slippy-map tiles (x0, x1, y0, y1), inclusive, covering bbox = (minx, miny, maxx, maxy)."""
+    n = 2 ** zoom
+    minx, miny, maxx, maxy = bbox
+
+    def tile_x(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def tile_y(lat):
+        lat = max(-85.0511, min(85.0511, lat))
+        return min(n - 1, max(0, int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)))
+
+    return tile_x(minx), tile_x(maxx), tile_y(maxy), tile_y(miny)
+
+
+def simplify_ring(points, tolerance):
+    """Douglas-Peucker simplification of a closed ring given as an (n, 2) array."""
+    n = len(points)
+    if tolerance <= 0 or n <= 4:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        a, b = points[start], points[end]
+        inner = points[start + 1:end]
+        dx, dy = b - a
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            distances = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    simplified = points[keep]
+    if len(simplified) < 4:
+        # Keep a triangle rather than dropping the ring
+        simplified = points[[0, n // 3, 2 * n // 3, n - 1]]
+    return simplified
+
+
+def _round_ring(points, precision):
+    rounded = np.round(points, precision)
+    # Drop the consecutive duplicates created by the rounding
+    distinct = np.ones(len(rounded), dtype=bool)
+    distinct[1:] = np.any(rounded[1:] != rounded[:-1], axis=1)
+    rounded = rounded[distinct]
+    if len(rounded) < 4:
+        rounded = np.round(points[[0, len(points) // 3, 2 * len(points) // 3, len(points) - 1]], precision)
+    return rounded.tolist()
+
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def simplify_geometry(geometry, tolerance, precision):
+    """
+    Simplified copy of a Polygon or MultiPolygon. Holes and secondary parts
+    smaller than the tolerance are dropped; the largest part is always kept.
+    """
+    polygons = [[np.asarray(ring, dtype=np.float64) for ring in polygon] for polygon in _polygons(geometry)]
+    if not polygons:
+        return geometry
+
+    def extent(ring):
+        return float(np.max(ring.max(axis=0) - ring.min(axis=0)))
+
+    largest = max(range(len(polygons)), key=lambda i: extent(polygons[i][0]))
+    simplified = []
+    for i, polygon in enumerate(polygons):
+        if i != largest and extent(polygon[0]) < tolerance:
+            continue
+        rings = [polygon[0]] + [hole for hole in polygon[1:] if extent(hole) >= tolerance]
+        simplified.append([_round_ring(simplify_ring(ring, tolerance), precision) for ring in rings])
+
+    if len(simplified) == 1:
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def ring_centroid(points):
+    """Area-weighted centroid of a closed ring (shoelace formula)."""
+    x, y = points[:, 0], points[:, 1]
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    area = cross.sum() / 2
+    if area == 0:
+        return points.mean(axis=0), 0.0
+    cx = ((x[:-1] + x[1:]) * cross).sum() / (6 * area)
+    cy = ((y[:-1] + y[1:]) * cross).sum() / (6 * area)
+    return np.array([cx, cy]), abs(area)
+
+
+def geometry_centroid(geometry):
+    """Centroid of the outer rings of a geometry, weighted by area."""
+    centroids, areas = [], []
+    for polygon in _polygons(geometry):
+        centroid, area = ring_centroid(np.asarray(polygon[0], dtype=np.float64))
+        centroids.append(centroid)
+        areas.append(area)
+    if not centroids:
+        return np.array([np.nan, np.nan])
+    areas = np.asarray(areas)
+    if areas.sum() == 0:
+        return np.mean(centroids, axis=0)
+    return np.average(np.asarray(centroids), axis=0, weights=areas)
+
+
+def geometry_bbox(geometry):
+    points = np.concatenate([np.asarray(polygon[0], dtype=np.float64) for polygon in _polygons(geometry)])
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def feature_code(properties):
+    for name in CODE_PROPERTIES:
+        if properties.get(name) not in (None, ""):
+            return str(properties[name]).strip().zfill(5)
+    return ""
+
+
+def build_pvd_layers(geojson, region_colors=REGION_COLORS, levels=LEVEL_ZOOMS):
+    """
+    Compile the PVD GeoJSON into one layer per zoom level plus a table of the
+    communes with their centroid and bounding box.
+    Each layer is {"zoom", "tolerance", "features", "tiles"} where "tiles" maps
+    "x/y" to the indices of the features crossing that tile.
+    """
+    features = [feature for feature in geojson["features"] if feature.get("geometry")]
+    rows = []
+    for feature in features:
+        properties = feature.get("properties") or {}
+        region = properties.get("reg_name", "")
+        centroid = geometry_centroid(feature["geometry"])
+        rows.append({
+            "code": feature_code(properties),
+            "lib_com": properties.get("lib_com", ""),
+            "reg_name": region,
+            "fill": region_colors.get(region, DEFAULT_COLOR),
+            "lon": centroid[0],
+            "lat": centroid[1],
+            **dict(zip(("minx", "miny", "maxx", "maxy"), geometry_bbox(feature["geometry"]))),
+        })
+    communes = pd.DataFrame(rows, columns=["code", "lib_com", "reg_name", "fill", "lon", "lat",
+                                           "minx", "miny", "maxx", "maxy"])
+    for column in ("lon", "lat", "minx", "miny", "maxx", "maxy"):
+        communes[column] = communes[column].astype(np.float32)
+
+    layers = {}
+    for zoom in levels:
+        tolerance = pixel_size(zoom) / 2
+        precision = coordinate_precision(zoom)
+        layer_features = []
+        tiles = {}
+        for i, (feature, row) in enumerate(zip(features, rows)):
+            layer_features.append({
+                "type": "Feature",
+                "properties": {key: row[key] for key in ("code", "lib_com", "reg_name", "fill")},
+                "geometry": simplify_geometry(feature["geometry"], tolerance, precision),
+            })
+            x0, x1, y0, y1 = tile_range((row["minx"], row["miny"], row["maxx"], row["maxy"]), zoom)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    tiles.setdefault(f"{x}/{y}", []).append(i)
+        layers[zoom] = {"zoom": zoom, "tolerance": tolerance, "features": layer_features, "tiles": tiles}
+    return layers, communes
+
+
+class PolygonIndex:
+    """
+    Point-in-polygon lookup over the features of a GeoJSON FeatureCollection,
+    numbered like the rows of build_pvd_layers() (features without geometry
+    are skipped). Every ring is stored as edges (x1, y1, x2, y2); a point is
+    inside a feature when a ray from it crosses an odd number of the edges of
+    the feature (even-odd rule, which handles holes and multipolygons).
+    """
+
+    def __init__(self, codes, boxes, edges, offsets, cells, cell_size=GRID_DEGREES):
+        self.codes = list(codes)
+        self.boxes = boxes  # (n, 4) minx, miny, maxx, maxy
+        self.edges = edges  # (m, 4), the edges of feature i in offsets[i]:offsets[i + 1]
+        self.offsets = offsets
+        self.cells = cells  # (column, row) -> features whose box overlaps the cell
+        self.cell_size = cell_size
+
+    @classmethod
+    def from_geojson(cls, geojson, cell_size=GRID_DEGREES):
+        features = [feature for feature in geojson["features"] if feature.get("geometry")]
+        codes, boxes, edges, offsets = [], [], [], [0]
+        cells = {}
+        for i, feature in enumerate(features):
+            rings = [np.asarray(ring, dtype=np.float64)[:, :2]
+                     for polygon in _polygons(feature["geometry"]) for ring in polygon if len(ring)]
+            # Each vertex to the next one, the last back to the first (a null edge for closed rings)
+            feature_edges = np.concatenate([np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in rings]) \
+                if rings else np.empty((0, 4))
+            if len(feature_edges):
+                box = (*feature_edges[:, :2].min(axis=0), *feature_edges[:, :2].max(axis=0))
+            else:
+                box = (np.nan,) * 4
+            codes.append(feature_code(feature.get("properties") or {}))
+            boxes.append(box)
+            edges.append(feature_edges)
+            offsets.append(offsets[-1] + len(feature_edges))
+            if len(feature_edges):
+                minx, miny, maxx, maxy = box
+                for column in range(math.floor(minx / cell_size), math.floor(maxx / cell_size) + 1):
+                    for row in range(math.floor(miny / cell_size), math.floor(maxy / cell_size) + 1):
+                        cells.setdefault((column, row), []).append(i)
+        return cls(
+            codes,
+            np.asarray(boxes, dtype=np.float64).reshape(-1, 4),
+            np.concatenate(edges) if edges else np.empty((0, 4)),
+            np.asarray(offsets, dtype=np.int64),
+            {cell: np.asarray(members, dtype=np.int32) for cell, members in cells.items()},
+            cell_size,
+        )
+
+    def contains(self, i, lat, lon):
+        """Whether feature `i` contains the point."""
+        edges = self.edges[self.offsets[i]:self.offsets[i + 1]]
+        crossing = (edges[:, 1] > lat) != (edges[:, 3] > lat)
+        if not crossing.any():
+            return False
+        x1, y1, x2, y2 = edges[crossing].T
+        return bool(np.count_nonzero(lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1)) % 2)
+
+    def locate(self, lat, lon):
+        """Number of the feature containing the point, or -1."""
+        candidates = self.cells.get((math.floor(lon / self.cell_size), math.floor(lat / self.cell_size)))
+        if candidates is None:
+            return -1
+        boxes = self.boxes[candidates]
+        inside = (boxes[:, 0] <= lon) & (lon <= boxes[:, 2]) & (boxes[:, 1] <= lat) & (lat <= boxes[:, 3])
+        for i in candidates[inside]:
+            if self.contains(i, lat, lon):
+                return int(i)
+        return -1
+
+
+def tiles_in_view(zoom, bounds):
+    """
+    Tile range (x0, x1, y0, y1) at level `zoom` covering the map bounds
+    ((south, west), (north, east)); None stands for the whole map.
+    """
+    if bounds is None:
+        return None
+    (south, west), (north, east) = bounds
+    return tile_range((west, south, east, north), zoom)
+
+
+def features_in_tiles(layer, tiles):
+    """Indices of the features of `layer` crossing the tile range `tiles` (all of them if None)."""
+    if tiles is None:
+        return list(range(len(layer["features"])))
+    x0, x1, y0, y1 = tiles
+    indices = set()
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            indices.update(layer["tiles"].get(f"{x}/{y}", ()))
+    return sorted(indices)
@@ -0,0 +1,264 @@
+"""
+Opt-in timing of the stages of a page rerun or of a script run.
+
+    with record_run("Étude de cas", profiler="cprofile") as run:
+        page()
+    run.stages   # [StageRecord(name, kind, depth, start, seconds, rss_delta), ...]
+
+The data access and model code marks its expensive steps with
+`with stage(name, kind):`, kind being one of STAGE_KINDS. Outside of
+record_run() a stage costs one context variable lookup, so the marks stay in
+place in production. Inside, each stage records its wall time and the change
+of the process resident memory (RSS, Linux only) and nests in the stages
+around it. The recording follows the thread (or task) that opened it:
+concurrent Streamlit sessions do not mix their stages.
+
+record_run() can also profile the whole run with cProfile (a .prof file for
+snakeviz or pstats) or pyinstrument (an HTML flame chart, if the package is
+installed), written to PROJET_DATA_PROFILE_DIR (data/cache/profiles by
+default), and append a JSON line per run to the file named by
+PROJET_DATA_METRICS.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STAGE_KINDS = ("import", "load", "transform", "fit", "render")
+PROFILERS = ("cprofile", "pyinstrument")
+
+PROFILE_DIR = Path(os.environ.get("PROJET_DATA_PROFILE_DIR",
+                                  Path(__file__).resolve().parent.parent / "data" / "cache" / "profiles"))
+
+_current = contextvars.ContextVar("instrumentation_run", default=None)
+
+# A single profiler can hook the interpreter at a time.
+_profiler_lock = threading.Lock()
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+
+def rss_bytes():
+    """Resident memory of the process, or None where /proc is not available."""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+@dataclass
+class StageRecord:
+    name: str
+    kind: str
+    depth: int
+    start: float  # seconds since the start of the run
+    seconds: float
+    rss_delta: int = None  # bytes
+
+
+@dataclass
+class RunRecord:
+    label: str
+    started_at: float
+    seconds: float = None
+    rss_delta: int = None
+    stages: list = field(default_factory=list)
+    profile_path: Path = None
+    error: str = None
+
+    def self_seconds(self):
+        """Seconds of each stage minus those of the stages nested in it, in stage order."""
+        own = [record.seconds for record in self.stages]
+        for i, record in enumerate(self.stages):
+            # The parent is the closest earlier stage one level up
+            for j in range(i - 1, -1, -1):
+                if self.stages[j].depth == record.depth - 1:
+                    own[j] -= record.seconds
+                    break
+        return own
+
+    def totals(self):
+        """Seconds spent in each kind of stage, nested stages counted in their own kind."""
+        totals = {}
+        for record, seconds in zip(self.stages, self.self_seconds()):
+            totals[record.kind] = totals.get(record.kind, 0.0) + seconds
+        return totals
+
+
+class _Stage:
+    __slots__ = ("run", "name", "kind", "record", "_start", "_rss")
+
+    def __init__(self, run, name, kind):
+        self.run = run
+        self.name = name
+        self.kind = kind
+
+    def __enter__(self):
+        run = self.run
+        # Recorded in start order; the depth is the number of stages still open
+        self.record = StageRecord(self.name, self.kind, run._depth, 0.0, 0.0)
+        run.record.stages.append(self.record)
+        run._depth += 1
+        self._rss = rss_bytes()
+        self._start = time.perf_counter()
+        self.record.start = self._start - run._start
+        return self.record
+
+    def __exit__(self, *exc_info):
+        self.record.seconds = time.perf_counter() - self._start
+        rss = rss_bytes()
+        if rss is not None and self._rss is not None:
+            self.record.rss_delta = rss - self._rss
+        self.run._depth -= 1
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _ActiveRun:
+    def __init__(self, record):
+        self.record = record
+        self._depth = 0
+        self._start = time.perf_counter()
+
+
+def stage(name, kind="transform"):
+    """Context manager timing the step `name` of the current run; does nothing outside of record_run()."""
+    run = _current.get()
+    if run is None:
+        return _NULL_STAGE
+    return _Stage(run, name, kind)
+
+
+def is_recording():
+    return _current.get() is not None
+
+
+def _slug(label):
+    return re.sub(r"[^\w-]+", "-", label, flags=re.ASCII).strip("-").lower() or "run"
+
+
+class _Profiler:
+    """cProfile or pyinstrument around a run; start() returns False if it cannot run."""
+
+    def __init__(self, name):
+        self.name = name
+        self._profiler = None
+
+    def start(self):
+        if not _profiler_lock.acquire(blocking=False):
+            logger.warning("A profiler is already running in another session; %s skipped", self.name)
+            return False
+        try:
+            if self.name == "pyinstrument":
+                from pyinstrument import Profiler
+
+                self._profiler = Profiler()
+                self._profiler.start()
+            else:
+                import cProfile
+
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+        except Exception:
+            _profiler_lock.release()
+            raise
+        return True
+
+    def stop(self, label):
+        try:
+            if self.name == "pyinstrument":
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+        finally:
+            _profiler_lock.release()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        if self.name == "pyinstrument":
+            path = PROFILE_DIR / f"{stamp}-{_slug(label)}.html"
+            path.write_text(self._profiler.output_html(), encoding="utf-8")
+        else:
+            path = PROFILE_DIR / f"{stamp}-{_slug(label)}.prof"
+            self._profiler.dump_stats(path)
+        return path
+
+
+def export_run(record, path=None):
+    """Append the run as a JSON line to `path` (default: PROJET_DATA_METRICS, if set)."""
+    path = path or os.environ.get("PROJET_DATA_METRICS")
+    if not path:
+        return
+    line = asdict(record)
+    line["profile_path"] = str(record.profile_path) if record.profile_path else None
+    line["pid"] = os.getpid()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+@contextmanager
+def record_run(label, profiler=None):
+    """
+    Record the stages run inside the block, optionally under a profiler among
+    PROFILERS. Yields the RunRecord, complete once the block exits.
+    """
+    if profiler is not None and profiler not in PROFILERS:
+        raise ValueError(f"unknown profiler {profiler!r}, expected one of {', '.join(PROFILERS)}")
+    record = RunRecord(label, time.time())
+    active = _ActiveRun(record)
+    token = _current.set(active)
+    rss = rss_bytes()
+    profiling = None
+    if profiler is not None:
+        profiling = _Profiler(profiler)
+        try:
+            if not profiling.start():
+                profiling = None
+        except ImportError:
+            logger.warning("pyinstrument is not installed; profiling skipped")
+            profiling = None
+    try:
+        yield record
+    except BaseException as exc:
+        # Also st.stop() and st.rerun(), which raise to end the run
+        record.error = type(exc).__name__
+        raise
+    finally:
+        try:
+            if profiling is not None:
+                record.profile_path = profiling.stop(label)
+        finally:
+            record.seconds = time.perf_counter() - active._start
+            end_rss = rss_bytes()
+            if rss is not None and end_rss is not None:
+                record.rss_delta = end_rss - rss
+            _current.reset(token)
+        try:
+            export_run(record)
+        except OSError:
+            logger.exception("Could not write the run metrics")
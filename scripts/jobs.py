@@ -0,0 +1,143 @@
+"""
+Background jobs shared across sessions.
+
+    job = submit(("model", key), regression_model, label="Ajustement du modèle")
+    job.done(), job.progress, job.message, job.result()
+
+Expensive page work (model fit, resampling, map data) runs on a thread pool
+shared by every session of the process: the script run that asked for it
+ends at once and the page polls the job. A job is identified by a key:
+submitting a key that is queued, running or finished returns the same job,
+so two sessions (or two reruns) opening a cold page start one computation.
+A failed job is replaced on the next submission, so that it can be retried.
+The last MAX_FINISHED finished jobs are kept.
+
+Threads rather than processes: results land in the in-process caches of
+scripts.utils and scripts.artifacts that the page reads next, and the heavy
+parts (NumPy, the process pool of scripts/resampling.py) release the GIL.
+
+Inside a job, report_progress(fraction, message) updates its progress; like
+instrumentation.stage(), it does nothing outside of a job.
+PROJET_DATA_JOB_WORKERS sets the number of threads (2 by default);
+PROJET_DATA_JOBS=0 runs the jobs in the caller instead, as the benchmarks do.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("PROJET_DATA_JOB_WORKERS", "2"))
+MAX_FINISHED = 32
+
+_current = contextvars.ContextVar("current_job", default=None)
+_jobs = OrderedDict()
+_lock = threading.Lock()
+_executor = None
+
+
+def background_enabled():
+    return os.environ.get("PROJET_DATA_JOBS", "1").strip().lower() not in ("0", "false", "off", "non")
+
+
+class Job:
+    """A computation submitted under `key`, its progress and its future."""
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.progress = 0.0
+        self.message = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.future = Future()
+
+    def done(self):
+        return self.future.done()
+
+    def failed(self):
+        return self.future.done() and self.future.exception() is not None
+
+    def result(self, timeout=None):
+        """The value returned by the job, waiting for it if needed; raises the exception of a failed job."""
+        return self.future.result(timeout)
+
+    def report(self, fraction, message=None):
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        self.message = message
+
+    def _run(self, function, args, kwargs):
+        token = _current.set(self)
+        try:
+            value = function(*args, **kwargs)
+        except BaseException as exc:
+            logger.exception("Job %r failed", self.key)
+            self.future.set_exception(exc)
+        else:
+            self.report(1.0)
+            self.future.set_result(value)
+        finally:
+            self.finished_at = time.time()
+            _current.reset(token)
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="projet-data-job")
+    return _executor
+
+
+def _trim():
+    finished = [key for key, job in _jobs.items() if job.done()]
+    for key in finished[:max(len(finished) - MAX_FINISHED, 0)]:
+        del _jobs[key]
+
+
+def submit(key, function, *args, label=None, **kwargs):
+    """The job `key`: the one already submitted, or a new one running function(*args, **kwargs)."""
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None and not job.failed():
+            _jobs.move_to_end(key)
+            return job
+        job = Job(key, label or str(key))
+        job.future.set_running_or_notify_cancel()
+        _jobs[key] = job
+        _trim()
+        if background_enabled():
+            _pool().submit(job._run, function, args, kwargs)
+            return job
+    # Outside of the lock: the job may submit jobs of its own
+    job._run(function, args, kwargs)
+    return job
+
+
+def get(key):
+    """The job submitted under `key`, or None."""
+    with _lock:
+        return _jobs.get(key)
+
+
+def jobs():
+    """Snapshot of the known jobs, oldest first."""
+    with _lock:
+        return list(_jobs.values())
+
+
+def clear():
+    """Forget the finished jobs; running ones complete normally."""
+    with _lock:
+        for key in [key for key, job in _jobs.items() if job.done()]:
+            del _jobs[key]
+
+
+def report_progress(fraction, message=None):
+    """Set the progress (0 to 1) and message of the current job; does nothing outside of a job."""
+    job = _current.get()
+    if job is not None:
+        job.report(fraction, message)
@@ -0,0 +1,81 @@
+"""
+What-if predictions of the final regression model.
+
+    predictor = regression_predictor()
+    predictor.predict()                     # fitted taux_evolution of every commune of the sample
+    predictor.scenario({"Cinema": 1, "nombre_de_medecins_generalistes": 2}, rows=mask)
+
+The coefficients of the selected model are kept as a float64 vector aligned
+with the columns of the design matrix of the sample (same dummies, same
+order as the fit), both built once per model. A prediction is one
+matrix-vector product over the communes of the sample; a scenario only
+recomputes the columns it changes and adds their effect to the baseline.
+Changed values are floored at the smallest possible value of their column
+(zero for counts, shares and incomes): a commune cannot lose more doctors
+than it has, so the effect of a negative change differs between communes.
+"""
+import numpy as np
+import pandas as pd
+
+from scripts.regression import DROPPED_COLUMNS, design_matrix, regression_model
+from scripts.utils import cached_derived
+
+
+class Predictor:
+    """Coefficient vector of a fitted model and design matrix of the communes it applies to."""
+
+    def __init__(self, response, names, coefficients, codes, matrix):
+        self.response = response
+        self.names = list(names)
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.codes = pd.Index(codes)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+        self.baseline = self.matrix @ self.coefficients
+        self.lower = np.where(self.matrix.min(axis=0) >= 0, 0.0, -np.inf)
+        self._columns = {name: j for j, name in enumerate(self.names)}
+
+    @classmethod
+    def from_model(cls, model, frame, dropped_columns=DROPPED_COLUMNS, code_column="code_insee"):
+        """Predictor of a result of regression.fit_regression() over the sample `frame` it was fitted on."""
+        X, _ = design_matrix(frame, model["response"], dropped_columns)
+        names = list(model["params"].index)
+        return cls(model["response"], names, model["params"].to_numpy(), frame[code_column].astype(str),
+                   X[names].to_numpy())
+
+    @property
+    def variables(self):
+        """Explanatory variables of the model, without the constant."""
+        return [name for name in self.names if name != "const"]
+
+    def predict(self, rows=None):
+        """Predicted response of every commune, or of the rows selected by the mask or positions `rows`."""
+        return self.baseline if rows is None else self.baseline[rows]
+
+    def scenario(self, deltas, rows=None):
+        """
+        Predicted response of every commune after adding `deltas` ({variable:
+        change}) to the communes selected by `rows` (all by default); the
+        other communes keep their baseline.
+        """
+        unknown = [name for name in deltas if name not in self._columns]
+        if unknown:
+            raise KeyError(f"not a variable of the model: {', '.join(unknown)}")
+        changed = [name for name, delta in deltas.items() if delta]
+        if not changed:
+            return self.baseline.copy()
+        columns = [self._columns[name] for name in changed]
+        rows = np.arange(len(self.codes)) if rows is None else np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        current = self.matrix[np.ix_(rows, columns)]
+        shifted = np.maximum(current + np.array([deltas[name] for name in changed]), self.lower[columns])
+        predictions = self.baseline.copy()
+        predictions[rows] += (shifted - current) @ self.coefficients[columns]
+        return predictions
+
+
+def regression_predictor(table="final_filtered_data_sample"):
+    """Predictor of the cached regression model of `table`, built once per model and table version."""
+    model = regression_model(table)
+    return cached_derived(table, ("predictor", model["key"]), lambda frame: Predictor.from_model(model, frame))
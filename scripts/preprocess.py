@@ -0,0 +1,368 @@
+"""
+Offline build step: compile the raw sources into typed Parquet tables.
+
+    python -m scripts.preprocess            # rebuild the stale tables
+    python -m scripts.preprocess --force    # rebuild everything
+
+Each table is read once from its raw source, its encoding and column names are
+fixed, the numeric columns are downcast and the INSEE code is stored as a
+categorical key. The Parquet files are written to data/processed/ next to a
+manifest.json recording the source version, row count and dtypes of each table.
+The PVD GeoJSON is compiled the same way into a table of communes plus one
+simplified map layer per zoom level (see scripts/geo.py).
+Pages load them through scripts.utils.load_table(); a missing or stale artifact
+is rebuilt on first access. Builds hold a lock on data/processed/.build.lock,
+so that two processes (the app and this script, or two app servers) never
+write the same artifacts or lose each other's manifest entries.
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only covers the threads of one process
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from scripts.design import CATEGORICAL_DIMENSIONS, collapse_dummies
+from scripts.geo import LEVEL_ZOOMS, build_pvd_layers
+from scripts.instrumentation import stage
+from scripts.utils import (
+    DATA_DIR,
+    ETUDE_2_CAS_PATH,
+    PVD_GEOJSON_PATH,
+    REGRESSION_SAMPLE_PATH,
+    file_version,
+    load_json,
+)
+
+PROCESSED_DIR = DATA_DIR / "processed"
+MANIFEST_PATH = PROCESSED_DIR / "manifest.json"
+LOCK_PATH = PROCESSED_DIR / ".build.lock"
+
+# Bump when the cleaning rules change so that existing artifacts are rebuilt.
+PIPELINE_VERSION = 3
+
+# Rows per Parquet row group: the tables are sorted by INSEE code, so the
+# per-group statistics let filtered reads (scripts/queries.py) skip the groups
+# outside the requested codes.
+ROW_GROUP_SIZE = 4096
+
+# Raw header -> clean column name, for the columns whose label is misspelt in
+# the Observatoire des territoires export.
+ETUDE_2_CAS_RENAMES = {
+    "Nombre de supérettes et épieries": "Nombre de supérettes et épiceries",
+    "Nombre boulangeries et patisseries": "Nombre boulangeries et pâtisseries",
+}
+
+# Columns holding a share, a rate or a euro amount rather than a count.
+ETUDE_2_CAS_CONTINUOUS = [
+    "Médiane du revenu disponible par UC 2020",
+    "Part des 60-74 ans 2021",
+    "Part des moins de 15 ans 2021",
+    "Part des 15-29 ans 2021",
+    "Part des 30-44 ans 2021",
+    "Part des 45-59 ans 2021",
+    "Taux d'équipements sportifs pour 1 000 habitants 2023",
+]
+
+# The response variables and age shares are kept in float64 so that the
+# published regression is reproduced exactly; integer columns are downcast
+# losslessly.
+REGRESSION_SAMPLE_FLOAT64 = [
+    "part_des_60-74_ans_2021",
+    "part_des_moins_de_15_ans_2021",
+    "part_des_15-29_ans_2021",
+    "part_des_30-44_ans_2021",
+    "part_des_45-59_ans_2021",
+    "taux_evolution",
+    "taux_evolution_due_solde_migratoire",
+    "taux_evolution_due_solde_naturel",
+]
+
+_thread_lock = threading.Lock()
+
+
+def normalize_insee_codes(codes):
+    """Restore the leading zero that spreadsheet exports drop from INSEE codes."""
+    return codes.astype(str).str.strip().str.zfill(5)
+
+
+def downcast_count(values, fractional=np.float32):
+    """
+    Store a whole-valued column in the smallest integer type, float32 if it has
+    gaps. A column with a fractional value is stored as `fractional` instead.
+    """
+    numbers = values.to_numpy(dtype=np.float64)
+    known = numbers[~np.isnan(numbers)]
+    if (known != np.floor(known)).any():
+        return values.astype(fractional)
+    if len(known) < len(numbers):
+        return values.astype(np.float32)
+    for dtype in (np.uint8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if values.min() >= info.min and values.max() <= info.max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def parse_etude_2_cas(raw):
+    """
+    Columns of etude_2_cas.csv (or of any block of its rows) with fixed names,
+    the INSEE codes normalized and the indicators parsed as numbers, rows in
+    file order. The dtypes do not depend on the values, so that the blocks of
+    a chunked read (scripts/streaming.py) all have the same schema.
+    """
+    data = raw.rename(columns=ETUDE_2_CAS_RENAMES)
+    columns = {}
+    for column in data.columns:
+        if column == "Code":
+            columns[column] = normalize_insee_codes(data[column])
+        elif column == "Libellé":
+            columns[column] = data[column].astype(str)
+        else:
+            # "N/A - résultat non disponible" and "N/A - division par 0" become NaN
+            columns[column] = pd.to_numeric(data[column], errors="coerce").astype(np.float64)
+    return pd.DataFrame(columns, index=data.index)
+
+
+def clean_etude_2_cas(raw):
+    """Typed version of etude_2_cas.csv, sorted by INSEE code."""
+    data = parse_etude_2_cas(raw)
+    columns = {"Code": data["Code"], "Libellé": data["Libellé"]}
+    for column in data.columns[2:]:
+        if column in ETUDE_2_CAS_CONTINUOUS:
+            columns[column] = data[column].astype(np.float32)
+        else:
+            columns[column] = downcast_count(data[column])
+    clean = pd.DataFrame(columns).sort_values("Code", ignore_index=True)
+    clean["Code"] = pd.Categorical(clean["Code"], categories=clean["Code"].unique())
+    return clean
+
+
+def clean_regression_sample(raw):
+    """
+    Typed version of final_filtered_data_sample.csv, column order unchanged
+    except that the GCD_* and AAV_* dummy columns become the categoricals GCD
+    and AAV (see scripts/design.py). Text columns are stored as categoricals.
+    """
+    columns = {}
+    for column in raw.columns:
+        values = raw[column]
+        if column == "code_insee":
+            codes = normalize_insee_codes(values)
+            columns[column] = pd.Categorical(codes, categories=sorted(codes.unique()))
+        elif column in REGRESSION_SAMPLE_FLOAT64:
+            columns[column] = values.astype(np.float64)
+        elif not pd.api.types.is_numeric_dtype(values):
+            columns[column] = pd.Categorical(values)
+        else:
+            # Fractional columns feed the regression: kept in float64 like REGRESSION_SAMPLE_FLOAT64
+            columns[column] = downcast_count(values, fractional=np.float64)
+    clean = pd.DataFrame(columns)
+    for column, (prefix, reference) in CATEGORICAL_DIMENSIONS.items():
+        clean = collapse_dummies(clean, column, prefix, reference)
+    return clean
+
+
+def read_etude_2_cas(path=ETUDE_2_CAS_PATH):
+    return pd.read_csv(path, delimiter=";", encoding="latin1", dtype=str)
+
+
+def read_regression_sample(path=REGRESSION_SAMPLE_PATH):
+    return pd.read_csv(path, dtype={"code_insee": str})
+
+
+def read_geojson(path=PVD_GEOJSON_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def layer_path(zoom):
+    return PROCESSED_DIR / f"pvd_z{zoom}.json"
+
+
+def compile_pvd_layers(geojson):
+    """
+    Write the simplified, pre-styled map layer of each zoom level and return
+    the table of PVD communes (centroid, bounding box, fill colour).
+    """
+    layers, communes = build_pvd_layers(geojson)
+    for zoom, layer in layers.items():
+        _atomic_write_bytes(layer_path(zoom), json.dumps(layer, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    communes["code"] = pd.Categorical(communes["code"])
+    return communes
+
+
+# name -> (raw source, reader, cleaner)
+TABLES = {
+    "etude_2_cas": (ETUDE_2_CAS_PATH, read_etude_2_cas, clean_etude_2_cas),
+    "final_filtered_data_sample": (REGRESSION_SAMPLE_PATH, read_regression_sample, clean_regression_sample),
+    "pvd_communes": (PVD_GEOJSON_PATH, read_geojson, compile_pvd_layers),
+}
+
+# Files written by a cleaner besides the table itself
+EXTRA_OUTPUTS = {
+    "pvd_communes": [layer_path(zoom) for zoom in LEVEL_ZOOMS],
+}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_path(name):
+    return PROCESSED_DIR / f"{name}.parquet"
+
+
+def read_manifest():
+    try:
+        return load_json(MANIFEST_PATH)
+    except FileNotFoundError:
+        return {"pipeline_version": PIPELINE_VERSION, "tables": {}}
+
+
+def write_manifest(manifest):
+    _atomic_write_bytes(MANIFEST_PATH, json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8"))
+
+
+def _atomic_write_bytes(path, payload):
+    # Write next to the target then rename, so readers never see a partial file.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "wb") as f:
+        f.write(payload)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _atomic_write_parquet(path, frame):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    os.close(fd)
+    frame.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def build_lock():
+    """Exclusive lock on the artifacts and the manifest, across threads and processes."""
+    with _thread_lock:
+        PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+        with open(LOCK_PATH, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _table_status(name, manifest):
+    # "fresh", "touched" (same content, new mtime, e.g. after a checkout) or "stale"
+    entry = manifest.get("tables", {}).get(name)
+    if entry is None or manifest.get("pipeline_version") != PIPELINE_VERSION:
+        return "stale"
+    if not all(path.exists() for path in [artifact_path(name), *EXTRA_OUTPUTS.get(name, [])]):
+        return "stale"
+    source = TABLES[name][0]
+    mtime_ns, size = file_version(source)
+    if (entry["source_mtime_ns"], entry["source_size"]) == (mtime_ns, size):
+        return "fresh"
+    if entry["source_size"] == size and entry["source_sha256"] == file_sha256(source):
+        return "touched"
+    return "stale"
+
+
+def is_fresh(name):
+    """Whether the artifact of `name` was built from the current source by this pipeline version."""
+    return _table_status(name, read_manifest()) != "stale"
+
+
+def _touch_manifest(name):
+    # Record the new mtime so that the source is not hashed again on every access.
+    manifest = dict(read_manifest())
+    manifest["tables"] = dict(manifest["tables"])
+    entry = dict(manifest["tables"][name])
+    entry["source_mtime_ns"], entry["source_size"] = file_version(TABLES[name][0])
+    manifest["tables"][name] = entry
+    write_manifest(manifest)
+
+
+def build_table(name):
+    """Compile one table from its raw source and record it in the manifest; call it under build_lock()."""
+    source, reader, cleaner = TABLES[name]
+    mtime_ns, size = file_version(source)
+    with stage(f"read {source.name}", "load"):
+        raw = reader(source)
+    with stage(f"build {name}", "transform"):
+        frame = cleaner(raw)
+        _atomic_write_parquet(artifact_path(name), frame)
+
+    manifest = dict(read_manifest())
+    if manifest.get("pipeline_version") != PIPELINE_VERSION:
+        manifest = {"pipeline_version": PIPELINE_VERSION, "tables": {}}
+    manifest["tables"] = dict(manifest.get("tables", {}))
+    manifest["tables"][name] = {
+        "file": artifact_path(name).name,
+        "source": source.relative_to(DATA_DIR.parent).as_posix(),
+        "source_mtime_ns": mtime_ns,
+        "source_size": size,
+        "source_sha256": file_sha256(source),
+        "rows": len(frame),
+        "columns": {column: str(dtype) for column, dtype in frame.dtypes.items()},
+    }
+    write_manifest(manifest)
+    return frame
+
+
+def ensure_table(name):
+    """Return the artifact path of `name`, rebuilding it first if it is stale."""
+    if _table_status(name, read_manifest()) != "fresh":
+        with build_lock():
+            status = _table_status(name, read_manifest())
+            if status == "touched":
+                _touch_manifest(name)
+            elif status == "stale":
+                build_table(name)
+    return artifact_path(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the raw sources into typed Parquet tables.")
+    parser.add_argument("tables", nargs="*", help=f"tables to build among {', '.join(TABLES)} (default: all)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the artifact is up to date")
+    args = parser.parse_args(argv)
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+
+    for name in args.tables or TABLES:
+        if not TABLES[name][0].exists():
+            print(f"{name}: source {TABLES[name][0]} not found, skipped")
+            continue
+        with build_lock():
+            if not args.force and is_fresh(name):
+                print(f"{name}: up to date")
+                continue
+            frame = build_table(name)
+        size_kb = artifact_path(name).stat().st_size / 1024
+        print(f"{name}: {len(frame)} rows, {frame.memory_usage(deep=True).sum() / 1024:.0f} KiB in memory, "
+              f"{size_kb:.0f} KiB on disk")
+
+
+if __name__ == "__main__":
+    main()
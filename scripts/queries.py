@@ -0,0 +1,168 @@
+"""
+Column and row selection over the preprocessed commune tables.
+
+    select(["Libellé", "Population au dernier recensement 2021"],
+           where=[("Population au dernier recensement 2021", ">=", 2000),
+                  ("region", "==", "Occitanie"),
+                  ("pvd", "==", True)])
+
+Only the requested columns are read from the Parquet artifact, and the
+predicates are pushed down to the Parquet reader as pyarrow filters, which
+skip the row groups whose statistics exclude them. Besides the stored
+columns, predicates can use the virtual columns "departement", "region" and
+"pvd" (membership of Petites Villes de Demain), which are resolved to a list
+of INSEE codes first. Results are shared across sessions like the tables:
+callers get a shallow view and must not modify it in place.
+
+A selection by `codes` alone takes its rows from the cached projection of the
+requested columns through the index of INSEE codes: a query per map click or
+per change of the commune picker adds nothing to the cache. Results filtered
+by `where` go to the small cache of query results (utils.cached_query).
+"""
+import operator
+
+import numpy as np
+import pandas as pd
+
+from scripts.geo import department_of, region_of
+from scripts.instrumentation import stage
+from scripts.preprocess import TABLES
+from scripts.utils import cached_derived, cached_query, cached_value, file_version, table_path
+
+# Column holding the INSEE code in each table
+CODE_COLUMNS = {
+    "etude_2_cas": "Code",
+    "final_filtered_data_sample": "code_insee",
+    "pvd_communes": "code",
+}
+VIRTUAL_COLUMNS = ("departement", "region", "pvd")
+
+_OPERATORS = {
+    "==": operator.eq, "=": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+def _matches(values, op, value):
+    """Boolean mask of a predicate over an array or Series."""
+    values = pd.Series(values)
+    if op == "in":
+        return values.isin(list(value)).to_numpy()
+    if op == "not in":
+        return ~values.isin(list(value)).to_numpy()
+    if op not in _OPERATORS:
+        raise ValueError(f"Unsupported operator {op!r}")
+    return np.asarray(_OPERATORS[op](values, value), dtype=bool)
+
+
+def pvd_table():
+    """
+    Table listing the PVD communes: the map table when data/PVD.geojson is
+    available, otherwise the regression sample, which only covers PVD communes.
+    """
+    return "pvd_communes" if TABLES["pvd_communes"][0].exists() else "final_filtered_data_sample"
+
+
+def pvd_codes():
+    """INSEE codes of the PVD communes."""
+    name = pvd_table()
+    column = CODE_COLUMNS[name]
+    return cached_derived(name, ("pvd_codes", column),
+                          lambda frame: frozenset(frame[column].astype(str).str.zfill(5)))
+
+
+def commune_attributes(table="etude_2_cas"):
+    """Department, region and PVD membership of each row of `table`, in table order."""
+    column = CODE_COLUMNS[table]
+
+    def build(frame):
+        codes = frame[column].astype(str).str.zfill(5)
+        return pd.DataFrame({
+            "code": codes.to_numpy(),
+            "departement": department_of(codes).to_numpy(),
+            "region": region_of(codes).to_numpy(),
+            "pvd": codes.isin(pvd_codes()).to_numpy(),
+        })
+
+    # The PVD list comes from another table: rebuild when it changes
+    pvd_version = file_version(table_path(pvd_table()))
+    return cached_derived(table, ("attributes", column, pvd_table(), pvd_version), build)
+
+
+def _filters(table, where, codes):
+    """pyarrow filters for `where` and `codes`, virtual columns resolved to codes."""
+    column = CODE_COLUMNS[table]
+    stored = []
+    virtual = [predicate for predicate in where if predicate[0] in VIRTUAL_COLUMNS]
+    for predicate in where:
+        if predicate[0] not in VIRTUAL_COLUMNS:
+            name, op, value = predicate
+            stored.append((name, op, sorted(value) if op in ("in", "not in") else value))
+
+    allowed = None
+    if virtual:
+        attributes = commune_attributes(table)
+        mask = np.ones(len(attributes), dtype=bool)
+        for name, op, value in virtual:
+            mask &= _matches(attributes[name], op, value)
+        allowed = set(attributes["code"][mask])
+    if codes is not None:
+        wanted = {str(code).strip().zfill(5) for code in codes}
+        allowed = wanted if allowed is None else allowed & wanted
+    if allowed is not None:
+        # pyarrow rejects an empty "in" list; no code is empty
+        stored.append((column, "in", sorted(allowed) or [""]))
+    return stored
+
+
+def code_index(table="etude_2_cas"):
+    """pd.Index of the zero-padded INSEE codes of `table`, in table order."""
+    column = CODE_COLUMNS[table]
+    return cached_derived(table, ("code_index", column),
+                          lambda frame: pd.Index(frame[column].astype(str).str.zfill(5)))
+
+
+def _read(path, columns, filters):
+    import pyarrow.parquet as pq
+
+    with stage(f"query {path.name}", "load"):
+        return pq.read_table(path, columns=columns, filters=filters or None).to_pandas()
+
+
+def select(columns=None, where=(), codes=None, table="etude_2_cas"):
+    """
+    Rows of the preprocessed `table` matching every predicate of `where` (tuples
+    (column, op, value) with op among == != < <= > >= in, not in) and, if
+    given, whose INSEE code is in `codes`; only `columns` (all if None) are
+    read. Rows come in table order, or in the order of `codes` when given (all
+    the rows of a code repeated in the table, in table order).
+    """
+    path = table_path(table)
+    code_column = CODE_COLUMNS[table]
+    where = [tuple(predicate) for predicate in where]
+    read_columns = None if columns is None else list(columns)
+    if codes is not None and not where:
+        # Projection shared by every selection of these columns, rows taken by position
+        projection = cached_value(("query", str(path), repr(read_columns), "[]"), path,
+                                  lambda: _read(path, read_columns, None))
+        # get_indexer_for: the PVD table repeats some codes, one row per polygon
+        order = code_index(table).get_indexer_for([str(code).strip().zfill(5) for code in codes])
+        return projection.take(order[order >= 0]).reset_index(drop=True)
+
+    filters = _filters(table, where, codes)
+    if codes is not None and read_columns is not None and code_column not in read_columns:
+        read_columns.append(code_column)
+    key = ("query", str(path), repr(read_columns), repr(filters))
+    if filters:
+        frame = cached_query(key, path, lambda: _read(path, read_columns, filters))
+    else:
+        frame = cached_value(key, path, lambda: _read(path, read_columns, filters))
+
+    if codes is not None:
+        order = pd.Index(frame[code_column].astype(str)).get_indexer_for(
+            [str(code).strip().zfill(5) for code in codes])
+        frame = frame.take(order[order >= 0]).reset_index(drop=True)
+        if columns is not None and code_column not in columns:
+            frame = frame.drop(columns=[code_column])
+        return frame
+    return frame.copy(deep=False)
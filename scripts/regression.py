@@ -0,0 +1,104 @@
+"""
+Regression model of the population growth rate of the PVD communes.
+
+fit_regression() runs the whole analysis shown on the regression page:
+correlation screening, backward selection and the final statsmodels fit.
+regression_model() caches its result on disk, keyed by the content of the
+source file, the dropped columns, the response and the significance level.
+"""
+import numpy as np
+import pandas as pd
+
+from scripts.artifacts import cached_artifact, fingerprint
+from scripts.correlation import correlated_pairs
+from scripts.design import expand_categoricals
+from scripts.instrumentation import stage
+from scripts.jobs import report_progress
+from scripts.preprocess import PIPELINE_VERSION, TABLES
+from scripts.utils import load_table
+
+# Bump when the content of the model artifact changes.
+MODEL_VERSION = 3
+
+RESPONSE = "taux_evolution"
+DROPPED_COLUMNS = ("taux_evolution_due_solde_naturel", "taux_evolution_due_solde_migratoire", "code_insee")
+
+# Growth rates that can be modelled; the other two are then left out of the predictors.
+RESPONSES = ("taux_evolution", "taux_evolution_due_solde_naturel", "taux_evolution_due_solde_migratoire")
+CORRELATION_THRESHOLD = 0.85
+
+
+def dropped_columns_for(response):
+    """Columns left out of the predictors when modelling `response`."""
+    return tuple(column for column in RESPONSES if column != response) + ("code_insee",)
+
+
+def design_matrix(data, response=RESPONSE, dropped_columns=DROPPED_COLUMNS):
+    """
+    Explanatory variables (with a leading "const" column) and response of the
+    model, in float64; categorical columns enter as drop-first dummies.
+    """
+    data_for_regression = data.drop(columns=list(dropped_columns))
+    X = expand_categoricals(data_for_regression.drop(columns=[response])).astype(np.float64)
+    X.insert(0, "const", 1.0)
+    return X, data_for_regression[response].astype(np.float64)
+
+
+def fit_regression(data, response=RESPONSE, dropped_columns=DROPPED_COLUMNS, significance_level=0.05):
+    """Correlation screening, backward selection and final fit of `response` on the other columns."""
+    # Only needed on a cache miss: scipy and statsmodels are slow to import.
+    from scripts.selection import backward_regression_with_logging
+
+    data_for_regression = expand_categoricals(data.drop(columns=list(dropped_columns)))
+
+    # The screening works block by block and fills the float32 matrix of the heatmap on the way.
+    report_progress(0.1, "matrice de corrélation")
+    with stage("correlation screening", "transform"):
+        columns = list(data_for_regression.columns)
+        correlations = np.empty((len(columns), len(columns)), dtype=np.float32)
+        pairs = correlated_pairs(data_for_regression, CORRELATION_THRESHOLD, out=correlations)
+        # Constant columns have no correlation (NaN, like DataFrame.corr())
+        constant = np.diag(correlations) == 0
+        correlations[constant, :] = np.nan
+        correlations[:, constant] = np.nan
+        correlation_matrix = pd.DataFrame(correlations, index=columns, columns=columns)
+        highly_correlated = list(zip(pairs["variable_1"], pairs["variable_2"]))
+
+    report_progress(0.5, "sélection backward")
+    with stage("backward selection", "fit"):
+        X, y = design_matrix(data, response, dropped_columns)
+        final_model, steps = backward_regression_with_logging(X, y, significance_level=significance_level)
+
+    return {
+        "response": response,
+        "significance_level": significance_level,
+        "correlation_matrix": correlation_matrix,
+        "correlated_pairs": highly_correlated,
+        "steps": steps,
+        "selected": list(final_model.params.index),
+        "params": final_model.params,
+        "bse": final_model.bse,
+        "pvalues": final_model.pvalues,
+        "aic": final_model.aic,
+        "rsquared": final_model.rsquared,
+        "fitted": final_model.fittedvalues.to_numpy(),
+        "resid": final_model.resid.to_numpy(),
+        "summary": final_model.summary().as_text(),
+    }
+
+
+def model_fingerprint(table="final_filtered_data_sample", response=RESPONSE, dropped_columns=DROPPED_COLUMNS,
+                      significance_level=0.05):
+    source = TABLES[table][0]
+    return fingerprint(source, PIPELINE_VERSION, MODEL_VERSION, table, response,
+                       sorted(dropped_columns), float(significance_level))
+
+
+def regression_model(table="final_filtered_data_sample", response=RESPONSE, dropped_columns=DROPPED_COLUMNS,
+                     significance_level=0.05):
+    """The fitted model of fit_regression() on a preprocessed table, loaded from disk when available."""
+    key = model_fingerprint(table, response, dropped_columns, significance_level)
+    return cached_artifact(
+        "model", key,
+        lambda: dict(fit_regression(load_table(table), response, dropped_columns, significance_level), key=key),
+    )
@@ -0,0 +1,186 @@
+"""
+Batch report of the regression analysis, one job per table and response.
+
+    python -m scripts.report                              # every response
+    python -m scripts.report --responses taux_evolution   # a single one
+    python -m scripts.report --output /srv/reports --workers 4 --force
+
+Each job runs the whole analysis of the regression page (correlation
+screening, backward selection, final fit, residual diagnostics and figures)
+and writes it to <output>/<table>/<response>/. The jobs run in parallel
+worker processes. A job whose inputs (source file content, pipeline, model
+and figure versions) have the same fingerprint as in <output>/manifest.json,
+and whose files are intact, is skipped, so a nightly run only redoes what
+changed. The fitted models and figures are also reused from the artifact
+cache. The output contains no timestamp: the same inputs give the same bytes.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.artifacts import fingerprint
+from scripts.design import expand_categoricals
+from scripts.regression import RESPONSES, dropped_columns_for, model_fingerprint, regression_model
+from scripts.utils import ROOT_DIR, load_json, load_table
+from scripts.visualizations import FIGURE_VERSION, model_figure, regression_line
+
+# Bump when the content or layout of a job's output changes.
+REPORT_VERSION = 1
+
+DEFAULT_OUTPUT = ROOT_DIR / "reports"
+DEFAULT_TABLES = ("final_filtered_data_sample",)
+
+# Output file of each figure of scripts/visualizations.py
+FIGURE_FILES = {
+    "correlation_heatmap": "corr_mat.png",
+    "residuals_vs_fitted": "res_vs_fit.png",
+    "residuals_qqplot": "qqplot.png",
+}
+
+
+def job_fingerprint(table, response, significance_level=0.05):
+    return fingerprint(model_fingerprint(table, response, dropped_columns_for(response), significance_level),
+                       FIGURE_VERSION, REPORT_VERSION)
+
+
+def _timeless_summary(summary):
+    # statsmodels stamps the summary with the fit date and time
+    summary = re.sub(r"\w{3}, \d{2} \w{3} \d{4}", lambda m: "-" * len(m.group()), summary)
+    return re.sub(r"\d{2}:\d{2}:\d{2}", "--:--:--", summary)
+
+
+def _csv(frame):
+    return frame.to_csv(index=False, float_format="%.10g", lineterminator="\n").encode()
+
+
+def job_files(table, response, significance_level=0.05):
+    """Content of every output file of a job, as {file name: bytes}."""
+    model = regression_model(table, response, dropped_columns_for(response), significance_level)
+    files = {
+        "summary.txt": _timeless_summary(model["summary"]).encode(),
+        "steps.csv": _csv(pd.DataFrame(
+            [(i, step.action, step.variable, step.aic, step.p_value) for i, step in enumerate(model["steps"], 1)],
+            columns=["step", "action", "variable", "aic", "p_value"],
+        )),
+        "coefficients.csv": _csv(pd.DataFrame({
+            "variable": model["selected"],
+            "coef": model["params"].to_numpy(),
+            "std_err": model["bse"].to_numpy(),
+            "p_value": model["pvalues"].to_numpy(),
+        })),
+        "correlated_pairs.csv": _csv(pd.DataFrame(model["correlated_pairs"], columns=["variable_1", "variable_2"])),
+    }
+    for name, file_name in FIGURE_FILES.items():
+        files[file_name] = model_figure(model, name)
+
+    # Simple regression on the most significant predictor of the final model
+    pvalues = model["pvalues"].drop("const", errors="ignore")
+    if len(pvalues):
+        predictor = pvalues.idxmin()
+        # The predictor can be the dummy of one class of a categorical column
+        data = expand_categoricals(load_table(table))
+        files["regression_line.png"] = regression_line(data[predictor], data[response], predictor, response)
+    return files
+
+
+def _sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def run_job(table, response, output_dir, significance_level=0.05):
+    """Compute a job and write its files; returns its manifest entry."""
+    start = time.perf_counter()
+    job_dir = Path(output_dir) / table / response
+    files = job_files(table, response, significance_level)
+    for name, content in files.items():
+        _write(job_dir / name, content)
+    # Files of an older layout of the job
+    for path in job_dir.glob("*"):
+        if path.is_file() and path.name not in files:
+            path.unlink()
+    return {
+        "table": table,
+        "response": response,
+        "fingerprint": job_fingerprint(table, response, significance_level),
+        "files": {name: _sha256(content) for name, content in sorted(files.items())},
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def is_up_to_date(entry, output_dir, table, response, significance_level=0.05):
+    if not entry or entry.get("fingerprint") != job_fingerprint(table, response, significance_level):
+        return False
+    job_dir = Path(output_dir) / table / response
+    for name, digest in entry.get("files", {}).items():
+        path = job_dir / name
+        if not path.exists() or _sha256(path.read_bytes()) != digest:
+            return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the regression report of each table and response.")
+    parser.add_argument("--tables", nargs="+", default=list(DEFAULT_TABLES), help="preprocessed tables to analyse")
+    parser.add_argument("--responses", nargs="+", default=list(RESPONSES),
+                        help=f"response variables among {', '.join(RESPONSES)} (default: all)")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="output directory (default: reports/)")
+    parser.add_argument("--significance-level", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="rerun every job even if its inputs are unchanged")
+    args = parser.parse_args(argv)
+    unknown = set(args.responses) - set(RESPONSES)
+    if unknown:
+        parser.error(f"unknown responses: {', '.join(sorted(unknown))}")
+
+    manifest_path = args.output / "manifest.json"
+    manifest = load_json(manifest_path) if manifest_path.exists() else {}
+    if manifest.get("report_version") != REPORT_VERSION:
+        manifest = {"report_version": REPORT_VERSION, "jobs": {}}
+    jobs = dict(manifest["jobs"])
+
+    pending = []
+    for table in args.tables:
+        for response in args.responses:
+            job_id = f"{table}/{response}"
+            if not args.force and is_up_to_date(jobs.get(job_id), args.output, table, response,
+                                                 args.significance_level):
+                print(f"{job_id}: up to date")
+            else:
+                pending.append((table, response))
+
+    def record(entry):
+        entry = dict(entry)
+        print(f"{entry['table']}/{entry['response']}: written in {entry.pop('seconds')} s")
+        jobs[f"{entry['table']}/{entry['response']}"] = entry
+
+    workers = max(1, min(args.workers or 1, len(pending)))
+    if workers == 1:
+        for table, response in pending:
+            record(run_job(table, response, args.output, args.significance_level))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_job, table, response, args.output, args.significance_level)
+                       for table, response in pending]
+            for future in futures:
+                record(future.result())
+
+    manifest = {"report_version": REPORT_VERSION, "jobs": dict(sorted(jobs.items()))}
+    _write(manifest_path, (json.dumps(manifest, indent=2, ensure_ascii=False) + "\n").encode())
+
+
+if __name__ == "__main__":
+    main()
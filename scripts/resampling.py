@@ -0,0 +1,236 @@
+"""
+Stability of the backward selection under resampling.
+
+resample_selection() reruns the whole backward elimination on bootstrap
+resamples of the rows and scores the procedure out of sample with repeated
+k-fold cross-validation. A bootstrap resample is a vector
+of row counts w, so a replicate only needs the weighted Gram matrix X'WX; a
+cross-validation fold is the full Gram system minus the Gram system of the
+held-out rows. With the engine of scripts/selection.py a replicate costs a few
+milliseconds.
+
+The replicates are spread over a ProcessPoolExecutor. X and y are copied once
+into multiprocessing.shared_memory blocks that every worker maps when it
+starts, so a task only carries a seed and a list of replicate numbers.
+The workers are spawned, not forked: resampling runs from a job thread of the
+Streamlit server, and forking a threaded process can deadlock the child on a
+lock held by another thread.
+Replicate i always draws from default_rng([seed, i]): the results do not
+depend on the number of workers or on how the replicates are chunked.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from scripts.artifacts import cached_artifact, fingerprint, load_artifact
+from scripts.instrumentation import stage
+from scripts.jobs import report_progress
+from scripts.regression import DROPPED_COLUMNS, RESPONSE, design_matrix, model_fingerprint
+from scripts.selection import GramSystem, backward_elimination
+from scripts.utils import load_table
+
+# Bump when the resampling procedure changes.
+RESAMPLING_VERSION = 1
+
+# Seed offset of the cross-validation splits, so they never reuse a bootstrap stream.
+_CV_STREAM = 1 << 32
+
+# Arrays of the current process: mapped from shared memory in the workers.
+_arrays = {}
+
+
+@dataclass
+class ResamplingResult:
+    names: list
+    selected: np.ndarray  # (n_bootstrap, p) bool: variable kept by each replicate
+    params: np.ndarray  # (n_bootstrap, p) coefficients, NaN when not kept
+    fold_r2: np.ndarray  # R² of each held-out fold
+    cv_r2: float  # out-of-sample R² pooled over the folds of all repeats
+    significance_level: float
+    seed: int
+
+    def selection_frequency(self):
+        """Share of the bootstrap replicates keeping each variable, most stable first."""
+        frequency = pd.Series(self.selected.mean(axis=0), index=self.names, name="frequency")
+        return frequency.sort_values(ascending=False, kind="stable")
+
+    def coefficient_bands(self, level=0.95):
+        """
+        Bootstrap distribution of each coefficient over the replicates that keep
+        the variable: mean, standard deviation and percentile band at `level`.
+        """
+        alpha = (1 - level) / 2
+        rows = []
+        for j, name in enumerate(self.names):
+            values = self.params[self.selected[:, j], j]
+            if len(values) == 0:
+                continue
+            lower, upper = np.quantile(values, [alpha, 1 - alpha])
+            rows.append({"variable": name, "frequency": len(values) / len(self.params), "mean": values.mean(),
+                         "std": values.std(ddof=1) if len(values) > 1 else np.nan, "lower": lower, "upper": upper})
+        return pd.DataFrame(rows).sort_values("frequency", ascending=False, kind="stable", ignore_index=True)
+
+
+def _share(arrays):
+    """Copy arrays into new shared memory blocks; returns the blocks and their descriptions."""
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def _attach(specs, names):
+    # Worker initializer: map the shared arrays without copying them. The
+    # workers share the parent's resource tracker, and the parent unlinks the
+    # blocks once the pool is done.
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _arrays[name] = (block, np.ndarray(shape, np.dtype(dtype), buffer=block.buf))
+    _arrays["names"] = (None, list(names))
+
+
+def _get(name):
+    return _arrays[name][1]
+
+
+def _fit(system, significance_level):
+    result = backward_elimination(system, significance_level=significance_level)
+    return system.index(result.selected), result.params.to_numpy()
+
+
+def _bootstrap_task(seed, replicates, significance_level):
+    X, y, names = _get("X"), _get("y"), _get("names")
+    nobs, ncols = X.shape
+    yy = y * y
+    selected = np.zeros((len(replicates), ncols), dtype=bool)
+    params = np.full((len(replicates), ncols), np.nan)
+    for k, replicate in enumerate(replicates):
+        rng = np.random.default_rng([seed, replicate])
+        weights = np.bincount(rng.integers(0, nobs, nobs), minlength=nobs).astype(np.float64)
+        Xw = X * weights[:, None]
+        system = GramSystem(Xw.T @ X, Xw.T @ y, weights @ yy, nobs, names)
+        columns, coefficients = _fit(system, significance_level)
+        selected[k, columns] = True
+        params[k, columns] = coefficients
+    return replicates, selected, params
+
+
+def _cv_task(seed, repeat, folds, significance_level):
+    X, y, names = _get("X"), _get("y"), _get("names")
+    nobs = len(y)
+    rng = np.random.default_rng([seed, _CV_STREAM + repeat])
+    total = GramSystem.from_arrays(X, y, names)
+    y_sum = y.sum()
+    fold_r2, sse, sst = [], 0.0, 0.0
+    for test in np.array_split(rng.permutation(nobs), folds):
+        train = total - GramSystem.from_arrays(X[test], y[test], names)
+        columns, coefficients = _fit(train, significance_level)
+        residuals = y[test] - X[np.ix_(test, columns)] @ coefficients
+        train_mean = (y_sum - y[test].sum()) / (nobs - len(test))
+        fold_sse = residuals @ residuals
+        fold_r2.append(1 - fold_sse / np.sum((y[test] - y[test].mean()) ** 2))
+        sse += fold_sse
+        sst += np.sum((y[test] - train_mean) ** 2)
+    return fold_r2, sse, sst
+
+
+def _chunks(items, count):
+    return [chunk.tolist() for chunk in np.array_split(np.asarray(items), count) if len(chunk)]
+
+
+def resample_selection(X, y, n_bootstrap=1000, folds=10, cv_repeats=5, significance_level=0.05, seed=0,
+                       workers=None):
+    """
+    Bootstrap the backward elimination of y on X (DataFrame, constant included)
+    `n_bootstrap` times and cross-validate it with `cv_repeats` x `folds`
+    folds, over `workers` processes (default: all cores; 1 runs in-process).
+    """
+    names = list(X.columns)
+    arrays = {"X": np.ascontiguousarray(X.to_numpy(dtype=np.float64)),
+              "y": np.ascontiguousarray(np.asarray(y, dtype=np.float64))}
+    workers = workers or os.cpu_count() or 1
+    # A few chunks per worker balance the load without flooding the queue.
+    chunks = _chunks(np.arange(n_bootstrap), min(n_bootstrap, 4 * workers)) if n_bootstrap else []
+    tasks = len(chunks) + cv_repeats
+
+    def progress(completed):
+        # Reported to the background job running the resampling, if any
+        report_progress(completed / tasks, f"{completed} tâches sur {tasks}")
+
+    if workers == 1:
+        _arrays.update({name: (None, array) for name, array in arrays.items()})
+        _arrays["names"] = (None, names)
+        boot, cv = [], []
+        for chunk in chunks:
+            boot.append(_bootstrap_task(seed, chunk, significance_level))
+            progress(len(boot))
+        for repeat in range(cv_repeats):
+            cv.append(_cv_task(seed, repeat, folds, significance_level))
+            progress(len(boot) + len(cv))
+        _arrays.clear()
+    else:
+        blocks, specs = _share(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_attach,
+                                     initargs=(specs, names)) as pool:
+                boot_futures = [pool.submit(_bootstrap_task, seed, chunk, significance_level) for chunk in chunks]
+                cv_futures = [pool.submit(_cv_task, seed, repeat, folds, significance_level)
+                              for repeat in range(cv_repeats)]
+                for completed, _ in enumerate(as_completed(boot_futures + cv_futures), start=1):
+                    progress(completed)
+                boot = [future.result() for future in boot_futures]
+                cv = [future.result() for future in cv_futures]
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    selected = np.zeros((n_bootstrap, len(names)), dtype=bool)
+    params = np.full((n_bootstrap, len(names)), np.nan)
+    for replicates, chunk_selected, chunk_params in boot:
+        selected[replicates] = chunk_selected
+        params[replicates] = chunk_params
+    sse = sum(part[1] for part in cv)
+    sst = sum(part[2] for part in cv)
+    return ResamplingResult(
+        names=names,
+        selected=selected,
+        params=params,
+        fold_r2=np.array([r2 for part in cv for r2 in part[0]]),
+        cv_r2=1 - sse / sst if sst else np.nan,
+        significance_level=significance_level,
+        seed=seed,
+    )
+
+
+def stability_fingerprint(table="final_filtered_data_sample", response=RESPONSE, dropped_columns=DROPPED_COLUMNS,
+                          significance_level=0.05, n_bootstrap=1000, folds=10, cv_repeats=5, seed=0):
+    return fingerprint(model_fingerprint(table, response, dropped_columns, significance_level),
+                       RESAMPLING_VERSION, n_bootstrap, folds, cv_repeats, seed)
+
+
+def model_stability(table="final_filtered_data_sample", response=RESPONSE, dropped_columns=DROPPED_COLUMNS,
+                    significance_level=0.05, n_bootstrap=1000, folds=10, cv_repeats=5, seed=0, compute=True):
+    """
+    resample_selection() for the model of regression_model() with the same
+    arguments, cached on disk. With compute=False, returns None unless it was
+    already computed.
+    """
+    key = stability_fingerprint(table, response, dropped_columns, significance_level, n_bootstrap, folds,
+                                cv_repeats, seed)
+    if not compute:
+        return load_artifact("stability", key)
+
+    def build():
+        X, y = design_matrix(load_table(table), response, dropped_columns)
+        with stage("bootstrap and cross-validation", "fit"):
+            return resample_selection(X, y, n_bootstrap, folds, cv_repeats, significance_level, seed)
+
+    return cached_artifact("stability", key, build)
@@ -0,0 +1,321 @@
+"""
+Stepwise variable selection for OLS on precomputed sufficient statistics.
+
+The design matrix is reduced once to its Gram matrix X'X, X'y and y'y. Every
+candidate model is then evaluated from the inverse of the active block of X'X:
+dropping a variable is a rank-one downdate of that inverse and adding one is a
+bordering update, both O(p^2), so no step refits the model or copies the data.
+Coefficients, standard errors, p-values and AIC follow the statsmodels OLS
+definitions; statsmodels is only needed to produce the final summary.
+
+Columns that are constant zero or a linear combination of earlier columns are
+aliased: statsmodels gives them a meaningless p-value driven by rounding noise,
+so they are dropped before the selection starts and logged as such.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+# Relative tolerance under which a column is considered aliased.
+ALIAS_TOLERANCE = 1e-10
+
+
+@dataclass
+class Step:
+    """One move of the selection: `action` is "remove", "add" or "aliased"."""
+
+    action: str
+    variable: str
+    aic: float  # AIC of the model before the move
+    p_value: float
+
+
+@dataclass
+class SelectionResult:
+    selected: list
+    params: pd.Series
+    bse: pd.Series
+    pvalues: pd.Series
+    aic: float
+    rss: float
+    df_resid: float
+    nobs: int
+    steps: list = field(default_factory=list)
+
+
+class GramSystem:
+    """
+    Sufficient statistics of an OLS problem: X'X, X'y, y'y and the number of
+    observations. Columns are equilibrated to unit diagonal for numerical
+    stability; results are reported on the original scale.
+    """
+
+    def __init__(self, xtx, xty, yty, nobs, names):
+        self.xtx = np.asarray(xtx, dtype=np.float64)
+        self.xty = np.asarray(xty, dtype=np.float64)
+        self.yty = float(yty)
+        self.nobs = int(nobs)
+        self.names = list(names)
+
+        diag = np.diag(self.xtx)
+        self.zero = diag <= 0
+        self.scale = np.where(self.zero, 1.0, 1.0 / np.sqrt(np.where(self.zero, 1.0, diag)))
+        self._g = self.xtx * np.outer(self.scale, self.scale)
+        self._gy = self.xty * self.scale
+
+    @classmethod
+    def from_arrays(cls, X, y, names=None):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        names = names if names is not None else [f"x{i}" for i in range(X.shape[1])]
+        return cls(X.T @ X, X.T @ y, y @ y, len(y), names)
+
+    @classmethod
+    def from_frame(cls, X, y):
+        return cls.from_arrays(X.to_numpy(dtype=np.float64), np.asarray(y, dtype=np.float64), X.columns)
+
+    def __add__(self, other):
+        return GramSystem(self.xtx + other.xtx, self.xty + other.xty, self.yty + other.yty,
+                          self.nobs + other.nobs, self.names)
+
+    def __sub__(self, other):
+        return GramSystem(self.xtx - other.xtx, self.xty - other.xty, self.yty - other.yty,
+                          self.nobs - other.nobs, self.names)
+
+    def index(self, names):
+        positions = {name: i for i, name in enumerate(self.names)}
+        return [positions[name] for name in names]
+
+
+class _ActiveSet:
+    """Inverse of the equilibrated Gram block of the active columns, kept up to date."""
+
+    def __init__(self, system):
+        self.system = system
+        self.columns = []
+        self.inverse = np.zeros((0, 0))
+
+    def schur(self, candidate):
+        g = self.system._g
+        a = g[self.columns, candidate]
+        u = self.inverse @ a
+        return g[candidate, candidate] - a @ u, u
+
+    def add(self, candidate):
+        """Bordering update; returns False (and leaves the set unchanged) if the column is aliased."""
+        if self.system.zero[candidate]:
+            return False
+        s, u = self.schur(candidate)
+        if s <= ALIAS_TOLERANCE * self.system._g[candidate, candidate]:
+            return False
+        k = len(self.columns)
+        inverse = np.empty((k + 1, k + 1))
+        inverse[:k, :k] = self.inverse + np.outer(u, u) / s
+        inverse[:k, k] = inverse[k, :k] = -u / s
+        inverse[k, k] = 1.0 / s
+        self.inverse = inverse
+        self.columns.append(candidate)
+        return True
+
+    def remove(self, position):
+        """Rank-one downdate of the inverse when the column at `position` leaves the set."""
+        keep = np.arange(len(self.columns)) != position
+        pivot = self.inverse[position, position]
+        border = self.inverse[keep, position]
+        self.inverse = self.inverse[np.ix_(keep, keep)] - np.outer(border, border) / pivot
+        del self.columns[position]
+
+    def fit(self):
+        system = self.system
+        beta = self.inverse @ system._gy[self.columns]
+        rss = max(system.yty - beta @ system._gy[self.columns], 0.0)
+        df_resid = system.nobs - len(self.columns)
+        sigma2 = rss / df_resid
+        se = np.sqrt(sigma2 * np.diag(self.inverse))
+        t = beta / se
+        p_values = _t_pvalues(t, df_resid)
+        return beta, se, p_values, rss, df_resid
+
+    def rss(self):
+        gy = self.system._gy[self.columns]
+        return max(self.system.yty - (self.inverse @ gy) @ gy, 0.0)
+
+    def aic(self, rss=None, k=None):
+        system = self.system
+        rss = rss if rss is not None else self.rss()
+        k = k if k is not None else len(self.columns)
+        return _aic(rss, system.nobs, k)
+
+    def result(self, steps):
+        system = self.system
+        beta, se, p_values, rss, df_resid = self.fit()
+        scale = system.scale[self.columns]
+        names = [system.names[i] for i in self.columns]
+        return SelectionResult(
+            selected=names,
+            params=pd.Series(beta * scale, index=names),
+            bse=pd.Series(se * scale, index=names),
+            pvalues=pd.Series(p_values, index=names),
+            aic=_aic(rss, system.nobs, len(self.columns)),
+            rss=rss,
+            df_resid=df_resid,
+            nobs=system.nobs,
+            steps=steps,
+        )
+
+
+def _t_pvalues(t, df):
+    # Two-sided Student p-values; scipy.stats.t.sf without its argument checking overhead
+    return 2 * special.stdtr(df, -np.abs(t))
+
+
+def _aic(rss, nobs, k):
+    # statsmodels: aic = -2 llf + 2 rank, with the Gaussian log-likelihood at the MLE of sigma
+    llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(rss / nobs) + 1)
+    return -2 * llf + 2 * k
+
+
+def _start(system, variables, steps):
+    active = _ActiveSet(system)
+    for i in system.index(variables):
+        if not active.add(i):
+            steps.append(Step("aliased", system.names[i], np.nan, np.nan))
+    return active
+
+
+def _drop_candidate(active, criterion, significance_level, keep):
+    # Index in the active set of the variable to remove, or None to stop.
+    beta, _, p_values, rss, _ = active.fit()
+    removable = np.array([active.system.names[i] not in keep for i in active.columns])
+    if not removable.any():
+        return None, p_values
+    if criterion == "pvalue":
+        masked = np.where(removable & ~np.isnan(p_values), p_values, -np.inf)
+        position = int(np.argmax(masked))
+        return (position if masked[position] > significance_level else None), p_values
+    # Removing column j raises the RSS by beta_j^2 / inv_jj.
+    new_rss = rss + beta ** 2 / np.diag(active.inverse)
+    new_aic = _aic(new_rss, active.system.nobs, len(active.columns) - 1)
+    new_aic = np.where(removable, new_aic, np.inf)
+    position = int(np.argmin(new_aic))
+    return (position if new_aic[position] < _aic(rss, active.system.nobs, len(active.columns)) else None), p_values
+
+
+def _add_candidate(active, candidates, criterion, significance_level):
+    # Column index of the variable to add, or None to stop.
+    system = active.system
+    candidates = [c for c in candidates if not system.zero[c]]
+    if not candidates:
+        return None, np.nan
+    g, gy = system._g, system._gy
+    cols = active.columns
+    if cols:
+        beta, _, _, rss, _ = active.fit()
+        U = active.inverse @ g[np.ix_(cols, candidates)]
+        s = np.diag(g)[candidates] - np.sum(g[np.ix_(cols, candidates)] * U, axis=0)
+        num = gy[candidates] - U.T @ gy[cols]
+    else:
+        rss = system.yty
+        s = np.diag(g)[candidates].copy()
+        num = gy[candidates].copy()
+    aliased = s <= ALIAS_TOLERANCE * np.diag(g)[candidates]
+    s = np.where(aliased, np.nan, s)
+    new_rss = rss - num ** 2 / s
+    df_resid = system.nobs - len(cols) - 1
+    t = (num / s) / np.sqrt(new_rss / df_resid / s)
+    p_values = _t_pvalues(t, df_resid)
+    if np.all(np.isnan(p_values)):
+        return None, np.nan
+    if criterion == "pvalue":
+        best = int(np.nanargmin(p_values))
+        if p_values[best] >= significance_level:
+            return None, p_values[best]
+    else:
+        new_aic = _aic(new_rss, system.nobs, len(cols) + 1)
+        best = int(np.nanargmin(new_aic))
+        if not new_aic[best] < _aic(rss, system.nobs, len(cols)):
+            return None, p_values[best]
+    return candidates[best], p_values[best]
+
+
+def backward_elimination(system, variables=None, significance_level=0.05, criterion="pvalue", keep=()):
+    """
+    Start from `variables` (default: all columns) and repeatedly remove the
+    variable with the largest p-value above `significance_level` (or, with
+    criterion="aic", the removal that lowers the AIC most).
+    """
+    steps = []
+    active = _start(system, variables if variables is not None else system.names, steps)
+    while True:
+        aic = active.aic()
+        position, p_values = _drop_candidate(active, criterion, significance_level, set(keep))
+        if position is None:
+            break
+        steps.append(Step("remove", system.names[active.columns[position]], aic, p_values[position]))
+        active.remove(position)
+    return active.result(steps)
+
+
+def forward_selection(system, variables=None, significance_level=0.05, criterion="pvalue", keep=("const",)):
+    """
+    Start from `keep` and repeatedly add the candidate with the smallest p-value
+    below `significance_level` (or, with criterion="aic", the one that lowers
+    the AIC most).
+    """
+    variables = variables if variables is not None else system.names
+    steps = []
+    active = _start(system, [name for name in keep if name in system.names], steps)
+    candidates = [i for i in system.index(variables) if i not in active.columns]
+    while candidates:
+        aic = active.aic() if active.columns else np.nan
+        candidate, p_value = _add_candidate(active, candidates, criterion, significance_level)
+        if candidate is None or not active.add(candidate):
+            break
+        steps.append(Step("add", system.names[candidate], aic, p_value))
+        candidates.remove(candidate)
+    return active.result(steps)
+
+
+def stepwise_selection(system, variables=None, significance_level=0.05, significance_level_out=0.10,
+                       criterion="pvalue", keep=("const",), max_steps=1000):
+    """
+    Bidirectional selection: after each addition, remove any variable whose
+    p-value rose above `significance_level_out`. The exit threshold must be
+    larger than the entry threshold to avoid cycling.
+    """
+    variables = variables if variables is not None else system.names
+    steps = []
+    active = _start(system, [name for name in keep if name in system.names], steps)
+    candidates = [i for i in system.index(variables) if i not in active.columns]
+    for _ in range(max_steps):
+        aic = active.aic() if active.columns else np.nan
+        candidate, p_value = _add_candidate(active, candidates, criterion, significance_level)
+        if candidate is None or not active.add(candidate):
+            break
+        steps.append(Step("add", system.names[candidate], aic, p_value))
+        candidates.remove(candidate)
+        while True:
+            aic = active.aic()
+            position, p_values = _drop_candidate(active, criterion, significance_level_out, set(keep))
+            if position is None:
+                break
+            removed = active.columns[position]
+            steps.append(Step("remove", system.names[removed], aic, p_values[position]))
+            active.remove(position)
+            candidates.append(removed)
+    return active.result(steps)
+
+
+def backward_regression_with_logging(X, y, significance_level=0.05):
+    """
+    Backward elimination on the DataFrame X (constant included), as used by the
+    regression page and the report script. Returns the statsmodels fit of the
+    selected model and the list of removal steps.
+    """
+    import statsmodels.api as sm
+
+    result = backward_elimination(GramSystem.from_frame(X, y), significance_level=significance_level)
+    model = sm.OLS(y, X[result.selected]).fit()
+    return model, result.steps
@@ -0,0 +1,184 @@
+"""
+Communes most similar to a given one over the indicators of etude_2_cas.
+
+Every commune is a point in a standardized feature space: income, age
+shares, services and sports equipment, the counts taken as log(1 + n) so
+that a few large cities do not set the scale, each feature centred and
+divided by its standard deviation. Missing values are replaced by the
+median of their feature. A scikit-learn KDTree over the 35 000 points is
+built once per version of the table and cached on disk as the "similarity"
+artifact; a query takes a few milliseconds.
+
+Searches can be restricted to PVD or non-PVD communes and to a population
+band. A restriction keeping few communes is scanned directly; otherwise the
+tree is asked for more neighbours until enough of them pass. matched_pair()
+proposes the twin of a commune on the other side of the PVD programme, as
+the hand-picked Saint-Clément-de-Rivière / La Grand-Combe pair of the study.
+"""
+import numpy as np
+import pandas as pd
+
+from scripts.artifacts import cached_artifact, fingerprint
+from scripts.preprocess import PIPELINE_VERSION, TABLES
+from scripts.queries import pvd_codes
+from scripts.utils import load_table
+
+# Bump when the features or their scaling change.
+SIMILARITY_VERSION = 1
+
+POPULATION = "Population au dernier recensement 2021"
+RATIO_FEATURES = [
+    "Médiane du revenu disponible par UC 2020",
+    "Part des moins de 15 ans 2021",
+    "Part des 15-29 ans 2021",
+    "Part des 30-44 ans 2021",
+    "Part des 45-59 ans 2021",
+    "Part des 60-74 ans 2021",
+    "Taux d'équipements sportifs pour 1 000 habitants 2023",
+]
+COUNT_FEATURES = [
+    "Nombre d'équipements sportifs 2023",
+    "Nombre grandes surfaces 2023",
+    "Nombre de supérettes et épiceries",
+    "Nombre boulangeries et pâtisseries",
+    "Nombre écoles primaires maternelles élémentaires",
+    "Nombre de collèges",
+    "Nombre de lycées",
+    "Nombre de médecins généralistes",
+    "Nombre de dentistes",
+    "Nombre de pharmacies",
+]
+FEATURES = RATIO_FEATURES + COUNT_FEATURES
+
+# A filtered search keeping at most this share of the communes scans them directly.
+BRUTE_FORCE_SHARE = 0.05
+
+# Population band of matched_pair(): from half to twice the population of the commune.
+POPULATION_RATIO = 2.0
+
+
+def standardized_features(frame, features, log_features):
+    """
+    Columns `features` of `frame` as a float64 matrix, the `log_features` taken
+    as log(1 + n), missing values replaced by the median and every column
+    centred and divided by its standard deviation: (matrix, center, scale).
+    """
+    values = frame[features].to_numpy(dtype=np.float64)
+    logs = [j for j, column in enumerate(features) if column in log_features]
+    values[:, logs] = np.log1p(np.maximum(values[:, logs], 0))
+    values = np.where(np.isnan(values), np.nanmedian(values, axis=0), values)
+    center = values.mean(axis=0)
+    scale = values.std(axis=0)
+    scale[scale == 0] = 1.0
+    return (values - center) / scale, center, scale
+
+
+class SimilarityIndex:
+    """Standardized features of the communes of etude_2_cas and their KDTree, in table order."""
+
+    def __init__(self, codes, labels, population, features, center, scale, matrix):
+        from sklearn.neighbors import KDTree
+
+        self.codes = pd.Index(codes)
+        self.labels = np.asarray(labels, dtype=object)
+        self.population = np.asarray(population, dtype=np.float64)
+        self.features = list(features)
+        self.center = center
+        self.scale = scale
+        self.matrix = matrix
+        self.tree = KDTree(matrix)
+        self._pvd = None
+
+    @classmethod
+    def from_frame(cls, frame, features=FEATURES, code_column="Code", label_column="Libellé"):
+        matrix, center, scale = standardized_features(frame, features, COUNT_FEATURES)
+        return cls(frame[code_column].astype(str), frame[label_column], frame[POPULATION],
+                   features, center, scale, matrix)
+
+    def pvd_mask(self):
+        """Whether each commune is in the PVD programme, recomputed when the PVD table changes."""
+        codes = pvd_codes()
+        if self._pvd is None or self._pvd[0] is not codes:
+            self._pvd = (codes, self.codes.isin(list(codes)))
+        return self._pvd[1]
+
+    def rows(self, codes):
+        """Positions of the INSEE codes `codes`, -1 when unknown."""
+        return self.codes.get_indexer([str(code).strip().zfill(5) for code in codes])
+
+    def candidates(self, pvd=None, population=None):
+        """
+        Mask of the communes passing the filters, None without filter: `pvd`
+        True/False keeps PVD/non-PVD communes, `population` = (min, max) with
+        None for an open end.
+        """
+        mask = None
+        if pvd is not None:
+            mask = self.pvd_mask() == pvd
+        if population is not None:
+            low, high = population
+            band = np.ones(len(self.codes), dtype=bool)
+            if low is not None:
+                band &= self.population >= low
+            if high is not None:
+                band &= self.population <= high
+            mask = band if mask is None else mask & band
+        return mask
+
+    def neighbours(self, row, k=10, allowed=None):
+        """Rows and distances of the `k` communes nearest to `row`, itself excluded, within `allowed`."""
+        point = self.matrix[row:row + 1]
+        total = len(self.matrix)
+        if allowed is not None:
+            allowed = allowed.copy()
+            allowed[row] = False
+            if allowed.sum() <= BRUTE_FORCE_SHARE * total:
+                rows = np.flatnonzero(allowed)
+                distances = np.sqrt(((self.matrix[rows] - point) ** 2).sum(axis=1))
+                order = np.argsort(distances, kind="stable")[:k]
+                return rows[order], distances[order]
+
+        wanted = k + 1
+        while True:
+            distances, rows = self.tree.query(point, k=min(wanted, total))
+            distances, rows = distances[0], rows[0]
+            keep = rows != row if allowed is None else allowed[rows]
+            if keep.sum() >= k or wanted >= total:
+                return rows[keep][:k], distances[keep][:k]
+            # Too few of the nearest communes pass the filters: look further
+            wanted *= 4
+
+    def similar(self, code, k=10, pvd=None, population=None):
+        """The `k` communes most similar to `code`, nearest first, as a DataFrame."""
+        row = self.rows([code])[0]
+        if row < 0:
+            raise KeyError(code)
+        rows, distances = self.neighbours(row, k, self.candidates(pvd, population))
+        return pd.DataFrame({
+            "Code": self.codes[rows],
+            "Libellé": self.labels[rows],
+            "Distance": distances,
+            POPULATION: self.population[rows],
+            "PVD": self.pvd_mask()[rows],
+        })
+
+    def matched_pair(self, code, population_ratio=POPULATION_RATIO):
+        """
+        Nearest commune on the other side of the PVD programme with a comparable
+        population (within a factor `population_ratio`); None if there is none.
+        """
+        row = self.rows([code])[0]
+        if row < 0:
+            raise KeyError(code)
+        population = self.population[row]
+        band = None
+        if np.isfinite(population) and population > 0:
+            band = (population / population_ratio, population * population_ratio)
+        match = self.similar(code, k=1, pvd=not self.pvd_mask()[row], population=band)
+        return None if match.empty else match.iloc[0]
+
+
+def similarity_index(table="etude_2_cas"):
+    """SimilarityIndex of `table`, built once per version of its source and kept on disk."""
+    key = fingerprint(TABLES[table][0], PIPELINE_VERSION, SIMILARITY_VERSION, FEATURES)
+    return cached_artifact("similarity", key, lambda: SimilarityIndex.from_frame(load_table(table)))
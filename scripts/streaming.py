@@ -0,0 +1,188 @@
+"""
+Bounded-memory ingestion of large commune exports.
+
+    python -m scripts.streaming data/etude_complete.csv
+    python -m scripts.streaming data/etude_complete.csv --response "Médiane du revenu disponible par UC 2020"
+
+The Observatoire des territoires exports can be far larger than
+etude_2_cas.csv. Here the semicolon-separated latin-1 source is read in
+blocks of `chunk_rows` rows; each block is parsed with the same rules as the
+preprocessing (preprocess.parse_etude_2_cas) and handed to running
+aggregates, then dropped, so memory depends on the block size and on the
+number of columns but not on the number of rows:
+
+- RunningMoments: count, mean, standard deviation, min and max per column,
+  merged block by block with the pairwise update of Chan, Golub and LeVeque;
+- GramAccumulator: X'X, X'y and y'y of the complete rows, summed into a
+  selection.GramSystem, on which the backward selection of scripts/selection.py
+  runs without the table ever being materialized.
+
+Memory grows with the square of the number of predictors (the Gram matrix)
+and linearly with the block size.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from scripts.instrumentation import stage
+from scripts.preprocess import ETUDE_2_CAS_RENAMES, parse_etude_2_cas
+from scripts.selection import GramSystem, backward_elimination
+from scripts.utils import ETUDE_2_CAS_PATH
+
+# Rows per block: about 20 MB of parsed float64 for the 18 indicators.
+CHUNK_ROWS = 100_000
+
+
+def iter_chunks(path=ETUDE_2_CAS_PATH, chunk_rows=CHUNK_ROWS, columns=None, sep=";", encoding="latin1",
+                parse=parse_etude_2_cas):
+    """
+    Parsed blocks of at most `chunk_rows` rows of the file at `path`. Only
+    `columns` (clean names, all by default) are read from the file.
+    """
+    usecols = None
+    if columns is not None:
+        raw_names = {clean: raw for raw, clean in ETUDE_2_CAS_RENAMES.items()}
+        # A callable rather than the set itself: a name absent from the file is skipped, not an error
+        usecols = {raw_names.get(column, column) for column in columns}.__contains__
+    reader = pd.read_csv(path, sep=sep, encoding=encoding, dtype=str, usecols=usecols, chunksize=chunk_rows)
+    with reader:
+        for chunk in reader:
+            with stage(f"parse {len(chunk)} rows", "load"):
+                yield parse(chunk)
+
+
+class RunningMoments:
+    """Count, mean, variance, min and max of numeric columns, missing values skipped."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        width = len(self.columns)
+        self.count = np.zeros(width)
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)  # sum of squared deviations from the mean
+        self.min = np.full(width, np.inf)
+        self.max = np.full(width, -np.inf)
+
+    def _merge(self, count, mean, m2, low, high):
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = np.where(total > 0, count / total, 0.0)
+        self.mean = self.mean + delta * share
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * share
+        self.count = total
+        self.min = np.fmin(self.min, low)
+        self.max = np.fmax(self.max, high)
+
+    def update(self, frame):
+        values = frame[self.columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        count = present.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / count, 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+        low = np.where(present, values, np.inf).min(axis=0, initial=np.inf)
+        high = np.where(present, values, -np.inf).max(axis=0, initial=-np.inf)
+        self._merge(count, mean, m2, low, high)
+        return self
+
+    def __add__(self, other):
+        merged = RunningMoments(self.columns)
+        merged._merge(self.count, self.mean, self.m2, self.min, self.max)
+        merged._merge(other.count, other.mean, other.m2, other.min, other.max)
+        return merged
+
+    def summary(self):
+        """count, mean, std (ddof=1), min and max of each column, as DataFrame.describe() gives them."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(np.where(self.count > 1, self.m2 / (self.count - 1), np.nan))
+        empty = self.count == 0
+        return pd.DataFrame({
+            "count": self.count.astype(np.int64),
+            "mean": np.where(empty, np.nan, self.mean),
+            "std": std,
+            "min": np.where(empty, np.nan, self.min),
+            "max": np.where(empty, np.nan, self.max),
+        }, index=self.columns)
+
+
+class GramAccumulator:
+    """
+    Sufficient statistics of the OLS of `response` on `predictors` (with a
+    leading "const" column), summed over the rows where none of them is missing.
+    """
+
+    def __init__(self, response, predictors, add_constant=True):
+        self.response = response
+        self.predictors = list(predictors)
+        self.names = (["const"] if add_constant else []) + self.predictors
+        self.add_constant = add_constant
+        width = len(self.names)
+        self.total = GramSystem(np.zeros((width, width)), np.zeros(width), 0.0, 0, self.names)
+        self.skipped = 0  # rows with a missing value
+
+    def update(self, frame):
+        values = frame[[*self.predictors, self.response]].to_numpy(dtype=np.float64)
+        complete = ~np.isnan(values).any(axis=1)
+        self.skipped += int((~complete).sum())
+        values = values[complete]
+        X = values[:, :-1]
+        if self.add_constant:
+            X = np.hstack([np.ones((len(X), 1)), X])
+        self.total = self.total + GramSystem.from_arrays(X, values[:, -1], self.names)
+        return self
+
+    def system(self):
+        return self.total
+
+
+def stream(path=ETUDE_2_CAS_PATH, aggregates=(), chunk_rows=CHUNK_ROWS, columns=None, **read_options):
+    """Feed every block of the file to the update() of each aggregate; returns the number of rows read."""
+    rows = 0
+    for chunk in iter_chunks(path, chunk_rows, columns, **read_options):
+        for aggregate in aggregates:
+            aggregate.update(chunk)
+        rows += len(chunk)
+    return rows
+
+
+def numeric_columns(path=ETUDE_2_CAS_PATH, **read_options):
+    """Indicator columns of the file, from its first rows."""
+    head = next(iter_chunks(path, chunk_rows=100, **read_options))
+    return [column for column in head.columns if pd.api.types.is_numeric_dtype(head[column])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a commune export, and optionally fit an OLS model, "
+                                                 "in bounded memory.")
+    parser.add_argument("path", nargs="?", default=str(ETUDE_2_CAS_PATH), help="semicolon-separated latin-1 export")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help=f"rows per block (default: {CHUNK_ROWS})")
+    parser.add_argument("--response", help="column to regress on the other indicators (backward selection)")
+    parser.add_argument("--significance-level", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    columns = numeric_columns(args.path)
+    if args.response is not None and args.response not in columns:
+        parser.error(f"unknown response {args.response!r}")
+    moments = RunningMoments(columns)
+    aggregates = [moments]
+    if args.response is not None:
+        gram = GramAccumulator(args.response, [column for column in columns if column != args.response])
+        aggregates.append(gram)
+
+    rows = stream(args.path, aggregates, args.chunk_rows)
+    print(f"{rows} rows")
+    with pd.option_context("display.width", 160, "display.max_columns", None):
+        print(moments.summary().to_string(float_format=lambda value: f"{value:.6g}"))
+        if args.response is not None:
+            system = gram.system()
+            result = backward_elimination(system, significance_level=args.significance_level)
+            print(f"\n{args.response}: {system.nobs} complete rows ({gram.skipped} skipped), "
+                  f"R² {1 - result.rss / (system.yty - system.xty[0] ** 2 / system.nobs):.4f}")
+            print(pd.DataFrame({"coef": result.params, "std_err": result.bse, "p_value": result.pvalues})
+                  .to_string(float_format=lambda value: f"{value:.6g}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,355 @@
-# This file is for creating functions accessible in the app
\ No newline at end of file
+"""
+Shared data access for the Streamlit pages and the analysis scripts.
+
+Every table is parsed once per process and kept in a memory-bounded LRU cache
+keyed by file path and read options. The file's mtime and size are checked on
+each access, so an edited file is reloaded automatically. Concurrent sessions
+share the same parsed copy: callers receive a shallow view and must treat it
+as read-only. Adding or replacing columns of the view is safe; with pandas 3
+(copy-on-write by default) any write only affects the writer's copy.
+
+The budget can be tuned with the PROJET_DATA_CACHE_MB and
+PROJET_DATA_CACHE_ENTRIES environment variables or with configure_cache().
+Filtered query results (scripts/queries.py) have their own, smaller cache
+(PROJET_DATA_QUERY_CACHE_ENTRIES), so that one query per click cannot evict
+the tables and the indexes built from them.
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scripts.instrumentation import stage
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = ROOT_DIR / "data"
+
+ETUDE_2_CAS_PATH = DATA_DIR / "etude_2_cas.csv"
+REGRESSION_SAMPLE_PATH = DATA_DIR / "final_filtered_data_sample.csv"
+PVD_GEOJSON_PATH = DATA_DIR / "PVD.geojson"
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("PROJET_DATA_CACHE_MB", "512")) * 1024 ** 2)
+DEFAULT_MAX_ENTRIES = int(os.environ.get("PROJET_DATA_CACHE_ENTRIES", "32"))
+QUERY_CACHE_ENTRIES = int(os.environ.get("PROJET_DATA_QUERY_CACHE_ENTRIES", "16"))
+
+class SizedLRUCache:
+    """
+    Thread-safe LRU mapping bounded by total size in bytes and number of entries.
+    Each entry stores a version tag; a lookup with a different version misses.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (version, value, nbytes)
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, nbytes, version=None):
+        with self._lock:
+            self.discard(key)
+            # An entry that alone exceeds the budget is never stored.
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (version, value, nbytes)
+            self._total_bytes += nbytes
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+
+    def clear(self, predicate=None):
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                self.discard(key)
+
+    def configure(self, max_bytes=None, max_entries=None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self._evict()
+
+    def info(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+            or (self.max_entries is not None and len(self._entries) > self.max_entries)
+        ):
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self._total_bytes -= nbytes
+
+
+_table_cache = SizedLRUCache()
+_query_cache = SizedLRUCache(max_bytes=DEFAULT_MAX_BYTES // 8, max_entries=QUERY_CACHE_ENTRIES)
+_load_locks = {}  # key -> [lock, number of threads holding or waiting for it]
+_load_locks_guard = threading.Lock()
+
+
+@contextmanager
+def key_lock(key):
+    """
+    Lock held while `key` is built, so that two sessions asking for the same
+    value at the same time compute it once, while different keys still build
+    in parallel. The lock is dropped when no thread uses it any more.
+    """
+    with _load_locks_guard:
+        entry = _load_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _load_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _load_locks[key]
+
+
+def file_version(path):
+    """Return the (mtime_ns, size) pair used to detect edited files."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def frame_nbytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def object_nbytes(value):
+    """Approximate memory footprint of a cached value."""
+    if isinstance(value, pd.DataFrame):
+        return frame_nbytes(value)
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(object_nbytes(k) + object_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(object_nbytes(v) for v in value)
+    if hasattr(value, "__dict__") and not isinstance(value, type):
+        # Plain objects (engines, indexes...) are as large as their attributes
+        return sum(object_nbytes(v) for v in vars(value).values())
+    return sys.getsizeof(value)
+
+
+def cached_value(key, path, builder, cache=_table_cache):
+    """
+    Return builder() cached under `key` for the current version of the file at
+    `path`, shared across sessions and computed once even under concurrent reruns.
+    """
+    version = file_version(path)
+    value = cache.get(key, version)
+    if value is None:
+        with key_lock(key):
+            version = file_version(path)
+            value = cache.get(key, version)
+            if value is None:
+                value = builder()
+                cache.put(key, value, object_nbytes(value), version)
+    return value
+
+
+def cached_query(key, path, builder):
+    """cached_value() in the cache of filtered query results, kept apart from the tables."""
+    return cached_value(key, path, builder, cache=_query_cache)
+
+
+def load_csv(path, **read_csv_kwargs):
+    """
+    Return the parsed CSV at `path`, shared across sessions.
+    The result is a shallow view of the cached frame.
+    """
+    path = Path(path).resolve()
+    key = ("csv", str(path), repr(sorted(read_csv_kwargs.items())))
+
+    def read():
+        with stage(f"read {path.name}", "load"):
+            return pd.read_csv(path, **read_csv_kwargs)
+
+    return cached_value(key, path, read).copy(deep=False)
+
+
+def load_parquet(path, columns=None):
+    """
+    Return the Parquet file at `path` (optionally only `columns`), shared across sessions.
+    The result is a shallow view of the cached frame.
+    """
+    path = Path(path).resolve()
+    key = ("parquet", str(path), repr(columns))
+
+    def read():
+        with stage(f"read {path.name}", "load"):
+            return pd.read_parquet(path, columns=columns)
+
+    return cached_value(key, path, read).copy(deep=False)
+
+
+def load_table(name, columns=None):
+    """
+    Return a table compiled by scripts/preprocess.py, building it first if the
+    artifact is missing or older than its raw source.
+    """
+    return load_parquet(table_path(name), columns=columns)
+
+
+def table_path(name):
+    """Path of the up-to-date artifact of a preprocessed table."""
+    from scripts.preprocess import ensure_table
+
+    return ensure_table(name)
+
+
+def cached_derived(name, tag, builder):
+    """
+    Return builder(table) for the preprocessed table `name`, computed once per
+    version of the table and shared across sessions like the table itself.
+    """
+    path = table_path(name)
+
+    def build():
+        table = load_parquet(path)
+        with stage(f"{name}: {tag[0] if isinstance(tag, tuple) else tag}", "transform"):
+            return builder(table)
+
+    return cached_value(("derived", str(path), tag), path, build)
+
+
+def load_json(path):
+    """
+    Return the decoded JSON document at `path`, shared across sessions.
+    The object is not copied: callers must not modify it.
+    """
+    path = Path(path).resolve()
+    key = ("json", str(path), "")
+    version = file_version(path)
+
+    document = _table_cache.get(key, version)
+    if document is None:
+        with key_lock(key):
+            version = file_version(path)
+            document = _table_cache.get(key, version)
+            if document is None:
+                with open(path, "r", encoding="utf-8") as f:
+                    document = json.load(f)
+                # Decoded JSON takes several times its size on disk.
+                _table_cache.put(key, document, 4 * version[1], version)
+    return document
+
+
+def load_etude_2_cas():
+    """All French communes with the indicators used by the case study."""
+    return load_table("etude_2_cas")
+
+
+def load_regression_sample():
+    """The 1397 PVD communes with a complete set of regression variables."""
+    return load_table("final_filtered_data_sample")
+
+
+def load_pvd_geojson():
+    """Contours of the communes in the Petites Villes de Demain programme."""
+    return load_json(PVD_GEOJSON_PATH)
+
+
+def commune_index(name="etude_2_cas", code_column="Code"):
+    """
+    Hash index from INSEE code to row position in table `name`, built once per
+    version of the table.
+    """
+    def build(frame):
+        index = pd.Index(frame[code_column].astype(str).to_numpy(), name=code_column)
+        index.get_indexer(index[:1])  # build the hash table now rather than on the first lookup
+        return index
+
+    return cached_derived(name, ("commune_index", code_column), build)
+
+
+def lookup_communes(codes, name="etude_2_cas", code_column="Code"):
+    """Rows of table `name` for the given INSEE codes, in the order given; unknown codes are skipped."""
+    codes = pd.Index([str(code).strip().zfill(5) for code in codes])
+    positions = commune_index(name, code_column).get_indexer(codes)
+    return load_table(name).take(positions[positions >= 0])
+
+
+def commune_labels(name="etude_2_cas", code_column="Code", label_column="Libellé"):
+    """'Libellé (Code)' of every commune, in table order, for the commune pickers."""
+    def build(frame):
+        labels = frame[label_column].astype(str) + " (" + frame[code_column].astype(str) + ")"
+        return labels.tolist()
+
+    return cached_derived(name, ("commune_labels", code_column, label_column), build)
+
+
+def load_pvd_layer(zoom):
+    """Simplified, pre-styled map layer of the PVD communes for a map at `zoom`."""
+    from scripts.geo import level_for_zoom
+    from scripts.preprocess import ensure_table, layer_path
+
+    ensure_table("pvd_communes")
+    return load_json(layer_path(level_for_zoom(zoom)))
+
+
+def pvd_polygon_index():
+    """geo.PolygonIndex of the full-resolution PVD outlines, in the order of the pvd_communes table."""
+    from scripts.geo import PolygonIndex
+
+    def build():
+        geojson = load_pvd_geojson()
+        with stage("PVD polygon index", "transform"):
+            return PolygonIndex.from_geojson(geojson)
+
+    return cached_value(("polygon_index", str(PVD_GEOJSON_PATH.resolve())), PVD_GEOJSON_PATH, build)
+
+
+def configure_cache(max_bytes=None, max_entries=None):
+    """Change the memory budget of the shared cache, evicting entries if needed."""
+    _table_cache.configure(max_bytes=max_bytes, max_entries=max_entries)
+
+
+def clear_cache(path=None):
+    """Drop every cached table, or only those read from `path`."""
+    if path is None:
+        _table_cache.clear()
+        _query_cache.clear()
+    else:
+        path = str(Path(path).resolve())
+        _table_cache.clear(lambda key: key[1] == path)
+        _query_cache.clear(lambda key: key[1] == path)
+
+
+def cache_info():
+    return _table_cache.info()
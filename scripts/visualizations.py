@@ -0,0 +1,109 @@
+"""
+Figures of the regression diagnostics, rendered once per fitted model.
+
+The figures only depend on the model returned by regression_model(), so they
+are drawn off-screen on matplotlib's Agg canvas and stored as PNG bytes under
+the "figure" artifact kind, keyed by the model fingerprint. Pages display the
+bytes with st.image and do not import matplotlib once the figures are cached.
+Figures on disk beyond PROJET_DATA_FIGURE_MB (64 MB by default) are deleted,
+least recently used first; the in-memory copies share the artifact LRU.
+"""
+import io
+import os
+
+import numpy as np
+
+from scripts.artifacts import cached_artifact, fingerprint, prune_artifacts
+from scripts.instrumentation import stage
+
+# Bump when the drawing code changes.
+FIGURE_VERSION = 1
+
+FIGURE_MAX_BYTES = int(float(os.environ.get("PROJET_DATA_FIGURE_MB", "64")) * 1024 ** 2)
+
+# Same rendering as st.pyplot
+DPI = 200
+
+
+def _new_figure(figsize):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    # No pyplot: the figure is never registered with a GUI backend or a global state.
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=DPI, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def correlation_heatmap(model):
+    fig = _new_figure((12, 10))
+    ax = fig.add_subplot()
+    cax = ax.imshow(model["correlation_matrix"].to_numpy(), cmap="coolwarm", interpolation="nearest")
+    fig.colorbar(cax)
+    ax.set_title("Matrice de corrélation des variables")
+    return _png(fig)
+
+
+def residuals_vs_fitted(model):
+    fig = _new_figure((10, 6))
+    ax = fig.add_subplot()
+    ax.scatter(model["fitted"], model["resid"], alpha=0.6)
+    ax.axhline(0, color="red", linestyle="--")
+    ax.set_title("Résidus vs Valeurs ajustées")
+    ax.set_xlabel("Valeurs ajustées")
+    ax.set_ylabel("Résidus")
+    return _png(fig)
+
+
+def residuals_qqplot(model):
+    import statsmodels.api as sm
+
+    fig = _new_figure((6.4, 4.8))
+    sm.qqplot(model["resid"], line="45", fit=True, ax=fig.add_subplot())
+    return _png(fig)
+
+
+def regression_line(x, y, predictor, response):
+    """Scatter of `response` against one predictor with its simple OLS line (PNG bytes, not cached)."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    slope, intercept = np.polyfit(x, y, 1)
+    fig = _new_figure((10, 6))
+    ax = fig.add_subplot()
+    ax.scatter(x, y, alpha=0.6, label="Données")
+    order = np.argsort(x)
+    ax.plot(x[order], intercept + slope * x[order], color="red", label="Droite de régression")
+    ax.set_title(f"Droite de régression : {response} selon {predictor}")
+    ax.set_xlabel(predictor)
+    ax.set_ylabel(response)
+    ax.legend()
+    return _png(fig)
+
+
+FIGURES = {
+    "correlation_heatmap": correlation_heatmap,
+    "residuals_vs_fitted": residuals_vs_fitted,
+    "residuals_qqplot": residuals_qqplot,
+}
+
+
+def model_figure(model, name):
+    """PNG bytes of the figure `name` (a key of FIGURES) for a model of regression_model()."""
+    key = fingerprint(model["key"], name, FIGURE_VERSION, DPI)
+    built = []
+
+    def build():
+        built.append(name)
+        with stage(f"draw {name}", "render"):
+            return FIGURES[name](model)
+
+    png = cached_artifact("figure", key, build)
+    if built:
+        prune_artifacts("figure", FIGURE_MAX_BYTES)
+    return png